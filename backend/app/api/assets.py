@@ -1,9 +1,10 @@
 import os
-import boto3
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response
 from app.core.security import get_current_org
 from app.core.config import get_settings
+from app.services.asset_cache import get_asset_cache, get_asset_key, get_storage_client
+from app.services.receipt_previews import invalidate_receipt_previews
 import tempfile
 from io import BytesIO
 
@@ -11,40 +12,22 @@ router = APIRouter(prefix="/assets", tags=["Assets"])
 
 settings = get_settings()
 
-# Initialize Supabase Storage client (using boto3 for S3 compatibility)
-def get_storage_client():
-    return boto3.client(
-        's3',
-        endpoint_url=settings.SUPABASE_STORAGE_URL,
-        region_name=settings.SUPABASE_STORAGE_REGION,
-        aws_access_key_id=settings.SUPABASE_STORAGE_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.SUPABASE_STORAGE_SECRET_ACCESS_KEY
-    )
-
-def get_asset_key(org_id: str, asset_type: str) -> str:
-    """Generate asset key for Supabase storage"""
-    return f"{org_id}/assets/{asset_type}.png"
+def get_image_media_type(asset_bytes: bytes) -> str:
+    """Uploads may be PNG or JPEG even though the key always ends in .png"""
+    return "image/jpeg" if asset_bytes[:3] == b"\xff\xd8\xff" else "image/png"
 
 @router.get("/logo")
 def get_logo(org_id: str = Depends(get_current_org)):
-    try:
-        s3_client = get_storage_client()
-        asset_key = get_asset_key(org_id, "logo")
-        
-        # Try to get the object from Supabase storage
-        response = s3_client.get_object(
-            Bucket=settings.SUPABASE_STORAGE_BUCKET,
-            Key=asset_key
-        )
-        
-        # Return the file as a streaming response
-        return StreamingResponse(
-            response['Body'],
-            media_type="image/png",
-            headers={"Content-Disposition": f"inline; filename=logo.png"}
-        )
-    except Exception as e:
+    # Served from the asset cache shared with receipt rendering
+    asset_bytes = get_asset_cache().get(org_id, "logo")
+    if not asset_bytes:
         raise HTTPException(status_code=404, detail="Logo not found")
+    
+    return Response(
+        content=asset_bytes,
+        media_type=get_image_media_type(asset_bytes),
+        headers={"Content-Disposition": f"inline; filename=logo.png"}
+    )
 
 @router.post("/logo")
 def upload_logo(file: UploadFile = File(...), org_id: str = Depends(get_current_org)):
@@ -59,37 +42,33 @@ def upload_logo(file: UploadFile = File(...), org_id: str = Depends(get_current_
         file_content = file.file.read()
         
         # Upload to Supabase storage
-        s3_client.put_object(
+        response = s3_client.put_object(
             Bucket=settings.SUPABASE_STORAGE_BUCKET,
             Key=asset_key,
             Body=file_content,
             ContentType=file.content_type
         )
         
+        # Replace the cached copy so the next receipt uses the new logo
+        get_asset_cache().put(org_id, "logo", file_content, response.get("ETag"))
+        invalidate_receipt_previews(org_id)
+        
         return {"detail": "Logo uploaded successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to upload logo: {str(e)}")
 
 @router.get("/signature")
 def get_signature(org_id: str = Depends(get_current_org)):
-    try:
-        s3_client = get_storage_client()
-        asset_key = get_asset_key(org_id, "signature")
-        
-        # Try to get the object from Supabase storage
-        response = s3_client.get_object(
-            Bucket=settings.SUPABASE_STORAGE_BUCKET,
-            Key=asset_key
-        )
-        
-        # Return the file as a streaming response
-        return StreamingResponse(
-            response['Body'],
-            media_type="image/png",
-            headers={"Content-Disposition": f"inline; filename=signature.png"}
-        )
-    except Exception as e:
+    # Served from the asset cache shared with receipt rendering
+    asset_bytes = get_asset_cache().get(org_id, "signature")
+    if not asset_bytes:
         raise HTTPException(status_code=404, detail="Signature not found")
+    
+    return Response(
+        content=asset_bytes,
+        media_type=get_image_media_type(asset_bytes),
+        headers={"Content-Disposition": f"inline; filename=signature.png"}
+    )
 
 @router.post("/signature")
 def upload_signature(file: UploadFile = File(...), org_id: str = Depends(get_current_org)):
@@ -104,13 +83,17 @@ def upload_signature(file: UploadFile = File(...), org_id: str = Depends(get_cur
         file_content = file.file.read()
         
         # Upload to Supabase storage
-        s3_client.put_object(
+        response = s3_client.put_object(
             Bucket=settings.SUPABASE_STORAGE_BUCKET,
             Key=asset_key,
             Body=file_content,
             ContentType=file.content_type
         )
         
+        # Replace the cached copy so the next receipt uses the new signature
+        get_asset_cache().put(org_id, "signature", file_content, response.get("ETag"))
+        invalidate_receipt_previews(org_id)
+        
         return {"detail": "Signature uploaded successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to upload signature: {str(e)}") 
\ No newline at end of file
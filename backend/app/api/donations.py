@@ -8,6 +8,8 @@ import requests
 from app.db.session import get_db
 from app.schemas.donation import DonationResponse, DonationCreate, DonationUpdate
 from app.models.donation import Donation
+from app.models.donor import Donor
+from app.services.email_outbox import commit_queued_email, queue_receipt_email
 from app.core.security import get_current_org
 
 router = APIRouter(prefix="/donations", tags=["Donations"])
@@ -111,7 +113,17 @@ def add_donation(
         whatsapp_sent=data.whatsapp_sent,
     )
     db.add(donation)
-    db.commit()
+    
+    # The receipt email is queued in the same transaction and sent in the background
+    if data.send_receipt:
+        donor = db.query(Donor).filter(Donor.organization_id == org_id, Donor.id == data.donor_id).first()
+        if not donor or not donor.email:
+            db.rollback()
+            raise HTTPException(status_code=400, detail="Donor has no email address to send the receipt to")
+        email = queue_receipt_email(db, donation, donor.email)
+        commit_queued_email(db, email)
+    else:
+        db.commit()
     db.refresh(donation)
     return donation
 
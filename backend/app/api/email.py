@@ -1,5 +1,3 @@
-import os
-import sys
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from app.db.session import get_db
@@ -8,59 +6,19 @@ from app.models.donor import Donor
 from app.models.email_template import OrganizationEmailTemplate
 from app.schemas.email_template import OrganizationEmailTemplateCreate, OrganizationEmailTemplateUpdate, OrganizationEmailTemplateResponse
 from app.core.security import get_current_org
-from fastapi.responses import JSONResponse
-from modules.supabase_utils import get_organization_settings, get_organization_receipt_path
-from modules.email_utils import send_email_receipt
-from datetime import datetime
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import or_
+from modules.supabase_utils import get_organization_settings
+from modules.email_template_cache import invalidate_email_templates
 from typing import List
 
-# Add the template_generate directory to the Python path
-template_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'template_generate')
-sys.path.insert(0, template_dir)
-
-try:
-    from template_generate.render import generate_receipt_pdf
-except ImportError as e:
-    print(f"Warning: Could not import new template system: {e}")
-    # Fallback to old system
-    from modules.pdf_template import generate_receipt
-
-# Helper function for payment details (same as in receipts.py)
-def get_payment_details_display(payment_details, payment_mode):
-    """Extract and format payment details for receipt display"""
-    try:
-        if not payment_details or payment_details == {}:
-            return "N/A"
-        
-        if isinstance(payment_details, dict):
-            # Try to extract meaningful payment info based on payment mode
-            if payment_mode and payment_mode.lower() in ['upi', 'online', 'digital']:
-                # For digital payments, look for transaction ID, UPI ID, etc.
-                for key in ['transaction_id', 'txn_id', 'upi_id', 'ref_number', 'reference']:
-                    if key in payment_details:
-                        return str(payment_details[key])
-            elif payment_mode and payment_mode.lower() in ['cheque', 'check']:
-                # For cheques, look for cheque number
-                for key in ['cheque_number', 'check_number', 'cheque_no']:
-                    if key in payment_details:
-                        return f"Cheque No: {payment_details[key]}"
-            elif payment_mode and payment_mode.lower() in ['neft', 'rtgs', 'bank_transfer']:
-                # For bank transfers, look for reference number
-                for key in ['reference_number', 'ref_no', 'transaction_id']:
-                    if key in payment_details:
-                        return str(payment_details[key])
-            
-            # If no specific field found, return first non-empty value
-            for value in payment_details.values():
-                if value and str(value).strip():
-                    return str(value)
-        
-        # Fallback: convert to string
-        return str(payment_details) if payment_details else "N/A"
-        
-    except Exception as e:
-        print(f"Error processing payment details: {e}")
-        return "N/A"
+from fastapi.concurrency import run_in_threadpool
+from app.core.config import get_settings
+from app.schemas.receipt import ReceiptEmailBulkRequest
+from app.services.receipts import ReceiptEmailError, get_issued_receipt_pdf_async, send_receipt_pdf_email
+from app.services.email_outbox import commit_queued_email, queue_receipt_email
+from app.services.receipt_batch import query_batch_donations
+from app.services.receipt_email_batch import stream_bulk_email_report
 
 # Email template management endpoints (moved to /email-templates)
 email_templates_router = APIRouter(prefix="/email-templates", tags=["EmailTemplates"])
@@ -89,6 +47,7 @@ def create_email_template(
     db.add(new_template)
     db.commit()
     db.refresh(new_template)
+    invalidate_email_templates(org_id)
     return new_template
 
 @email_templates_router.put("/{template_id}", response_model=OrganizationEmailTemplateResponse)
@@ -111,6 +70,7 @@ def update_email_template(
     
     db.commit()
     db.refresh(db_template)
+    invalidate_email_templates(org_id)
     return db_template
 
 @email_templates_router.delete("/{template_id}")
@@ -129,14 +89,55 @@ def delete_email_template(
     
     db.delete(db_template)
     db.commit()
+    invalidate_email_templates(org_id)
     return {"detail": "Email template deleted successfully"}
 
-# Only /receipts/{donation_id}/email remains in the /receipts router
+# Receipt emails (/receipts/{donation_id}/email and /receipts/email/bulk) in the /receipts router
 from app.models.organization import Organization
 receipts_email_router = APIRouter(prefix="/receipts", tags=["Email"])
 
-@receipts_email_router.post("/{donation_id}/email")
-def send_receipt_email(donation_id: str, db: Session = Depends(get_db), org_id: str = Depends(get_current_org)):
+settings = get_settings()
+
+@receipts_email_router.post("/email/bulk")
+def send_receipt_emails_bulk(request: ReceiptEmailBulkRequest, db: Session = Depends(get_db), org_id: str = Depends(get_current_org)):
+    """
+    Email the receipts of every donation not emailed yet, or of those matching
+    the ids / date range / purpose filter. Rendering and sending are pipelined
+    within the SMTP account's rate limits; the response streams an NDJSON line
+    per donation (sent, failed, skipped or deferred) and a summary.
+    """
+    if request.include_sent and not (request.donation_ids or request.start_date or request.end_date or request.purpose):
+        raise HTTPException(status_code=400, detail="Provide donation_ids or a date/purpose filter to send receipts again")
+    
+    from modules.email_utils import get_email_config, validate_email_config
+    
+    email_config = get_email_config(org_id)
+    error_msg = validate_email_config(email_config)
+    if error_msg:
+        raise HTTPException(status_code=400, detail=error_msg)
+    
+    query = query_batch_donations(db, org_id, request.donation_ids, request.start_date, request.end_date, request.purpose)
+    if not request.include_sent:
+        query = query.filter(or_(Donation.email_sent == False, Donation.email_sent.is_(None)))
+    
+    # Load everything up front; the session is closed while the response streams
+    rows = query.order_by(Donation.date).limit(settings.RECEIPT_EMAIL_BULK_MAX_ITEMS + 1).all()
+    if len(rows) > settings.RECEIPT_EMAIL_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Bulk email is limited to {settings.RECEIPT_EMAIL_BULK_MAX_ITEMS} receipts, narrow the filter")
+    if not rows:
+        raise HTTPException(status_code=404, detail="No unsent receipts match the filter")
+    
+    org_settings = get_organization_settings(org_id)
+    return StreamingResponse(
+        stream_bulk_email_report(rows, org_id, org_settings, email_config,
+                                 settings.RECEIPT_EMAIL_BULK_RENDER_CONCURRENCY,
+                                 settings.RECEIPT_EMAIL_BULK_SEND_CONCURRENCY,
+                                 settings.RECEIPT_EMAIL_BULK_MARK_BATCH),
+        media_type="application/x-ndjson"
+    )
+
+def load_receipt_email_context(db: Session, donation_id: str, org_id: str):
+    """Database and settings lookups for a receipt email (blocking, runs in the threadpool)."""
     donation = db.query(Donation).filter(Donation.organization_id == org_id, Donation.id == donation_id).first()
     if not donation:
         raise HTTPException(status_code=404, detail="Donation not found")
@@ -148,105 +149,36 @@ def send_receipt_email(donation_id: str, db: Session = Depends(get_db), org_id:
         raise HTTPException(status_code=404, detail="Organization not found")
     
     org_settings = get_organization_settings(org_id)
-    org_details = org_settings.get('organization', {})
-    receipt_number = donation.receipt_number
-    if not receipt_number:
+    if not donation.receipt_number:
         raise HTTPException(status_code=500, detail="No receipt number found for this donation")
     
-    safe_receipt_number = receipt_number.replace('/', '_')
-    
+    return donation, donor, org_settings
+
+def deliver_receipt_email(db: Session, donation, donor, org_id: str, org_settings: dict, pdf_bytes: bytes):
+    """Send the receipt and mark the donation (blocking, runs in the threadpool)."""
     try:
-        # Use new template system
-        # Prepare data for new template system
-        donor_data = {
-            "name": donor.full_name,
-            "address": donor.address or "Address Not Provided",
-            "phone": donor.phone or "Phone Not Provided", 
-            "email": donor.email or "Email Not Provided",
-            "pan": donor.pan or "N/A"
-        }
-        
-        org_data = org_settings.get('organization', {})
-        
-        donation_data = {
-            "receipt_number": receipt_number,
-            "amount": float(donation.amount),
-            "date": donation.date.strftime("%Y-%m-%d") if hasattr(donation.date, 'strftime') else str(donation.date),
-            "purpose": donation.purpose or "General Fund",
-            "payment_mode": donation.payment_mode or "Online",
-            "payment_details": get_payment_details_display(donation.payment_details, donation.payment_mode)
-        }
-        
-        # Determine donor type - check for Company/Individual
-        donor_type = getattr(donor, 'donor_type', 'Individual')
-        print(f"Debug: Generating email receipt for donor type: {donor_type}")
-        
-        # Generate PDF using new template system
-        pdf_bytes = generate_receipt_pdf(donor_data, org_data, donation_data, donor_type, organization_id=org_id)
-        
-        # Save to temporary file
-        import tempfile
-        temp_dir = tempfile.gettempdir()
-        receipt_path = os.path.join(temp_dir, f"{safe_receipt_number}.pdf")
-        
-        with open(receipt_path, 'wb') as f:
-            f.write(pdf_bytes)
-            
-        print(f"✅ Generated receipt PDF at: {receipt_path}")
-        
-    except Exception as e:
-        print(f"Error generating receipt with new template system: {str(e)}")
-        print(f"Falling back to old system...")
-        
-        # Fallback to old system
-        import tempfile
-        temp_dir = tempfile.gettempdir()
-        receipt_path = os.path.join(temp_dir, f"{safe_receipt_number}.pdf")
-        
-        donor_data_old = {
-            "name": donor.full_name,
-            "amount": float(donation.amount),
-            "date": donation.date.strftime("%Y-%m-%d") if hasattr(donation.date, 'strftime') else str(donation.date),
-            "receipt_number": receipt_number,
-            "purpose": donation.purpose,
-            "payment_mode": donation.payment_mode,
-            "pan": donor.pan or "N/A"
-        }
-        
-        if not os.path.exists(receipt_path):
-            generate_receipt(donor_data_old, receipt_path, organization_id=org_id)
-    
-    if not os.path.exists(receipt_path):
-        raise HTTPException(status_code=500, detail="Failed to generate receipt PDF")
-    
-    # Format donation date for email (DD/MM/YYYY format)
-    donation_date_formatted = donation.date.strftime("%d/%m/%Y") if hasattr(donation.date, 'strftime') else str(donation.date)
-    
-    # Validate SMTP configuration before proceeding
-    from modules.email_utils import get_email_config, validate_email_config
-    email_config = get_email_config(org_id)
-    error_msg = validate_email_config(email_config)
-    if error_msg:
-        raise HTTPException(status_code=400, detail=error_msg)
+        send_receipt_pdf_email(db, donation, donor, org_id, org_settings, pdf_bytes)
+    except ReceiptEmailError as e:
+        raise HTTPException(status_code=400 if e.permanent else 500, detail=str(e))
     
-    # Use organization details from database for email
-    email_sent = send_email_receipt(
-        to_email=donor.email,
-        donor_name=donor.full_name,
-        receipt_path=receipt_path,
-        amount=float(donation.amount),
-        receipt_number=receipt_number,
-        purpose=donation.purpose,
-        payment_mode=donation.payment_mode,
-        org_details=org_details,
-        donation_date=donation_date_formatted,  # Pass the actual donation date
-        organization_id=org_id  # Pass organization ID for email config
-    )
-    if not email_sent:
-        raise HTTPException(status_code=500, detail="Failed to send email receipt")
+    return JSONResponse(content={"detail": "Email sent successfully!"})
+
+def queue_receipt_email_for(db: Session, donation, donor):
+    """Put the receipt email in the outbox (blocking, runs in the threadpool)."""
+    if not donor.email:
+        raise HTTPException(status_code=400, detail="Donor has no email address")
+    email = commit_queued_email(db, queue_receipt_email(db, donation, donor.email))
+    return JSONResponse(status_code=202, content={"detail": "Email queued", "outbox_id": str(email.id)})
+
+@receipts_email_router.post("/{donation_id}/email")
+async def send_receipt_email(donation_id: str, queue: bool = False, db: Session = Depends(get_db), org_id: str = Depends(get_current_org)):
+    """Email a donation's receipt now, or with ?queue=true through the outbox (202, sent in the background)."""
+    # Blocking DB/SMTP work goes to the threadpool; the render itself is awaited
+    donation, donor, org_settings = await run_in_threadpool(load_receipt_email_context, db, donation_id, org_id)
+    if queue:
+        return await run_in_threadpool(queue_receipt_email_for, db, donation, donor)
     
-    # Update donation to mark email as sent
-    donation.email_sent = True
-    db.commit()
+    # The stored receipt when it was downloaded or sent before
+    pdf_bytes = await get_issued_receipt_pdf_async(db, donation, donor, org_id, org_settings)
     
-    return JSONResponse(content={"detail": "Email sent successfully!"}) 
\ No newline at end of file
+    return await run_in_threadpool(deliver_receipt_email, db, donation, donor, org_id, org_settings, pdf_bytes)
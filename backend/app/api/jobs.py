@@ -0,0 +1,47 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from app.db.session import get_db
+from app.models.donation import Donation
+from app.models.receipt_job import ReceiptJob
+from app.core.security import get_current_org
+from app.core.config import get_settings
+from app.schemas.receipt_job import ReceiptJobCreate, ReceiptJobBatchCreate, ReceiptJobResponse, ReceiptJobBatchResponse
+from app.services.receipt_jobs import enqueue_receipt_job
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+settings = get_settings()
+
+@router.post("", status_code=202, response_model=ReceiptJobResponse)
+def create_receipt_job(request: ReceiptJobCreate, db: Session = Depends(get_db), org_id: str = Depends(get_current_org)):
+    """
+    Queue rendering and/or emailing of a donation's receipt. Returns at once
+    with the job; poll GET /jobs/{job_id} for its status.
+    """
+    donation = db.query(Donation.id).filter(Donation.organization_id == org_id, Donation.id == request.donation_id).first()
+    if not donation:
+        raise HTTPException(status_code=404, detail="Donation not found")
+
+    return enqueue_receipt_job(db, org_id, request.donation_id, request.job_type)
+
+@router.post("/batch", status_code=202, response_model=ReceiptJobBatchResponse)
+def create_receipt_jobs(request: ReceiptJobBatchCreate, db: Session = Depends(get_db), org_id: str = Depends(get_current_org)):
+    """Queue the same job for several donations (each deduplicated on its own)."""
+    if not request.donation_ids:
+        raise HTTPException(status_code=400, detail="Provide donation_ids")
+    if len(request.donation_ids) > settings.RECEIPT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch is limited to {settings.RECEIPT_BATCH_MAX_ITEMS} receipts")
+
+    found = db.query(Donation.id).filter(Donation.organization_id == org_id, Donation.id.in_(request.donation_ids)).all()
+    found_ids = {row.id for row in found}
+    jobs = [enqueue_receipt_job(db, org_id, donation_id, request.job_type) for donation_id in dict.fromkeys(request.donation_ids) if donation_id in found_ids]
+    missing_ids = [donation_id for donation_id in request.donation_ids if donation_id not in found_ids]
+    return {"jobs": jobs, "missing_ids": missing_ids}
+
+@router.get("/{job_id}", response_model=ReceiptJobResponse)
+def get_receipt_job(job_id: str, db: Session = Depends(get_db), org_id: str = Depends(get_current_org)):
+    """Status of a receipt job: queued, running, succeeded or failed."""
+    job = db.query(ReceiptJob).filter(ReceiptJob.organization_id == org_id, ReceiptJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
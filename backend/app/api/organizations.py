@@ -4,6 +4,7 @@ from app.db.session import get_db
 from app.schemas.organization import OrganizationResponse, OrganizationUpdate
 from app.models.organization import Organization
 from app.core.security import get_current_org
+from modules.org_settings_cache import invalidate_organization_settings
 
 router = APIRouter(prefix="/organization", tags=["Organization"])
 
@@ -26,5 +27,6 @@ def update_me(
     for field, value in data.dict(exclude_unset=True).items():
         setattr(org, field, value)
     db.commit()
+    invalidate_organization_settings(org_id)
     db.refresh(org)
     return org 
\ No newline at end of file
@@ -1,144 +1,266 @@
-import os
-import sys
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import FileResponse, StreamingResponse
+import re
+from typing import Optional
+from botocore.exceptions import ClientError
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse, RedirectResponse, Response
 from sqlalchemy.orm import Session
 from app.db.session import get_db
 from app.models.donation import Donation
 from app.models.donor import Donor
 from app.core.security import get_current_org
-from modules.supabase_utils import get_organization_settings, get_organization_receipt_path
+from modules.supabase_utils import get_organization_settings
 from datetime import datetime
 from io import BytesIO
 
-# Add the template_generate directory to the Python path
-template_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'template_generate')
-sys.path.insert(0, template_dir)
-
-try:
-    from template_generate.render import generate_receipt_pdf
-except ImportError as e:
-    print(f"Warning: Could not import template system: {e}")
-    # Fallback to old system
-    from modules.pdf_template import generate_receipt_bytes
+from app.core.config import get_settings
+from app.schemas.receipt import ReceiptBatchRequest, StatementBatchRequest
+from fastapi.concurrency import run_in_threadpool
+from app.services.receipts import get_receipt_content_key, get_receipt_pdf_async
+from app.services.receipt_previews import IMAGE_FORMATS, get_receipt_preview
+from app.services.receipt_batch import query_batch_donations, stream_receipt_zip
+from app.services.statements import build_statement_inputs, load_statement_groups, stream_statement_zip
+from template_generate.receipt_document import get_financial_year_dates
+from template_generate.statement import generate_statement_pdf
+from app.services.asset_cache import NOT_FOUND_CODES, NOT_MODIFIED_CODES
+from app.services.receipt_store import get_stored_receipt_key, head_stored_receipt, open_stored_receipt, get_presigned_receipt_url, store_receipt_pdf
 
 router = APIRouter(prefix="/receipts", tags=["Receipts"])
 
-def get_payment_details_display(payment_details, payment_mode):
-    """Extract and format payment details for receipt display"""
+settings = get_settings()
+
+RANGE_RE = re.compile(r"^bytes=(\d+-\d*|-\d+)$")
+STREAM_CHUNK_SIZE = 64 * 1024
+
+@router.post("/batch")
+def get_receipts_batch(request: ReceiptBatchRequest, db: Session = Depends(get_db), org_id: str = Depends(get_current_org)):
+    """
+    Stream a ZIP of receipts for the given donation ids, or for every donation
+    matching the date range / purpose filter. Per-item failures are listed in
+    manifest.json at the end of the archive.
+    """
+    if not (request.donation_ids or request.start_date or request.end_date or request.purpose):
+        raise HTTPException(status_code=400, detail="Provide donation_ids or a date/purpose filter")
+    
+    query = query_batch_donations(db, org_id, request.donation_ids, request.start_date, request.end_date, request.purpose)
+    
+    # Load everything up front; the session is closed while the response streams
+    rows = query.order_by(Donation.date).limit(settings.RECEIPT_BATCH_MAX_ITEMS + 1).all()
+    if len(rows) > settings.RECEIPT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch is limited to {settings.RECEIPT_BATCH_MAX_ITEMS} receipts, narrow the filter")
+    
+    missing_ids = []
+    if request.donation_ids:
+        found_ids = {donation.id for donation, _ in rows}
+        missing_ids = [donation_id for donation_id in request.donation_ids if donation_id not in found_ids]
+    if not rows and not missing_ids:
+        raise HTTPException(status_code=404, detail="No donations match the filter")
+    
+    org_settings = get_organization_settings(org_id)
+    filename = f"receipts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    
+    return StreamingResponse(
+        stream_receipt_zip(rows, org_id, org_settings, settings.RECEIPT_BATCH_CONCURRENCY, missing_ids),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}"
+        }
+    )
+
+@router.get("/preview")
+async def get_receipt_preview_image(request: Request, donor_type: str = "Individual", format: str = "png", width: Optional[int] = None, org_id: str = Depends(get_current_org)):
+    """
+    Thumbnail (PNG or WebP) of page 1 of a sample receipt with the org's
+    current settings, logo and signature. Cached until any of them change.
+    """
+    image_format = format.lower()
+    if image_format not in IMAGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(IMAGE_FORMATS)}")
+    width = width or settings.RECEIPT_PREVIEW_DEFAULT_WIDTH
+    if not 50 <= width <= settings.RECEIPT_PREVIEW_MAX_WIDTH:
+        raise HTTPException(status_code=400, detail=f"width must be between 50 and {settings.RECEIPT_PREVIEW_MAX_WIDTH}")
+    
+    org_settings = await run_in_threadpool(get_organization_settings, org_id)
     try:
-        if not payment_details or payment_details == {}:
-            return "N/A"
-        
-        if isinstance(payment_details, dict):
-            # Try to extract meaningful payment info based on payment mode
-            if payment_mode and payment_mode.lower() in ['upi', 'online', 'digital']:
-                # For digital payments, look for transaction ID, UPI ID, etc.
-                for key in ['transaction_id', 'txn_id', 'upi_id', 'ref_number', 'reference']:
-                    if key in payment_details:
-                        return str(payment_details[key])
-            elif payment_mode and payment_mode.lower() in ['cheque', 'check']:
-                # For cheques, look for cheque number
-                for key in ['cheque_number', 'check_number', 'cheque_no']:
-                    if key in payment_details:
-                        return f"Cheque No: {payment_details[key]}"
-            elif payment_mode and payment_mode.lower() in ['neft', 'rtgs', 'bank_transfer']:
-                # For bank transfers, look for reference number
-                for key in ['reference_number', 'ref_no', 'transaction_id']:
-                    if key in payment_details:
-                        return str(payment_details[key])
-            
-            # If no specific field found, return first non-empty value
-            for value in payment_details.values():
-                if value and str(value).strip():
-                    return str(value)
-        
-        # Fallback: convert to string
-        return str(payment_details) if payment_details else "N/A"
-        
-    except Exception as e:
-        print(f"Error processing payment details: {e}")
-        return "N/A"
+        image_bytes, etag = await run_in_threadpool(get_receipt_preview, org_id, org_settings, donor_type, image_format, width, request.headers.get("if-none-match"))
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=f"Failed to render preview: {e}")
+    
+    # Revalidated on every view: settings can change at any time
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if image_bytes is None:
+        return Response(status_code=304, headers=headers)
+    return Response(content=image_bytes, media_type=IMAGE_FORMATS[image_format], headers=headers)
 
-@router.get("/{donation_id}")
-def get_receipt(donation_id: str, db: Session = Depends(get_db), org_id: str = Depends(get_current_org)):
-    # Get donation
+def parse_financial_year(financial_year):
+    try:
+        return get_financial_year_dates(financial_year)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/statements")
+def get_statements_batch(request: StatementBatchRequest, db: Session = Depends(get_db), org_id: str = Depends(get_current_org)):
+    """
+    Stream a ZIP with one annual statement per donor who gave in the financial
+    year (all donors, or the given donor_ids), listing each of their donations.
+    Per-donor failures are listed in manifest.json at the end of the archive.
+    """
+    financial_year, start, end = parse_financial_year(request.financial_year)
+    
+    # One query for the whole year; the session is closed while the response streams
+    groups = load_statement_groups(db, org_id, start, end, request.donor_ids, limit=settings.RECEIPT_STATEMENT_MAX_DONORS)
+    if len(groups) > settings.RECEIPT_STATEMENT_MAX_DONORS:
+        raise HTTPException(status_code=400, detail=f"Statements are limited to {settings.RECEIPT_STATEMENT_MAX_DONORS} donors per batch, pass donor_ids")
+    if not groups:
+        raise HTTPException(status_code=404, detail=f"No donations in financial year {financial_year}")
+    
+    org_settings = get_organization_settings(org_id)
+    return StreamingResponse(
+        stream_statement_zip(groups, org_id, org_settings, financial_year, start, end, settings.RECEIPT_STATEMENT_CONCURRENCY),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename=statements_{financial_year}.zip"
+        }
+    )
+
+@router.get("/statements/{donor_id}")
+async def get_statement(donor_id: str, financial_year: Optional[str] = None, db: Session = Depends(get_db), org_id: str = Depends(get_current_org)):
+    """Download one donor's statement for a financial year (?financial_year=2024-25, default the current one)."""
+    financial_year, start, end = parse_financial_year(financial_year)
+    groups = await run_in_threadpool(load_statement_groups, db, org_id, start, end, [donor_id])
+    if not groups:
+        raise HTTPException(status_code=404, detail=f"No donations from this donor in financial year {financial_year}")
+    
+    donor, donations = groups[0]
+    org_settings = await run_in_threadpool(get_organization_settings, org_id)
+    donor_data, donation_rows = build_statement_inputs(donor, donations)
+    pdf_bytes = await run_in_threadpool(
+        generate_statement_pdf, donor_data, org_settings.get('organization', {}), donation_rows,
+        financial_year, start, end, org_id, org_settings.get('receipt_engine')
+    )
+    return StreamingResponse(
+        BytesIO(pdf_bytes),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f"attachment; filename=statement_{financial_year}.pdf"}
+    )
+
+def load_donation(db: Session, donation_id: str, org_id: str):
+    """The org's donation with its receipt number (blocking, runs in the threadpool)."""
     donation = db.query(Donation).filter(Donation.organization_id == org_id, Donation.id == donation_id).first()
     if not donation:
         raise HTTPException(status_code=404, detail="Donation not found")
     
-    # Get donor
+    # Use the stored receipt_number
+    if not donation.receipt_number:
+        raise HTTPException(status_code=500, detail="No receipt number found for this donation")
+    
+    return donation
+
+def load_render_context(db: Session, donation, org_id: str):
+    """Donor and org settings needed to render a receipt (blocking, runs in the threadpool)."""
     donor = db.query(Donor).filter(Donor.id == donation.donor_id).first()
     if not donor:
         raise HTTPException(status_code=404, detail="Donor not found")
     
-    # Get org settings
-    org_settings = get_organization_settings(org_id)
+    return donor, get_organization_settings(org_id)
+
+def get_storage_error(e: ClientError):
+    error = e.response.get("Error", {})
+    return str(error.get("Code")), str(e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")), error
+
+def open_stored_receipt_for(request: Request, key: str):
+    """
+    get_object for a download, honouring Range, If-Range and If-None-Match.
+    Returns the storage response, or a Response to send as is (304/416), or
+    None when the object is gone.
+    """
+    byte_range = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if byte_range and not RANGE_RE.match(byte_range):
+        byte_range = None  # not a single byte range; send the whole file
     
-    # Use the stored receipt_number
-    receipt_number = donation.receipt_number
-    if not receipt_number:
-        raise HTTPException(status_code=500, detail="No receipt number found for this donation")
+    try:
+        # If-Range: the range only applies while the file is still the one the client has
+        return open_stored_receipt(key, byte_range, request.headers.get("if-none-match"), if_range if byte_range and if_range else None)
+    except ClientError as e:
+        code, status, error = get_storage_error(e)
+        if code in NOT_MODIFIED_CODES or status == "304":
+            return Response(status_code=304, headers={"ETag": request.headers.get("if-none-match")})
+        if code in NOT_FOUND_CODES or status == "404":
+            return None
+        if code == "PreconditionFailed" or status == "412":
+            return open_stored_receipt(key)
+        if code == "InvalidRange" or status == "416":
+            size = error.get("ActualObjectSize")
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"} if size else {})
+        raise
+
+async def serve_stored_receipt(request: Request, key: str, filename: str, redirect: bool):
+    """Response for a stored receipt, or None when the object is gone and it must be rendered."""
+    if redirect:
+        # Storage serves the bytes (and ranges) itself
+        if await run_in_threadpool(head_stored_receipt, key) is None:
+            return None
+        url = await run_in_threadpool(get_presigned_receipt_url, key, filename)
+        return RedirectResponse(url, status_code=307)
+    
+    stored = await run_in_threadpool(open_stored_receipt_for, request, key)
+    if stored is None or isinstance(stored, Response):
+        return stored
+    
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        "Content-Length": str(stored["ContentLength"]),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=0, must-revalidate",
+    }
+    if stored.get("ETag"):
+        headers["ETag"] = stored["ETag"]
+    if stored.get("ContentRange"):
+        headers["Content-Range"] = stored["ContentRange"]
+    return StreamingResponse(
+        stored["Body"].iter_chunks(STREAM_CHUNK_SIZE),
+        status_code=206 if stored.get("ContentRange") else 200,
+        media_type="application/pdf",
+        headers=headers
+    )
+
+@router.get("/{donation_id}")
+async def get_receipt(donation_id: str, request: Request, regenerate: bool = False, redirect: Optional[bool] = None, db: Session = Depends(get_db), org_id: str = Depends(get_current_org)):
+    """
+    Download a donation's receipt. Once generated it is kept in object storage
+    and served from there (Range/ETag supported, or ?redirect=true for a
+    presigned URL) while the donation, donor and organization details on it
+    are unchanged; otherwise, or with ?regenerate=true, it is rendered and
+    stored again.
+    """
+    # Blocking lookups go to the threadpool; the render itself is awaited so a
+    # slow PDF doesn't hold a worker thread that other routes need
+    donation = await run_in_threadpool(load_donation, db, donation_id, org_id)
     
     # Use a safe filename
-    safe_receipt_number = receipt_number.replace('/', '_')
+    safe_receipt_number = donation.receipt_number.replace('/', '_')
+    filename = f"{safe_receipt_number}.pdf"
     
-    try:
-        # Prepare data for new template system
-        donor_data = {
-            "name": donor.full_name,
-            "address": donor.address or "Address Not Provided",
-            "phone": donor.phone or "Phone Not Provided", 
-            "email": donor.email or "Email Not Provided",
-            "pan": donor.pan or "N/A"
-        }
-        
-        org_data = org_settings.get('organization', {})
-        
-        donation_data = {
-            "receipt_number": receipt_number,
-            "amount": float(donation.amount),
-            "date": donation.date.strftime("%Y-%m-%d") if hasattr(donation.date, 'strftime') else str(donation.date),
-            "purpose": donation.purpose or "General Fund",
-            "payment_mode": donation.payment_mode or "Online",
-            "payment_details": get_payment_details_display(donation.payment_details, donation.payment_mode)
-        }
-        
-        # Determine donor type - check for Company/Individual
-        donor_type = getattr(donor, 'donor_type', 'Individual')
-        print(f"Debug: Generating receipt for donor type: {donor_type}")
-        
-        # Generate PDF using new template system
-        pdf_bytes = generate_receipt_pdf(donor_data, org_data, donation_data, donor_type, organization_id=org_id)
-        
-        return StreamingResponse(
-            BytesIO(pdf_bytes), 
-            media_type="application/pdf", 
-            headers={
-                "Content-Disposition": f"attachment; filename={safe_receipt_number}.pdf"
-            }
-        )
-        
-    except Exception as e:
-        print(f"Error generating receipt with new template system: {str(e)}")
-        print(f"Falling back to old system...")
-        
-        # Fallback to old system
-        donor_data_old = {
-            "name": donor.full_name,
-            "amount": float(donation.amount),
-            "date": donation.date.strftime("%Y-%m-%d") if hasattr(donation.date, 'strftime') else str(donation.date),
-            "receipt_number": receipt_number,
-            "purpose": donation.purpose,
-            "payment_mode": donation.payment_mode,
-            "pan": donor.pan or "N/A"
-        }
-        pdf_bytes = generate_receipt_bytes(donor_data_old, organization_id=org_id)
-        
-        return StreamingResponse(
-            BytesIO(pdf_bytes), 
-            media_type="application/pdf", 
-            headers={
-                "Content-Disposition": f"attachment; filename={safe_receipt_number}.pdf"
-            }
-        ) 
\ No newline at end of file
+    donor, org_settings = await run_in_threadpool(load_render_context, db, donation, org_id)
+    content_key = await run_in_threadpool(get_receipt_content_key, org_id, donation, donor, org_settings)
+    
+    key = None if regenerate else get_stored_receipt_key(org_id, donation, content_key)
+    if key:
+        response = await serve_stored_receipt(request, key, filename, settings.RECEIPT_DOWNLOAD_REDIRECT if redirect is None else redirect)
+        if response is not None:
+            return response
+        print(f"⚠️ Stored receipt {key} is missing, rendering it again")
+    
+    # Served from the receipt cache when nothing that appears on it has changed
+    # (regenerating always renders)
+    pdf_bytes = await get_receipt_pdf_async(donation, donor, org_id, org_settings, use_cache=not regenerate)
+    etag = await run_in_threadpool(store_receipt_pdf, db, donation, org_id, pdf_bytes, content_key)
+    
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    if etag:
+        headers["ETag"] = etag
+    return StreamingResponse(
+        BytesIO(pdf_bytes), 
+        media_type="application/pdf", 
+        headers=headers
+    )
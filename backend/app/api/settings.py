@@ -6,6 +6,8 @@ from app.db.session import get_db
 from app.models.settings import OrganizationSettings
 from app.models.organization import Organization
 from app.core.security import get_current_org
+from app.services.receipt_previews import invalidate_receipt_previews
+from modules.org_settings_cache import invalidate_organization_settings
 
 router = APIRouter(prefix="/settings", tags=["Settings"])
 
@@ -98,6 +100,9 @@ def update_settings(
             )
             db.add(setting)
     db.commit()
+    invalidate_organization_settings(org_id)
+    # Receipt previews of the old settings won't be asked for again
+    invalidate_receipt_previews(org_id)
     # Return updated settings
     return get_settings(db, org_id)
 
@@ -149,4 +154,6 @@ def update_setting_key(key: str, value: Any = Body(...), db: Session = Depends(g
         )
         db.add(setting)
     db.commit()
+    invalidate_organization_settings(org_id)
+    invalidate_receipt_previews(org_id)
     return parse_setting_value(key, serialized_value) 
\ No newline at end of file
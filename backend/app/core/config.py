@@ -26,6 +26,75 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "supersecret"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
+    # Receipt rendering engine: playwright, weasyprint, reportlab or stamp (orgs may override
+    # with the receipt_engine setting). Fallbacks are tried in order when it fails.
+    RECEIPT_ENGINE: str = "playwright"
+    RECEIPT_ENGINE_FALLBACKS: str = "weasyprint,reportlab"
+    RECEIPT_STAMP_BASE_CACHE_SIZE: int = 32  # stamp engine: org base PDFs kept per worker
+    # Receipt rendering (pooled Chromium)
+    RECEIPT_BROWSER_POOL_SIZE: int = 2
+    RECEIPT_BROWSER_MAX_RENDERS: int = 500  # relaunch Chromium after this many renders
+    RECEIPT_BROWSER_MAX_RSS_MB: int = 1536  # relaunch Chromium above this resident memory
+    RECEIPT_READINESS_MODE: str = "deterministic"  # or "legacy" (networkidle + fixed 1s wait)
+    RECEIPT_READINESS_TIMEOUT_MS: int = 5000
+    RECEIPT_SINGLE_DOCUMENT: bool = True  # False: one PDF per page merged with PyPDF2
+    RECEIPT_RENDER_CONCURRENCY: int = 4  # async renders in flight per worker; the rest wait
+    # Render in separate worker processes (0: inside the API process)
+    RECEIPT_RENDER_WORKERS: int = 0
+    RECEIPT_RENDER_WORKER_TIMEOUT: int = 90  # seconds per job before its worker is killed
+    RECEIPT_RENDER_WORKER_MAX_RSS_MB: int = 1024  # replace a worker (with its Chromium) above this
+    # Receipt PDF size: images re-encoded once for print, fonts subset per receipt
+    RECEIPT_PDF_OPTIMIZE: bool = True
+    RECEIPT_PDF_IMAGE_DPI: int = 150  # downsample larger images to this for a full page
+    RECEIPT_PDF_IMAGE_QUALITY: int = 80  # JPEG quality for opaque images
+    RECEIPT_OPTIMIZED_ASSET_DIR: str = ""  # prepared template images (default: system temp dir)
+    # Organization logo/signature cache
+    ASSET_CACHE_MAX_ENTRIES: int = 256
+    ASSET_CACHE_TTL_SECONDS: int = 300  # revalidate with If-None-Match after this long
+    ASSET_CACHE_DIR: str = ""  # optional local disk spill, e.g. /var/cache/deardonor/assets
+    # Issued receipts kept in the Supabase bucket (<org_id>/receipts/...) and served from there
+    RECEIPT_STORAGE_ENABLED: bool = True
+    RECEIPT_DOWNLOAD_REDIRECT: bool = False  # GET /receipts/{id} redirects to a presigned URL
+    RECEIPT_PRESIGNED_URL_SECONDS: int = 300
+    # Generated receipt PDF cache (content-addressed)
+    RECEIPT_CACHE_ENABLED: bool = True
+    RECEIPT_CACHE_MAX_MB: int = 64  # in-memory tier, per worker
+    RECEIPT_CACHE_DIR: str = ""  # optional disk tier shared by workers on one machine
+    RECEIPT_CACHE_DISK_MAX_MB: int = 1024
+    RECEIPT_CACHE_OBJECT_STORAGE: bool = False  # also keep PDFs in the Supabase bucket
+    # GET /receipts/preview thumbnails
+    RECEIPT_PREVIEW_CACHE_MAX_MB: int = 16  # in-memory, per worker
+    RECEIPT_PREVIEW_DEFAULT_WIDTH: int = 800
+    RECEIPT_PREVIEW_MAX_WIDTH: int = 2000
+    # POST /receipts/batch
+    RECEIPT_BATCH_CONCURRENCY: int = 2  # renders in flight; beyond RECEIPT_BROWSER_POOL_SIZE they queue for a page
+    RECEIPT_BATCH_MAX_ITEMS: int = 5000
+    # POST /receipts/statements (annual donor statements)
+    RECEIPT_STATEMENT_CONCURRENCY: int = 4  # documents in flight; they queue for a page or render worker
+    RECEIPT_STATEMENT_MAX_DONORS: int = 20000
+    # Outgoing email limits per sending account, by SMTP host (token buckets, per process)
+    EMAIL_RATE_LIMITS: str = "smtp.gmail.com=20/minute,500/day"
+    EMAIL_DEFAULT_RATE_LIMITS: str = "60/minute"  # hosts not listed above
+    EMAIL_RATE_LIMIT_MAX_WAIT_SECONDS: int = 60  # a send waiting longer for its limit is deferred
+    # POST /receipts/email/bulk
+    RECEIPT_EMAIL_BULK_RENDER_CONCURRENCY: int = 2
+    RECEIPT_EMAIL_BULK_SEND_CONCURRENCY: int = 2  # SMTP sessions in use; see SMTP_POOL_MAX_PER_ACCOUNT
+    RECEIPT_EMAIL_BULK_MAX_ITEMS: int = 5000
+    RECEIPT_EMAIL_BULK_MARK_BATCH: int = 50  # donations marked emailed per database update
+    # Queued receipt jobs (POST /jobs)
+    RECEIPT_JOBS_DISPATCHER: bool = True  # run a dispatcher in each API process
+    RECEIPT_JOB_CONCURRENCY: int = 2  # jobs run at once per dispatcher
+    RECEIPT_JOB_POLL_SECONDS: float = 2.0
+    RECEIPT_JOB_LEASE_SECONDS: int = 300  # a running job is retried after this if its process died
+    RECEIPT_JOB_MAX_ATTEMPTS: int = 5
+    RECEIPT_JOB_BACKOFF_SECONDS: int = 30  # first retry delay, doubling per attempt
+    RECEIPT_JOB_MAX_BACKOFF_SECONDS: int = 3600
+    # Email outbox (emails queued with their donation, sent in the background)
+    EMAIL_OUTBOX_DISPATCHER: bool = True  # run a dispatcher in each API process
+    EMAIL_OUTBOX_CONCURRENCY: int = 2  # emails sent at once per dispatcher
+    EMAIL_OUTBOX_POLL_SECONDS: float = 2.0
+    EMAIL_OUTBOX_LEASE_SECONDS: int = 300  # a claimed email is retried after this if its process died
+    EMAIL_OUTBOX_MAX_ATTEMPTS: int = 8  # retries back off as RECEIPT_JOB_BACKOFF_SECONDS
 
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
@@ -1,7 +1,8 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.core.config import get_settings
-from app.api import auth, organizations, donors, donations, settings as settings_router, assets, export_import, receipts
+from app.api import auth, organizations, donors, donations, settings as settings_router, assets, export_import, receipts, jobs
 from app.api.email import email_templates_router, receipts_email_router
 
 settings = get_settings()
@@ -28,7 +29,94 @@ app.include_router(export_import.router)
 app.include_router(receipts.router)
 app.include_router(email_templates_router)
 app.include_router(receipts_email_router)
+app.include_router(jobs.router)
+
+@app.on_event("startup")
+def start_receipt_browser_pool():
+    # Launch Chromium once so the first receipt doesn't pay for it; with render
+    # workers it runs in those processes instead of this one
+    try:
+        if settings.RECEIPT_RENDER_WORKERS > 0:
+            from template_generate.render_workers import get_render_worker_pool
+            get_render_worker_pool().start()
+        else:
+            from template_generate.browser_pool import get_browser_pool
+            get_browser_pool().start()
+    except Exception as e:
+        print(f"Warning: Could not start receipt browser pool: {e}")
+
+@app.on_event("shutdown")
+def stop_receipt_browser_pool():
+    try:
+        if settings.RECEIPT_RENDER_WORKERS > 0:
+            from template_generate.render_workers import shutdown_render_worker_pool
+            shutdown_render_worker_pool()
+        else:
+            from template_generate.browser_pool import shutdown_browser_pool
+            shutdown_browser_pool()
+    except Exception as e:
+        print(f"Warning: Could not stop receipt browser pool: {e}")
+
+@app.on_event("startup")
+def start_receipt_job_dispatcher():
+    if not settings.RECEIPT_JOBS_DISPATCHER:
+        return
+    try:
+        from app.services.receipt_jobs import get_dispatcher
+        get_dispatcher().start()
+    except Exception as e:
+        print(f"Warning: Could not start receipt job dispatcher: {e}")
+
+@app.on_event("shutdown")
+def stop_receipt_job_dispatcher():
+    try:
+        from app.services.receipt_jobs import get_dispatcher
+        get_dispatcher().stop()
+    except Exception as e:
+        print(f"Warning: Could not stop receipt job dispatcher: {e}")
+
+@app.on_event("startup")
+def start_email_outbox_dispatcher():
+    if not settings.EMAIL_OUTBOX_DISPATCHER:
+        return
+    try:
+        from app.services.email_outbox import get_outbox_dispatcher
+        get_outbox_dispatcher().start()
+    except Exception as e:
+        print(f"Warning: Could not start email outbox dispatcher: {e}")
+
+@app.on_event("shutdown")
+def stop_email_outbox_dispatcher():
+    try:
+        from app.services.email_outbox import get_outbox_dispatcher
+        get_outbox_dispatcher().stop()
+    except Exception as e:
+        print(f"Warning: Could not stop email outbox dispatcher: {e}")
 
 @app.get("/", tags=["Health"])
 def health_check():
-    return {"status": "ok"} 
\ No newline at end of file
+    return {"status": "ok"}
+
+@app.get("/health/render-workers", tags=["Health"])
+def render_workers_health():
+    """Queue depth and per-worker health of the receipt render worker pool."""
+    if settings.RECEIPT_RENDER_WORKERS <= 0:
+        return {"status": "disabled"}
+
+    from template_generate.render_metrics import get_render_metrics
+    from template_generate.render_workers import get_render_worker_pool
+    stats = get_render_worker_pool().stats()
+    if stats["alive_workers"] == 0:
+        status = "down"
+    elif stats["alive_workers"] < stats["size"]:
+        status = "degraded"
+    else:
+        status = "ok"
+    metrics = get_render_metrics()
+    body = {
+        "status": status,
+        **stats,
+        "queue_wait": metrics.get("render_worker_queue"),
+        "render": metrics.get("render_worker_job"),
+    }
+    return JSONResponse(body, status_code=503 if status == "down" else 200) 
\ No newline at end of file
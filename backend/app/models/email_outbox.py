@@ -0,0 +1,32 @@
+from sqlalchemy import Column, Text, DateTime, Integer, ForeignKey, Index, text
+from sqlalchemy.dialects.postgresql import UUID
+from app.models.base import Base
+import uuid
+import datetime
+
+EMAIL_KINDS = ("receipt",)
+PENDING_STATUSES = ("queued", "sending")
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    organization_id = Column(UUID(as_uuid=True), ForeignKey("organizations.id"), nullable=False)
+    donation_id = Column(UUID(as_uuid=True), ForeignKey("donations.id"), nullable=False)
+    kind = Column(Text, nullable=False, default="receipt")
+    to_email = Column(Text, nullable=False)
+    status = Column(Text, nullable=False, default="queued")  # queued, sending, sent, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=8)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)  # not sent before this
+    locked_until = Column(DateTime)  # lease of the dispatcher sending it; reclaimed when it expires
+    locked_by = Column(Text)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('uq_email_outbox_pending', 'donation_id', 'kind', unique=True,
+              postgresql_where=text("status IN ('queued', 'sending')"),
+              sqlite_where=text("status IN ('queued', 'sending')")),
+    )
@@ -0,0 +1,33 @@
+from sqlalchemy import Column, Text, DateTime, Integer, ForeignKey, JSON, Index, text
+from sqlalchemy.dialects.postgresql import UUID
+from app.models.base import Base
+import uuid
+import datetime
+
+JOB_TYPES = ("render", "email", "render+email")
+ACTIVE_STATUSES = ("queued", "running")
+
+class ReceiptJob(Base):
+    __tablename__ = "receipt_jobs"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    organization_id = Column(UUID(as_uuid=True), ForeignKey("organizations.id"), nullable=False)
+    donation_id = Column(UUID(as_uuid=True), ForeignKey("donations.id"), nullable=False)
+    job_type = Column(Text, nullable=False)  # render, email or render+email
+    status = Column(Text, nullable=False, default="queued")  # queued, running, succeeded, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_after = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)  # not picked up before this
+    locked_until = Column(DateTime)  # lease of the dispatcher running it; reclaimed when it expires
+    locked_by = Column(Text)
+    last_error = Column(Text)
+    result = Column(JSON, default={})
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('uq_receipt_jobs_active', 'donation_id', 'job_type', unique=True,
+              postgresql_where=text("status IN ('queued', 'running')"),
+              sqlite_where=text("status IN ('queued', 'running')")),
+    )
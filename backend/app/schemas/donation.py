@@ -16,7 +16,7 @@ class DonationBase(BaseModel):
     whatsapp_sent: Optional[bool] = False
 
 class DonationCreate(DonationBase):
-    pass
+    send_receipt: bool = False  # queue the receipt email in the outbox with the donation
 
 class DonationUpdate(BaseModel):
     amount: Optional[float]
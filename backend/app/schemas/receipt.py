@@ -0,0 +1,20 @@
+from pydantic import BaseModel
+from typing import Optional, List
+from uuid import UUID
+from datetime import datetime
+
+class ReceiptBatchRequest(BaseModel):
+    """Either explicit donation ids, or a date range and/or purpose filter."""
+    donation_ids: Optional[List[UUID]] = None
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    purpose: Optional[str] = None
+
+class ReceiptEmailBulkRequest(ReceiptBatchRequest):
+    """Donations whose receipt was not emailed yet (all of them when no filter is given); include_sent sends again to those that were."""
+    include_sent: bool = False
+
+class StatementBatchRequest(BaseModel):
+    """Annual statements for a financial year ("2024-25"; the current one when omitted), for every donor or the given ones."""
+    financial_year: Optional[str] = None
+    donor_ids: Optional[List[UUID]] = None
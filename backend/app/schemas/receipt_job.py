@@ -0,0 +1,36 @@
+from pydantic import BaseModel
+from typing import Optional, List, Literal
+from uuid import UUID
+from datetime import datetime
+
+ReceiptJobType = Literal["render", "email", "render+email"]
+
+class ReceiptJobCreate(BaseModel):
+    donation_id: UUID
+    job_type: ReceiptJobType = "render"
+
+class ReceiptJobBatchCreate(BaseModel):
+    donation_ids: List[UUID]
+    job_type: ReceiptJobType = "render"
+
+class ReceiptJobResponse(BaseModel):
+    id: UUID
+    donation_id: UUID
+    job_type: str
+    status: str
+    attempts: int
+    max_attempts: int
+    run_after: Optional[datetime]
+    last_error: Optional[str]
+    result: Optional[dict]
+    created_at: Optional[datetime]
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+    deduplicated: bool = False  # an equivalent job was already queued or running
+
+    class Config:
+        orm_mode = True
+
+class ReceiptJobBatchResponse(BaseModel):
+    jobs: List[ReceiptJobResponse]
+    missing_ids: List[UUID] = []
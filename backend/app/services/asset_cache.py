@@ -0,0 +1,314 @@
+"""
+Per-organization cache for receipt assets (logo and signature).
+
+Receipt rendering used to create a new boto3 client and call ``get_object`` for
+both images on every PDF. Assets are now kept in a bounded LRU keyed by
+``(org_id, asset_type)``:
+
+* Fresh entries (younger than the TTL) are served without touching storage.
+* Stale entries are revalidated with ``If-None-Match`` against the stored ETag,
+  so an unchanged asset costs one bodiless request per TTL.
+* Missing assets are cached too, so orgs without a logo don't hit storage on
+  every receipt.
+* Uploads through ``/assets`` replace the entry in this process immediately;
+  other workers pick up the new file on their next revalidation.
+* When ``ASSET_CACHE_DIR`` is set, assets are also written to local disk so a
+  restarted worker starts warm.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import boto3
+from botocore.exceptions import ClientError
+
+from app.core.config import get_settings
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL_SECONDS = 300
+KEY_LOCK_STRIPES = 64
+
+NOT_MODIFIED_CODES = {'304', 'NotModified'}
+NOT_FOUND_CODES = {'404', 'NoSuchKey', 'NotFound'}
+
+
+def get_asset_key(org_id, asset_type):
+    """Storage key of an organization asset."""
+    return f"{org_id}/assets/{asset_type}.png"
+
+
+_storage_client = None
+_storage_client_lock = threading.Lock()
+
+
+def get_storage_client():
+    """Return a shared S3 client for Supabase storage (boto3 clients are thread-safe)."""
+    global _storage_client
+    with _storage_client_lock:
+        if _storage_client is None:
+            settings = get_settings()
+            _storage_client = boto3.client(
+                's3',
+                endpoint_url=settings.SUPABASE_STORAGE_URL,
+                region_name=settings.SUPABASE_STORAGE_REGION,
+                aws_access_key_id=settings.SUPABASE_STORAGE_ACCESS_KEY_ID,
+                aws_secret_access_key=settings.SUPABASE_STORAGE_SECRET_ACCESS_KEY
+            )
+    return _storage_client
+
+
+class AssetCache:
+    """Bounded LRU of organization assets with TTL + ETag revalidation."""
+
+    def __init__(self, bucket, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS, disk_dir=None, client_factory=get_storage_client):
+        self.bucket = bucket
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir or None
+        self.client_factory = client_factory
+
+        # (org_id, asset_type) -> {'data': bytes | None, 'etag': str | None, 'checked_at': float}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Concurrent renders for the same org share a single fetch. Keys are
+        # striped over a fixed set of locks, so this doesn't grow with the orgs seen
+        self._key_locks = [threading.Lock() for _ in range(KEY_LOCK_STRIPES)]
+
+        self._hits = 0
+        self._misses = 0
+        self._revalidations = 0
+        self._not_modified = 0
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def get(self, org_id, asset_type):
+        """Return the asset bytes, or None if the organization has not uploaded one."""
+        key = (str(org_id), asset_type)
+
+        entry = self._get_entry(key)
+        if entry is not None and self._is_fresh(entry):
+            with self._lock:
+                self._hits += 1
+            return entry['data']
+
+        with self._key_lock(key):
+            # Another thread may have refreshed it while we waited
+            entry = self._get_entry(key)
+            if entry is not None and self._is_fresh(entry):
+                with self._lock:
+                    self._hits += 1
+                return entry['data']
+
+            if entry is None:
+                entry = self._load_from_disk(key)
+                if entry is not None:
+                    self._set_entry(key, entry)
+                    if self._is_fresh(entry):
+                        with self._lock:
+                            self._hits += 1
+                        return entry['data']
+
+            entry = self._fetch(key, entry)
+            return entry['data']
+
+    def get_version(self, org_id, asset_type):
+        """
+        Return a short string identifying the current content of an asset
+        ('none' when not uploaded). Used to key caches of rendered receipts.
+        """
+        data = self.get(org_id, asset_type)
+        if data is None:
+            return 'none'
+        entry = self._get_entry((str(org_id), asset_type))
+        if entry is not None and entry.get('etag') and entry['data'] is data:
+            return entry['etag'].strip('"')
+        return hashlib.md5(data).hexdigest()
+
+    def put(self, org_id, asset_type, data, etag=None):
+        """Store a freshly uploaded asset so the next receipt uses it straight away."""
+        key = (str(org_id), asset_type)
+        entry = {'data': data, 'etag': etag, 'checked_at': time.time()}
+        self._set_entry(key, entry)
+        self._write_to_disk(key, entry)
+
+    def invalidate(self, org_id, asset_type=None):
+        """Drop one asset, or every asset of the organization when asset_type is None."""
+        org_id = str(org_id)
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == org_id and (asset_type is None or key[1] == asset_type)]
+            for key in keys:
+                del self._entries[key]
+        if not self.disk_dir:
+            return
+        if asset_type is None:
+            shutil.rmtree(os.path.join(self.disk_dir, org_id), ignore_errors=True)
+            return
+        for path in self._disk_paths((org_id, asset_type)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self._hits,
+                "misses": self._misses,
+                "revalidations": self._revalidations,
+                "not_modified": self._not_modified,
+                "disk_dir": self.disk_dir,
+            }
+
+    # ------------------------------------------------------------------
+    # Storage
+    # ------------------------------------------------------------------
+    def _fetch(self, key, stale_entry):
+        """Fetch (or revalidate) an asset from storage and cache the result."""
+        org_id, asset_type = key
+        asset_key = get_asset_key(org_id, asset_type)
+        params = {'Bucket': self.bucket, 'Key': asset_key}
+        if stale_entry is not None and stale_entry.get('etag'):
+            params['IfNoneMatch'] = stale_entry['etag']
+            with self._lock:
+                self._revalidations += 1
+        else:
+            with self._lock:
+                self._misses += 1
+
+        try:
+            response = self.client_factory().get_object(**params)
+            entry = {'data': response['Body'].read(), 'etag': response.get('ETag'), 'checked_at': time.time()}
+        except ClientError as e:
+            code = str(e.response.get('Error', {}).get('Code'))
+            status = str(e.response.get('ResponseMetadata', {}).get('HTTPStatusCode'))
+            if code in NOT_MODIFIED_CODES or status == '304':
+                with self._lock:
+                    self._not_modified += 1
+                entry = dict(stale_entry, checked_at=time.time())
+            elif code in NOT_FOUND_CODES or status == '404':
+                entry = {'data': None, 'etag': None, 'checked_at': time.time()}
+            else:
+                return self._fetch_failed(key, stale_entry, e)
+        except Exception as e:
+            return self._fetch_failed(key, stale_entry, e)
+
+        self._set_entry(key, entry)
+        self._write_to_disk(key, entry)
+        return entry
+
+    def _fetch_failed(self, key, stale_entry, error):
+        org_id, asset_type = key
+        print(f"Error fetching asset {get_asset_key(org_id, asset_type)}: {error}")
+        if stale_entry is not None:
+            # Storage is unreachable; keep serving what we had
+            print(f"⚠️ Serving cached {asset_type} for {org_id}")
+            return stale_entry
+        # Nothing cached - don't remember the failure so the next receipt retries
+        return {'data': None, 'etag': None, 'checked_at': 0}
+
+    # ------------------------------------------------------------------
+    # Memory LRU
+    # ------------------------------------------------------------------
+    def _is_fresh(self, entry):
+        return self.ttl_seconds and time.time() - entry['checked_at'] < self.ttl_seconds
+
+    def _get_entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _set_entry(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _key_lock(self, key):
+        return self._key_locks[hash(key) % len(self._key_locks)]
+
+    # ------------------------------------------------------------------
+    # Optional disk spill
+    # ------------------------------------------------------------------
+    def _disk_paths(self, key):
+        org_id, asset_type = key
+        directory = os.path.join(self.disk_dir, org_id)
+        return os.path.join(directory, f"{asset_type}.bin"), os.path.join(directory, f"{asset_type}.etag")
+
+    def _load_from_disk(self, key):
+        if not self.disk_dir:
+            return None
+        data_path, etag_path = self._disk_paths(key)
+        try:
+            with open(data_path, 'rb') as f:
+                data = f.read()
+            etag = None
+            if os.path.exists(etag_path):
+                with open(etag_path, 'r') as f:
+                    etag = f.read().strip() or None
+            # The file's mtime records when storage last confirmed it
+            return {'data': data, 'etag': etag, 'checked_at': os.path.getmtime(data_path)}
+        except OSError:
+            return None
+
+    def _write_to_disk(self, key, entry):
+        if not self.disk_dir or entry['data'] is None:
+            return
+        data_path, etag_path = self._disk_paths(key)
+        try:
+            os.makedirs(os.path.dirname(data_path), exist_ok=True)
+            for path, content, mode in ((data_path, entry['data'], 'wb'), (etag_path, entry.get('etag') or '', 'w')):
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+                with os.fdopen(fd, mode) as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Warning: Could not write asset cache file {data_path}: {e}")
+
+
+_asset_cache = None
+_asset_cache_lock = threading.Lock()
+
+
+def get_asset_cache():
+    """Return the process-wide asset cache, creating it on first use."""
+    global _asset_cache
+    with _asset_cache_lock:
+        if _asset_cache is None:
+            settings = get_settings()
+            _asset_cache = AssetCache(
+                bucket=settings.SUPABASE_STORAGE_BUCKET,
+                max_entries=settings.ASSET_CACHE_MAX_ENTRIES,
+                ttl_seconds=settings.ASSET_CACHE_TTL_SECONDS,
+                disk_dir=settings.ASSET_CACHE_DIR,
+            )
+    return _asset_cache
+
+
+def get_org_asset(org_id, asset_type):
+    """Return an organization's logo/signature bytes, or None if not uploaded."""
+    if not org_id:
+        return None
+    return get_asset_cache().get(org_id, asset_type)
+
+
+def get_org_asset_versions(org_id, asset_types=('logo', 'signature')):
+    """Return {asset_type: version} for an organization's receipt assets."""
+    if not org_id:
+        return {asset_type: 'none' for asset_type in asset_types}
+    cache = get_asset_cache()
+    return {asset_type: cache.get_version(org_id, asset_type) for asset_type in asset_types}
@@ -0,0 +1,231 @@
+"""
+Transactional email outbox: donor emails are written to the ``email_outbox``
+table (database/migrations/add_email_outbox.sql) in the same transaction as
+the donation they belong to, and sent in the background. Recording a donation
+never waits on SMTP, and an email queued with a donation that was committed
+is not lost if the process dies before it is sent.
+
+* queue_receipt_email adds the row to the caller's session; the caller's
+  commit makes it durable together with its own changes.
+* Dispatcher threads (the receipt job dispatcher, app/services/receipt_jobs.py,
+  with the outbox's claim/run) lease due rows with ``SELECT ... FOR UPDATE
+  SKIP LOCKED``. A lease that expires (its process died) is taken over, so
+  delivery is at least once.
+* A row is sent with the donation's issued receipt over the pooled SMTP
+  sessions (modules/smtp_pool.py), within the account's rate limits. Marking
+  it sent and setting ``donations.email_sent`` is one commit.
+* Failures are retried at ``next_attempt_at`` with exponential backoff until
+  ``max_attempts``; waiting for a sending limit does not use up an attempt.
+"""
+import datetime
+import threading
+import time
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import get_settings
+from app.db.session import SessionLocal
+from app.models.donation import Donation
+from app.models.donor import Donor
+from app.models.email_outbox import PENDING_STATUSES, EmailOutbox
+from app.services.receipt_jobs import DISPATCHER_ID, MAX_ERROR_LENGTH, ReceiptJobDispatcher, get_retry_delay, utcnow
+from app.services.receipts import ReceiptEmailError, get_issued_receipt_pdf, send_receipt_pdf
+
+settings = get_settings()
+
+
+class PermanentEmailError(Exception):
+    """The email cannot be sent by retrying."""
+
+
+# ----------------------------------------------------------------------
+# Queueing
+# ----------------------------------------------------------------------
+def get_pending_email(db, donation_id, kind="receipt"):
+    return db.query(EmailOutbox).filter(
+        EmailOutbox.donation_id == donation_id,
+        EmailOutbox.kind == kind,
+        EmailOutbox.status.in_(PENDING_STATUSES)
+    ).first()
+
+
+def queue_receipt_email(db, donation, to_email):
+    """
+    Add the donation's receipt email to the outbox in the caller's transaction
+    (not committed here). A receipt email already pending for the donation is
+    returned instead of queueing another.
+    """
+    if donation.id is not None:
+        pending = get_pending_email(db, donation.id)
+        if pending is not None:
+            return pending
+    else:
+        db.flush()  # assigns the new donation's id
+
+    email = EmailOutbox(
+        organization_id=donation.organization_id,
+        donation_id=donation.id,
+        kind="receipt",
+        to_email=to_email,
+        max_attempts=settings.EMAIL_OUTBOX_MAX_ATTEMPTS,
+    )
+    db.add(email)
+    return email
+
+
+def commit_queued_email(db, email):
+    """Commit a queued email and wake this process's dispatcher. Returns the pending row."""
+    try:
+        db.commit()
+    except IntegrityError:
+        # Queued for the same donation by another request in the meantime
+        db.rollback()
+        email = get_pending_email(db, email.donation_id, email.kind)
+        if email is None:
+            raise
+    get_outbox_dispatcher().notify()
+    return email
+
+
+# ----------------------------------------------------------------------
+# Sending
+# ----------------------------------------------------------------------
+def claim_next_email(db):
+    """Lease the next due email (or one whose lease expired) to this process. Returns its id or None."""
+    now = utcnow()
+    email = db.query(EmailOutbox).filter(or_(
+        and_(EmailOutbox.status == "queued", EmailOutbox.next_attempt_at <= now),
+        and_(EmailOutbox.status == "sending", EmailOutbox.locked_until < now),
+    )).order_by(EmailOutbox.next_attempt_at).with_for_update(skip_locked=True).first()
+    if email is None:
+        db.rollback()
+        return None
+
+    if email.status == "sending":
+        print(f"♻️ Outbox email {email.id} lease from {email.locked_by} expired, retrying")
+    if email.attempts >= email.max_attempts:
+        # The last attempt died without recording an outcome
+        changes = {"status": "failed", "last_error": email.last_error or "Lease expired on the last attempt", "locked_until": None}
+    else:
+        changes = {
+            "status": "sending",
+            "attempts": email.attempts + 1,
+            "locked_by": DISPATCHER_ID,
+            "locked_until": now + datetime.timedelta(seconds=settings.EMAIL_OUTBOX_LEASE_SECONDS),
+        }
+
+    # Conditional on the state we read, so an email is only ever claimed once
+    claimed = db.query(EmailOutbox).filter(
+        EmailOutbox.id == email.id,
+        EmailOutbox.status == email.status,
+        EmailOutbox.attempts == email.attempts
+    ).update(changes, synchronize_session=False)
+    db.commit()
+    if not claimed or changes["status"] != "sending":
+        return None
+    return email.id
+
+
+def deliver_email(db, email):
+    """Render (or read) the receipt and send it. Returns the donation."""
+    donation = db.query(Donation).filter(Donation.organization_id == email.organization_id, Donation.id == email.donation_id).first()
+    if not donation:
+        raise PermanentEmailError("Donation not found")
+    if not donation.receipt_number:
+        raise PermanentEmailError("No receipt number found for this donation")
+    donor = db.query(Donor).filter(Donor.id == donation.donor_id).first()
+    if not donor:
+        raise PermanentEmailError("Donor not found")
+
+    from modules.supabase_utils import get_organization_settings
+    org_id = str(email.organization_id)
+    org_settings = get_organization_settings(org_id)
+
+    pdf_bytes = get_issued_receipt_pdf(db, donation, donor, org_id, org_settings)
+    try:
+        send_receipt_pdf(donation, donor, org_id, org_settings, pdf_bytes, to_email=email.to_email)
+    except ReceiptEmailError as e:
+        if e.permanent:
+            raise PermanentEmailError(str(e))
+        raise
+    return donation
+
+
+def send_outbox_email(email_id):
+    """Send a claimed outbox email and record the outcome."""
+    db = SessionLocal()
+    try:
+        email = db.query(EmailOutbox).filter(EmailOutbox.id == email_id).first()
+        if email is None:
+            return
+        start = time.perf_counter()
+        try:
+            donation = deliver_email(db, email)
+        except Exception as e:
+            db.rollback()
+            email = db.query(EmailOutbox).filter(EmailOutbox.id == email_id).first()
+            email.last_error = f"{type(e).__name__}: {e}"[:MAX_ERROR_LENGTH]
+            email.locked_until = None
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after:
+                # Held back by the account's sending limit, not a failed attempt
+                email.status = "queued"
+                email.attempts -= 1
+                email.next_attempt_at = utcnow() + datetime.timedelta(seconds=retry_after)
+                print(f"⏳ Outbox email {email.id} waits {retry_after:.0f}s for the sending limit")
+            elif isinstance(e, PermanentEmailError) or email.attempts >= email.max_attempts:
+                email.status = "failed"
+                print(f"❌ Outbox email {email.id} to {email.to_email} failed after {email.attempts} attempts: {e}")
+            else:
+                delay = get_retry_delay(email.attempts)
+                email.status = "queued"
+                email.next_attempt_at = utcnow() + datetime.timedelta(seconds=delay)
+                print(f"⚠️ Outbox email {email.id} attempt {email.attempts} failed, retrying in {delay:.0f}s: {e}")
+            db.commit()
+            return
+
+        # Sent: the outbox row and the donation flag change together
+        email.status = "sent"
+        email.sent_at = utcnow()
+        email.last_error = None
+        email.locked_until = None
+        donation.email_sent = True
+        db.commit()
+        print(f"✅ Outbox email {email.id} sent to {email.to_email} in {(time.perf_counter() - start) * 1000:.0f} ms")
+    finally:
+        db.close()
+
+
+# ----------------------------------------------------------------------
+# Dispatcher
+# ----------------------------------------------------------------------
+_outbox_dispatcher = None
+_outbox_dispatcher_lock = threading.Lock()
+
+
+def get_outbox_dispatcher():
+    """Return the process-wide outbox dispatcher (started separately with start())."""
+    global _outbox_dispatcher
+    with _outbox_dispatcher_lock:
+        if _outbox_dispatcher is None:
+            _outbox_dispatcher = ReceiptJobDispatcher(
+                settings.EMAIL_OUTBOX_CONCURRENCY, settings.EMAIL_OUTBOX_POLL_SECONDS,
+                claim=claim_next_email, run=send_outbox_email, name="email-outbox"
+            )
+    return _outbox_dispatcher
+
+
+def main():
+    """Run an outbox dispatcher on its own, e.g. on a machine that does not serve the API."""
+    dispatcher = get_outbox_dispatcher()
+    dispatcher.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        dispatcher.stop()
+
+
+if __name__ == "__main__":
+    main()
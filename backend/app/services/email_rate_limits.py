@@ -0,0 +1,121 @@
+"""
+Outgoing email rate limits.
+
+Providers cap how fast one account may send (Gmail: about 500 messages a day
+for a personal account, and bursts get throttled). Limits are configured per
+SMTP host in ``EMAIL_RATE_LIMITS`` ("smtp.gmail.com=20/minute,500/day;...")
+and applied to each sending account on that host as token buckets, one per
+window. A send takes a token from every bucket of its account; when one is
+empty the sender waits for the refill, up to a bound, and is otherwise told
+how long until it may send again.
+
+The buckets live in this process, so with several API processes each one may
+send up to the limits; set them accordingly.
+"""
+import re
+import threading
+import time
+
+from app.core.config import get_settings
+
+settings = get_settings()
+
+WINDOW_SECONDS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+LIMIT_RE = re.compile(r"^\s*(\d+)\s*/\s*(second|minute|hour|day)\s*$")
+
+
+def parse_limits(value):
+    """'20/minute,500/day' -> [(20, 60), (500, 86400)]."""
+    limits = []
+    for part in (value or "").split(","):
+        if not part.strip():
+            continue
+        match = LIMIT_RE.match(part)
+        if not match:
+            raise ValueError(f"Invalid email rate limit: {part!r}")
+        limits.append((int(match.group(1)), WINDOW_SECONDS[match.group(2)]))
+    return limits
+
+
+def parse_provider_limits(value):
+    """'smtp.gmail.com=20/minute,500/day;smtp.office365.com=30/minute' -> {host: limits}."""
+    providers = {}
+    for entry in (value or "").split(";"):
+        if not entry.strip():
+            continue
+        host, _, limits = entry.partition("=")
+        providers[host.strip().lower()] = parse_limits(limits)
+    return providers
+
+
+class TokenBucket:
+    """``capacity`` tokens, refilled continuously over ``window`` seconds."""
+
+    def __init__(self, capacity, window):
+        self.capacity = max(1, capacity)
+        self.rate = self.capacity / window
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 when one is)."""
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class EmailRateLimiter:
+    """Token buckets per sending account, with limits looked up by SMTP host."""
+
+    def __init__(self, provider_limits, default_limits):
+        self.provider_limits = provider_limits
+        self.default_limits = default_limits
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def get_buckets(self, email_config):
+        host = str(email_config.get('smtp_server') or '').lower()
+        key = (host, email_config.get('email_address'))
+        buckets = self._buckets.get(key)
+        if buckets is None:
+            limits = self.provider_limits.get(host, self.default_limits)
+            buckets = self._buckets[key] = [TokenBucket(capacity, window) for capacity, window in limits]
+        return buckets
+
+    def acquire(self, email_config, max_wait=60):
+        """
+        Take a send token for the account, waiting up to ``max_wait`` seconds.
+        Returns 0 once taken, or the seconds to wait when that is longer.
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                buckets = self.get_buckets(email_config)
+                now = time.monotonic()
+                wait = max([bucket.wait_time(now) for bucket in buckets], default=0.0)
+                if wait == 0:
+                    for bucket in buckets:
+                        bucket.take()
+                    return 0.0
+            if now + wait > deadline:
+                return wait
+            time.sleep(wait)
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_email_rate_limiter():
+    """Return the process-wide limiter, creating it on first use."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = EmailRateLimiter(parse_provider_limits(settings.EMAIL_RATE_LIMITS), parse_limits(settings.EMAIL_DEFAULT_RATE_LIMITS))
+    return _rate_limiter
@@ -0,0 +1,172 @@
+"""
+Bulk receipt generation streamed as a ZIP archive.
+
+Receipts are rendered (or read from object storage when they were issued
+before) on a small thread pool. Each PDF is written into the archive as it
+completes and the bytes written so far are handed to the response, so only a
+small window of PDFs (twice the concurrency) is held in memory at any time. The archive ends with ``manifest.json``, which records the
+outcome of every requested donation, including failures.
+"""
+import json
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+from app.models.donation import Donation
+from app.models.donor import Donor
+from app.services.receipts import get_receipt_content_key, get_receipt_pdf
+from app.services.receipt_store import get_stored_receipt_key, read_stored_receipt
+
+MANIFEST_NAME = "manifest.json"
+
+
+class ZipChunkBuffer:
+    """Write-only file object that collects zip output until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def query_batch_donations(db, org_id, donation_ids=None, start_date=None, end_date=None, purpose=None):
+    """(Donation, Donor) query for explicit donation ids and/or a date range and purpose filter."""
+    query = db.query(Donation, Donor).join(Donor, Donor.id == Donation.donor_id).filter(Donation.organization_id == org_id)
+    if donation_ids:
+        query = query.filter(Donation.id.in_(donation_ids))
+    if start_date:
+        query = query.filter(Donation.date >= start_date)
+    if end_date:
+        query = query.filter(Donation.date <= end_date)
+    if purpose:
+        query = query.filter(Donation.purpose.ilike(f"%{purpose}%"))
+    return query
+
+
+def get_receipt_filename(receipt_number, donation_id, used_names):
+    """Safe, unique archive name for a receipt."""
+    name = f"{receipt_number.replace('/', '_')}.pdf"
+    if name in used_names:
+        name = f"{receipt_number.replace('/', '_')}_{donation_id}.pdf"
+    used_names.add(name)
+    return name
+
+
+def iter_completed(items, work, concurrency=2):
+    """
+    Run ``work(item)`` on a thread pool with a bounded window (twice the
+    concurrency) of items in flight, yielding (item, result, error) as each
+    completes. Items not started yet are cancelled when the consumer stops.
+    """
+    pending = {}
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="receipt-batch") as executor:
+
+        def submit_next():
+            item = next(items, None)
+            if item is None:
+                return False
+            pending[executor.submit(work, item)] = item
+            return True
+
+        for _ in range(max(1, concurrency) * 2):
+            if not submit_next():
+                break
+
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    try:
+                        result, error = future.result(), None
+                    except Exception as e:
+                        result, error = None, e
+                    yield item, result, error
+                    submit_next()
+        finally:
+            # Client went away: don't start the renders that were still queued
+            for future in pending:
+                future.cancel()
+
+
+def stream_receipt_zip(rows, org_id, org_settings, concurrency=2, missing_ids=()):
+    """
+    Yield a ZIP archive of receipts chunk by chunk.
+    rows: list of (donation, donor) pairs, already loaded from the database.
+    missing_ids: requested donation ids that were not found; reported in the manifest.
+    """
+    buffer = ZipChunkBuffer()
+    # PDFs are already compressed; storing them keeps the CPU on rendering
+    archive = zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED)
+    manifest = [{"donation_id": str(donation_id), "status": "error", "error": "Donation not found"} for donation_id in missing_ids]
+    used_names = set()
+    started = datetime.utcnow()
+
+    def render(row):
+        donation, donor = row
+        if not donation.receipt_number:
+            raise ValueError("No receipt number found for this donation")
+        # Receipts issued before are zipped as stored, not rendered again, unless out of date
+        key = get_stored_receipt_key(org_id, donation, get_receipt_content_key(org_id, donation, donor, org_settings))
+        pdf_bytes = read_stored_receipt(key) if key else None
+        return pdf_bytes if pdf_bytes is not None else get_receipt_pdf(donation, donor, org_id, org_settings)
+
+    for (donation, donor), pdf_bytes, error in iter_completed(rows, render, concurrency):
+        entry = {
+            "donation_id": str(donation.id),
+            "receipt_number": donation.receipt_number,
+            "donor_name": donor.full_name,
+        }
+        if error is None:
+            entry["file"] = get_receipt_filename(donation.receipt_number, donation.id, used_names)
+            entry["status"] = "ok"
+            entry["bytes"] = len(pdf_bytes)
+            archive.writestr(entry["file"], pdf_bytes)
+        else:
+            print(f"❌ Batch receipt failed for donation {donation.id}: {error}")
+            entry["status"] = "error"
+            entry["error"] = str(error)
+        manifest.append(entry)
+
+        chunk = buffer.drain()
+        if chunk:
+            yield chunk
+
+    yield finish_zip(archive, buffer, manifest, org_id, started)
+    print(f"📦 Streamed receipt batch: {count_succeeded(manifest)}/{len(manifest)} receipts")
+
+
+def count_succeeded(manifest):
+    return sum(1 for entry in manifest if entry["status"] == "ok")
+
+
+def finish_zip(archive, buffer, manifest, org_id, started, **extra):
+    """Write manifest.json, close the archive and return its remaining bytes."""
+    succeeded = count_succeeded(manifest)
+    archive.writestr(MANIFEST_NAME, json.dumps({
+        "organization_id": str(org_id),
+        **extra,
+        "generated_at": started.isoformat() + "Z",
+        "requested": len(manifest),
+        "succeeded": succeeded,
+        "failed": len(manifest) - succeeded,
+        "items": manifest,
+    }, indent=2))
+    archive.close()
+    return buffer.drain()
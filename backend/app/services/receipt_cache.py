@@ -0,0 +1,266 @@
+"""
+Content-addressed cache of generated receipt PDFs.
+
+A receipt is keyed by a SHA-256 over everything that shows up in the PDF: the
+donor and donation fields, the organization settings snapshot, the versions of
+the org logo/signature and the template version. Editing any of them produces
+a new key, so nothing has to be invalidated by hand; superseded PDFs simply age
+out.
+
+Tiers, checked in order:
+
+* memory - LRU bounded by ``RECEIPT_CACHE_MAX_MB`` (per worker process)
+* disk - ``RECEIPT_CACHE_DIR`` when set, shared by the workers on one machine
+* object storage - ``RECEIPT_CACHE_OBJECT_STORAGE`` stores PDFs under
+  ``<org_id>/receipt-cache/`` in the Supabase bucket, shared by every machine
+
+A hit in a lower tier is copied into the tiers above it.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+from app.core.config import get_settings
+from app.services.asset_cache import get_storage_client
+
+DEFAULT_MAX_MB = 64
+DEFAULT_DISK_MAX_MB = 1024
+DISK_PRUNE_INTERVAL = 50  # disk writes between size checks
+
+
+def get_receipt_cache_key(donor_data, org_data, donation_data, donor_type, asset_versions, template_version, renderer=None):
+    """SHA-256 over every input that affects the rendered receipt."""
+    payload = {
+        "donor": donor_data,
+        "org": org_data,
+        "donation": donation_data,
+        "donor_type": (donor_type or "Individual").lower(),
+        "assets": asset_versions,
+        "template": template_version,
+        "renderer": renderer,
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class ReceiptCache:
+    """Memory -> disk -> object storage cache of receipt PDF bytes."""
+
+    def __init__(self, max_mb=DEFAULT_MAX_MB, disk_dir=None, disk_max_mb=DEFAULT_DISK_MAX_MB, bucket=None, object_storage=False, client_factory=get_storage_client):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = int(disk_max_mb * 1024 * 1024)
+        self.bucket = bucket
+        self.object_storage = bool(object_storage and bucket)
+        self.client_factory = client_factory
+
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+
+        self._hits = {"memory": 0, "disk": 0, "object_storage": 0}
+        self._misses = 0
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def get(self, org_id, key):
+        """Return cached PDF bytes for ``key`` or None."""
+        pdf_bytes = self._memory_get(key)
+        if pdf_bytes is not None:
+            self._count_hit("memory")
+            return pdf_bytes
+
+        pdf_bytes = self._disk_get(org_id, key)
+        if pdf_bytes is not None:
+            self._count_hit("disk")
+            self._memory_put(key, pdf_bytes)
+            return pdf_bytes
+
+        pdf_bytes = self._object_get(org_id, key)
+        if pdf_bytes is not None:
+            self._count_hit("object_storage")
+            self._memory_put(key, pdf_bytes)
+            self._disk_put(org_id, key, pdf_bytes)
+            return pdf_bytes
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, org_id, key, pdf_bytes):
+        """Store PDF bytes in every configured tier."""
+        self._memory_put(key, pdf_bytes)
+        self._disk_put(org_id, key, pdf_bytes)
+        self._object_put(org_id, key, pdf_bytes)
+
+    def clear(self):
+        """Drop the in-memory tier (disk and object storage are left alone)."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_mb": round(self._size / (1024 * 1024), 2),
+                "max_mb": round(self.max_bytes / (1024 * 1024), 2),
+                "hits": dict(self._hits),
+                "misses": self._misses,
+                "disk_dir": self.disk_dir,
+                "object_storage": self.object_storage,
+            }
+
+    def _count_hit(self, tier):
+        with self._lock:
+            self._hits[tier] += 1
+
+    # ------------------------------------------------------------------
+    # Memory tier
+    # ------------------------------------------------------------------
+    def _memory_get(self, key):
+        with self._lock:
+            pdf_bytes = self._entries.get(key)
+            if pdf_bytes is not None:
+                self._entries.move_to_end(key)
+            return pdf_bytes
+
+    def _memory_put(self, key, pdf_bytes):
+        if len(pdf_bytes) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = pdf_bytes
+            self._size += len(pdf_bytes)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    # ------------------------------------------------------------------
+    # Disk tier
+    # ------------------------------------------------------------------
+    def _disk_path(self, org_id, key):
+        return os.path.join(self.disk_dir, str(org_id), key[:2], f"{key}.pdf")
+
+    def _disk_get(self, org_id, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(org_id, key)
+        try:
+            with open(path, 'rb') as f:
+                pdf_bytes = f.read()
+            # Touch so pruning drops the least recently used files first
+            os.utime(path, None)
+            return pdf_bytes
+        except OSError:
+            return None
+
+    def _disk_put(self, org_id, key, pdf_bytes):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(org_id, key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pdf_bytes)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Warning: Could not write receipt cache file {path}: {e}")
+            return
+
+        with self._lock:
+            self._disk_writes += 1
+            prune = self._disk_writes % DISK_PRUNE_INTERVAL == 0
+        if prune:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Delete least recently used PDFs until the disk tier fits its budget."""
+        files = []
+        total = 0
+        for root, _, filenames in os.walk(self.disk_dir):
+            for filename in filenames:
+                if not filename.endswith('.pdf'):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total <= self.disk_max_bytes:
+            return
+        files.sort()
+        for _, size, path in files:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        print(f"🧹 Pruned receipt disk cache to {total / (1024 * 1024):.0f} MB")
+
+    # ------------------------------------------------------------------
+    # Object storage tier
+    # ------------------------------------------------------------------
+    def _object_key(self, org_id, key):
+        return f"{org_id}/receipt-cache/{key}.pdf"
+
+    def _object_get(self, org_id, key):
+        if not self.object_storage:
+            return None
+        try:
+            response = self.client_factory().get_object(Bucket=self.bucket, Key=self._object_key(org_id, key))
+            return response['Body'].read()
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404', 'NotFound'):
+                print(f"⚠️ Warning: Receipt cache lookup failed: {e}")
+        except Exception as e:
+            print(f"⚠️ Warning: Receipt cache lookup failed: {e}")
+        return None
+
+    def _object_put(self, org_id, key, pdf_bytes):
+        if not self.object_storage:
+            return
+        try:
+            self.client_factory().put_object(
+                Bucket=self.bucket,
+                Key=self._object_key(org_id, key),
+                Body=pdf_bytes,
+                ContentType='application/pdf'
+            )
+        except Exception as e:
+            print(f"⚠️ Warning: Could not store receipt in object storage: {e}")
+
+
+_receipt_cache = None
+_receipt_cache_lock = threading.Lock()
+
+
+def get_receipt_cache():
+    """Return the process-wide receipt cache, creating it on first use."""
+    global _receipt_cache
+    with _receipt_cache_lock:
+        if _receipt_cache is None:
+            settings = get_settings()
+            _receipt_cache = ReceiptCache(
+                max_mb=settings.RECEIPT_CACHE_MAX_MB,
+                disk_dir=settings.RECEIPT_CACHE_DIR,
+                disk_max_mb=settings.RECEIPT_CACHE_DISK_MAX_MB,
+                bucket=settings.SUPABASE_STORAGE_BUCKET,
+                object_storage=settings.RECEIPT_CACHE_OBJECT_STORAGE,
+            )
+    return _receipt_cache
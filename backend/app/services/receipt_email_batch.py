@@ -0,0 +1,177 @@
+"""
+Bulk receipt emails ("send all unsent receipts").
+
+Receipts are rendered (or read from object storage when they were issued
+before) on a small thread pool, as for the ZIP batch
+(app/services/receipt_batch.py), and each PDF is handed to a second pool that
+mails it over the pooled SMTP sessions, so rendering and sending overlap.
+Both stages have a bounded window, and a send waits for a token from the
+account's rate limits (app/services/email_rate_limits.py). When the limit
+would hold a send back for longer than ``EMAIL_RATE_LIMIT_MAX_WAIT_SECONDS``
+(typically the daily cap), the run stops and the rest is reported as
+deferred. They are still unsent, so the next run picks them up.
+
+Sent donations are marked ``email_sent`` (and newly stored receipts recorded)
+in batches of ``RECEIPT_EMAIL_BULK_MARK_BATCH``, on a session of its own, and
+once more when the run ends or the client goes away. The report is streamed
+as NDJSON, a line per donation as it completes and a summary at the end.
+"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from app.db.session import SessionLocal
+from app.models.donation import Donation
+from app.services.receipt_batch import iter_completed
+from app.services.receipt_store import delete_stored_receipt, get_stored_receipt_key, is_stored_receipt_path, read_stored_receipt, upload_receipt_pdf
+from app.services.receipts import ReceiptEmailError, get_receipt_content_key, get_receipt_pdf, send_receipt_pdf
+
+REPORT_STATUSES = ("sent", "failed", "skipped", "deferred")
+
+
+class EmailSentMarker:
+    """Collects sent donations and records them a batch at a time."""
+
+    def __init__(self, batch_size=50):
+        self.batch_size = max(1, batch_size)
+        self._pending = []
+
+    def add(self, donation_id, receipt_path=None):
+        mapping = {"id": donation_id, "email_sent": True}
+        if receipt_path:
+            mapping["receipt_path"] = receipt_path
+        self._pending.append(mapping)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        db = SessionLocal()
+        try:
+            db.bulk_update_mappings(Donation, pending)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            # These were emailed; unmarked they would be sent again by the next run
+            print(f"❌ Could not mark {len(pending)} donations as emailed ({[str(m['id']) for m in pending]}): {e}")
+        finally:
+            db.close()
+
+
+def iter_bulk_receipt_emails(rows, org_id, org_settings, email_config, render_concurrency=2, send_concurrency=2, mark_batch_size=50):
+    """
+    Email the receipts of ``rows`` ((donation, donor) pairs, already loaded),
+    yielding a report entry per donation as it is done.
+    """
+    marker = EmailSentMarker(mark_batch_size)
+    reported = set()
+    deferred = None  # the error that stopped the run
+
+    def entry_for(donation, donor, status, error=None):
+        reported.add(donation.id)
+        entry = {
+            "donation_id": str(donation.id),
+            "receipt_number": donation.receipt_number,
+            "email": donor.email,
+            "status": status,
+        }
+        if error is not None:
+            entry["error"] = str(error)
+        return entry
+
+    def render(row):
+        donation, donor = row
+        if not donation.receipt_number:
+            raise ValueError("No receipt number found for this donation")
+        # Receipts issued before are sent as stored; new (or out of date) ones are stored for later downloads
+        content_key = get_receipt_content_key(org_id, donation, donor, org_settings)
+        key = get_stored_receipt_key(org_id, donation, content_key)
+        pdf_bytes = read_stored_receipt(key) if key else None
+        if pdf_bytes is not None:
+            return pdf_bytes, None
+        pdf_bytes = get_receipt_pdf(donation, donor, org_id, org_settings)
+        key, _ = upload_receipt_pdf(org_id, donation, pdf_bytes, content_key)
+        if key and key != donation.receipt_path and is_stored_receipt_path(org_id, donation.receipt_path):
+            delete_stored_receipt(donation.receipt_path)
+        return pdf_bytes, key
+
+    def send(row, rendered):
+        donation, donor = row
+        send_receipt_pdf(donation, donor, org_id, org_settings, rendered[0], email_config)
+
+    def finish(future, row, rendered):
+        nonlocal deferred
+        donation, donor = row
+        try:
+            future.result()
+        except ReceiptEmailError as e:
+            if e.retry_after:
+                deferred = deferred or e
+                return entry_for(donation, donor, "deferred", e)
+            return entry_for(donation, donor, "failed", e)
+        except Exception as e:
+            return entry_for(donation, donor, "failed", e)
+        marker.add(donation.id, rendered[1])
+        return entry_for(donation, donor, "sent")
+
+    # Donors without an address are reported without rendering anything
+    sendable = []
+    for donation, donor in rows:
+        if donor.email:
+            sendable.append((donation, donor))
+        else:
+            yield entry_for(donation, donor, "skipped", "Donor has no email address")
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, send_concurrency), thread_name_prefix="receipt-email") as senders:
+            in_flight = {}
+
+            def drain(until):
+                while len(in_flight) > until:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield finish(future, *in_flight.pop(future))
+
+            try:
+                for row, rendered, error in iter_completed(sendable, render, render_concurrency):
+                    if error is not None:
+                        print(f"❌ Bulk email render failed for donation {row[0].id}: {error}")
+                        yield entry_for(row[0], row[1], "failed", error)
+                        continue
+                    in_flight[senders.submit(send, row, rendered)] = (row, rendered)
+                    # Rendering runs at most a window ahead of sending
+                    yield from drain(max(1, send_concurrency) * 2 - 1)
+                    if deferred is not None:
+                        break
+                yield from drain(0)
+            finally:
+                # Client went away: sends already under way finish and are recorded
+                for future, (row, rendered) in in_flight.items():
+                    if not future.cancel():
+                        finish(future, row, rendered)
+    finally:
+        marker.flush()
+
+    for donation, donor in sendable:
+        if donation.id not in reported:
+            yield entry_for(donation, donor, "deferred", deferred or "Not sent")
+
+
+def stream_bulk_email_report(rows, org_id, org_settings, email_config, render_concurrency=2, send_concurrency=2, mark_batch_size=50):
+    """
+    Yield the run's report as NDJSON: a line per donation, then a
+    ``{"summary": ...}`` line with the counts per status.
+    """
+    started = time.perf_counter()
+    summary = {status: 0 for status in REPORT_STATUSES}
+    for entry in iter_bulk_receipt_emails(rows, org_id, org_settings, email_config, render_concurrency, send_concurrency, mark_batch_size):
+        summary[entry["status"]] += 1
+        yield json.dumps(entry) + "\n"
+
+    summary["requested"] = len(rows)
+    summary["seconds"] = round(time.perf_counter() - started, 1)
+    yield json.dumps({"summary": summary}) + "\n"
+    print(f"📧 Bulk receipt emails for org {org_id}: {summary['sent']} sent, {summary['failed']} failed, "
+          f"{summary['skipped']} skipped, {summary['deferred']} deferred in {summary['seconds']}s")
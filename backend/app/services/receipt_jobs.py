@@ -0,0 +1,307 @@
+"""
+Durable receipt jobs: render, email or render+email a donation's receipt in the
+background, tracked in the ``receipt_jobs`` table
+(database/migrations/add_receipt_jobs.sql).
+
+* enqueue_receipt_job inserts a queued job, or returns the queued/running job
+  of the same type for that donation (a partial unique index enforces it).
+* ReceiptJobDispatcher threads claim due jobs with ``SELECT ... FOR UPDATE
+  SKIP LOCKED``, so any number of API processes (or ``python -m
+  app.services.receipt_jobs``) can dispatch without taking the same job.
+* A claimed job holds a lease (``locked_until``). If its process dies, the
+  job is picked up again once the lease expires, so delivery is at least once.
+* Failures are retried with exponential backoff until ``max_attempts``;
+  waiting for a sending limit does not use up an attempt.
+  Errors that cannot succeed on retry (missing donation, SMTP not configured)
+  fail the job straight away.
+
+A render job stores the PDF in object storage (app/services/receipt_store.py),
+so the following download is served from there.
+"""
+import datetime
+import os
+import random
+import socket
+import threading
+import time
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import get_settings
+from app.db.session import SessionLocal
+from app.models.donation import Donation
+from app.models.donor import Donor
+from app.models.receipt_job import ACTIVE_STATUSES, ReceiptJob
+from app.services.receipts import ReceiptEmailError, get_issued_receipt_pdf, send_receipt_pdf_email
+
+settings = get_settings()
+
+DISPATCHER_ID = f"{socket.gethostname()}:{os.getpid()}"
+MAX_ERROR_LENGTH = 2000
+
+
+class PermanentJobError(Exception):
+    """The job cannot succeed by retrying."""
+
+
+def utcnow():
+    return datetime.datetime.utcnow()
+
+
+def get_retry_delay(attempts):
+    """Seconds before the next attempt: exponential with jitter, capped."""
+    delay = min(settings.RECEIPT_JOB_MAX_BACKOFF_SECONDS, settings.RECEIPT_JOB_BACKOFF_SECONDS * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.5, 1.5)
+
+
+# ----------------------------------------------------------------------
+# Enqueueing
+# ----------------------------------------------------------------------
+def get_active_job(db, donation_id, job_type):
+    return db.query(ReceiptJob).filter(
+        ReceiptJob.donation_id == donation_id,
+        ReceiptJob.job_type == job_type,
+        ReceiptJob.status.in_(ACTIVE_STATUSES)
+    ).first()
+
+
+def enqueue_receipt_job(db, org_id, donation_id, job_type):
+    """
+    Queue a job, deduplicated by donation: an equivalent queued/running job is
+    returned instead (with ``deduplicated`` set). Returns the ReceiptJob.
+    """
+    job = get_active_job(db, donation_id, job_type)
+    if job is None:
+        job = ReceiptJob(
+            organization_id=org_id,
+            donation_id=donation_id,
+            job_type=job_type,
+            max_attempts=settings.RECEIPT_JOB_MAX_ATTEMPTS,
+            result={},
+        )
+        db.add(job)
+        try:
+            db.commit()
+            job.deduplicated = False
+            get_dispatcher().notify()
+            return job
+        except IntegrityError:
+            # Another request queued the same job between our check and insert
+            db.rollback()
+            job = get_active_job(db, donation_id, job_type)
+            if job is None:
+                raise
+
+    job.deduplicated = True
+    return job
+
+
+# ----------------------------------------------------------------------
+# Running
+# ----------------------------------------------------------------------
+def claim_next_job(db):
+    """Lease the next due job (or one whose lease expired) to this process. Returns its id or None."""
+    now = utcnow()
+    job = db.query(ReceiptJob).filter(or_(
+        and_(ReceiptJob.status == "queued", ReceiptJob.run_after <= now),
+        and_(ReceiptJob.status == "running", ReceiptJob.locked_until < now),
+    )).order_by(ReceiptJob.run_after).with_for_update(skip_locked=True).first()
+    if job is None:
+        db.rollback()
+        return None
+
+    if job.status == "running":
+        print(f"♻️ Receipt job {job.id} lease from {job.locked_by} expired, retrying")
+    if job.attempts >= job.max_attempts:
+        # The last attempt died without recording an outcome
+        changes = {"status": "failed", "last_error": job.last_error or "Lease expired on the last attempt", "finished_at": now, "locked_until": None}
+    else:
+        changes = {
+            "status": "running",
+            "attempts": job.attempts + 1,
+            "locked_by": DISPATCHER_ID,
+            "locked_until": now + datetime.timedelta(seconds=settings.RECEIPT_JOB_LEASE_SECONDS),
+            "started_at": now,
+        }
+
+    # Conditional on the state we read, so a job is only ever claimed once
+    # (also where the database has no SKIP LOCKED)
+    claimed = db.query(ReceiptJob).filter(
+        ReceiptJob.id == job.id,
+        ReceiptJob.status == job.status,
+        ReceiptJob.attempts == job.attempts
+    ).update(changes, synchronize_session=False)
+    db.commit()
+    if not claimed or changes["status"] != "running":
+        return None
+    return job.id
+
+
+def run_job_steps(db, job):
+    """Do the job's work. Progress is saved in ``job.result`` so retries skip finished steps."""
+    donation = db.query(Donation).filter(Donation.organization_id == job.organization_id, Donation.id == job.donation_id).first()
+    if not donation:
+        raise PermanentJobError("Donation not found")
+    if not donation.receipt_number:
+        raise PermanentJobError("No receipt number found for this donation")
+    donor = db.query(Donor).filter(Donor.id == donation.donor_id).first()
+    if not donor:
+        raise PermanentJobError("Donor not found")
+
+    from modules.supabase_utils import get_organization_settings
+    org_id = str(job.organization_id)
+    org_settings = get_organization_settings(org_id)
+    result = dict(job.result or {})
+
+    # Stored on the first attempt, so a retry after a failed email doesn't render again
+    pdf_bytes = get_issued_receipt_pdf(db, donation, donor, org_id, org_settings)
+    result.update({"rendered": True, "pdf_bytes": len(pdf_bytes), "receipt_path": donation.receipt_path, "download_url": f"/receipts/{job.donation_id}"})
+
+    if job.job_type in ("email", "render+email") and not result.get("emailed"):
+        try:
+            send_receipt_pdf_email(db, donation, donor, org_id, org_settings, pdf_bytes)
+        except ReceiptEmailError as e:
+            if e.permanent:
+                raise PermanentJobError(str(e))
+            raise
+        result.update({"emailed": True, "email": donor.email})
+        # Record it right away: a retry after this point must not email again
+        job.result = result
+        db.commit()
+    return result
+
+
+def run_job(job_id):
+    """Run a claimed job and record its outcome."""
+    db = SessionLocal()
+    try:
+        job = db.query(ReceiptJob).filter(ReceiptJob.id == job_id).first()
+        if job is None:
+            return
+        start = time.perf_counter()
+        try:
+            result = run_job_steps(db, job)
+        except Exception as e:
+            db.rollback()
+            job = db.query(ReceiptJob).filter(ReceiptJob.id == job_id).first()
+            job.last_error = f"{type(e).__name__}: {e}"[:MAX_ERROR_LENGTH]
+            job.locked_until = None
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after:
+                # Held back by the account's sending limit, not a failed attempt
+                job.status = "queued"
+                job.attempts -= 1
+                job.run_after = utcnow() + datetime.timedelta(seconds=retry_after)
+                print(f"⏳ Receipt job {job.id} ({job.job_type}) waits {retry_after:.0f}s for the sending limit")
+            elif isinstance(e, PermanentJobError) or job.attempts >= job.max_attempts:
+                job.status = "failed"
+                job.finished_at = utcnow()
+                print(f"❌ Receipt job {job.id} ({job.job_type}) failed after {job.attempts} attempts: {e}")
+            else:
+                delay = get_retry_delay(job.attempts)
+                job.status = "queued"
+                job.run_after = utcnow() + datetime.timedelta(seconds=delay)
+                print(f"⚠️ Receipt job {job.id} ({job.job_type}) attempt {job.attempts} failed, retrying in {delay:.0f}s: {e}")
+            db.commit()
+            return
+
+        job.status = "succeeded"
+        job.result = result
+        job.last_error = None
+        job.locked_until = None
+        job.finished_at = utcnow()
+        db.commit()
+        print(f"✅ Receipt job {job.id} ({job.job_type}) done in {(time.perf_counter() - start) * 1000:.0f} ms")
+    finally:
+        db.close()
+
+
+# ----------------------------------------------------------------------
+# Dispatcher
+# ----------------------------------------------------------------------
+class ReceiptJobDispatcher:
+    """
+    Threads that claim and run due jobs; woken early when this process queues one.
+    ``claim(db)`` returns the id of a leased job or None and ``run(id)`` runs
+    it (receipt jobs by default; the email outbox uses its own).
+    """
+
+    def __init__(self, concurrency=2, poll_interval=2.0, claim=None, run=None, name="receipt-jobs"):
+        self.concurrency = max(1, int(concurrency))
+        self.poll_interval = poll_interval
+        self.claim = claim or claim_next_job
+        self.run = run or run_job
+        self.name = name
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for index in range(self.concurrency):
+                thread = threading.Thread(target=self._run, name=f"{self.name}-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        print(f"🚀 {self.name} dispatcher started with {self.concurrency} threads")
+
+    def stop(self, timeout=30):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        self._stop.set()
+        self._wakeup.set()
+        for thread in threads:
+            thread.join(timeout=timeout)
+
+    def notify(self):
+        """A job was queued: wake an idle thread instead of waiting for the next poll."""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                job_id = self.claim(db)
+            except Exception as e:
+                print(f"❌ Error claiming {self.name} job: {e}")
+                job_id = None
+            finally:
+                db.close()
+
+            if job_id is not None:
+                self.run(job_id)
+                continue
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Return the process-wide dispatcher (started separately with start())."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = ReceiptJobDispatcher(settings.RECEIPT_JOB_CONCURRENCY, settings.RECEIPT_JOB_POLL_SECONDS)
+    return _dispatcher
+
+
+def main():
+    """Run a dispatcher on its own, e.g. on a machine that does not serve the API."""
+    dispatcher = get_dispatcher()
+    dispatcher.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        dispatcher.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Receipt previews for the settings screens.
+
+A preview is page 1 of a sample receipt, rendered with the org's current
+settings and assets and rasterized with PyMuPDF to a PNG or WebP thumbnail.
+Thumbnails are kept in a small in-memory LRU keyed by the same inputs as the
+receipt cache (org settings, logo/signature versions, template version and
+engine), plus format and width. Changing a setting or uploading an asset gives
+a new key, so an admin trying out settings only waits for a render when
+something actually changed. The settings and asset endpoints also drop the
+org's thumbnails right away, so superseded ones don't hold memory.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import pymupdf
+from PIL import Image
+
+from app.core.config import get_settings
+from app.services.receipt_cache import get_receipt_cache
+from app.services.receipts import get_receipt_cache_key_for
+
+from template_generate.engines import get_engine_chain, render_receipt
+
+settings = get_settings()
+
+IMAGE_FORMATS = {'png': 'image/png', 'webp': 'image/webp'}
+WEBP_QUALITY = 85
+
+# Fixed sample data, so the preview of unchanged settings is always a cache hit
+PREVIEW_DONOR = {
+    "name": "John Doe",
+    "address": "221B Example Street, Mumbai",
+    "phone": "+91 98765 43210",
+    "email": "john.doe@example.com",
+    "pan": "ABCDE1234F"
+}
+PREVIEW_DONATION = {
+    "receipt_number": "PREVIEW/2024/001",
+    "amount": 10000.0,
+    "date": "2024-04-01",
+    "purpose": "General Fund",
+    "payment_mode": "Bank Transfer",
+    "payment_details": "NEFT Ref 123456"
+}
+
+
+def render_pdf_thumbnail(pdf_bytes, width, image_format='png', page_number=0):
+    """Rasterize one page of a PDF to PNG/WebP bytes, ``width`` pixels wide."""
+    doc = pymupdf.open(stream=pdf_bytes, filetype='pdf')
+    try:
+        page = doc[page_number]
+        zoom = width / page.rect.width
+        pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+        if image_format == 'png':
+            return pixmap.tobytes('png')
+        image = Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+        buffer = BytesIO()
+        image.save(buffer, format='WEBP', quality=WEBP_QUALITY)
+        return buffer.getvalue()
+    finally:
+        doc.close()
+
+
+class ThumbnailCache:
+    """In-memory LRU of preview images, bounded by total size."""
+
+    def __init__(self, max_mb=16):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, org_id, key):
+        with self._lock:
+            data = self._entries.get((str(org_id), key))
+            if data is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end((str(org_id), key))
+            self._hits += 1
+            return data
+
+    def put(self, org_id, key, data):
+        if len(data) > self.max_bytes:
+            return
+        entry_key = (str(org_id), key)
+        with self._lock:
+            previous = self._entries.pop(entry_key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[entry_key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def invalidate(self, org_id):
+        """Drop an organization's thumbnails (its settings or assets changed)."""
+        with self._lock:
+            for entry_key in [entry_key for entry_key in self._entries if entry_key[0] == str(org_id)]:
+                self._size -= len(self._entries.pop(entry_key))
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "hits": self._hits, "misses": self._misses}
+
+
+_thumbnail_cache = None
+_thumbnail_cache_lock = threading.Lock()
+
+
+def get_thumbnail_cache():
+    """Return the process-wide thumbnail cache, creating it on first use."""
+    global _thumbnail_cache
+    with _thumbnail_cache_lock:
+        if _thumbnail_cache is None:
+            _thumbnail_cache = ThumbnailCache(settings.RECEIPT_PREVIEW_CACHE_MAX_MB)
+    return _thumbnail_cache
+
+
+def invalidate_receipt_previews(org_id):
+    get_thumbnail_cache().invalidate(org_id)
+
+
+def get_receipt_preview(org_id, org_settings, donor_type="Individual", image_format="png", width=None, if_none_match=None):
+    """
+    Thumbnail of page 1 of a sample receipt with the org's current settings (blocking).
+    Returns (image_bytes, etag); image_bytes is None when ``if_none_match``
+    already names the current preview.
+    """
+    width = width or settings.RECEIPT_PREVIEW_DEFAULT_WIDTH
+    org_data = org_settings.get('organization', {})
+    chain = get_engine_chain(org_settings.get('receipt_engine'))
+    if not chain:
+        raise RuntimeError("No receipt engine available")
+
+    pdf_key = get_receipt_cache_key_for(org_id, PREVIEW_DONOR, org_data, PREVIEW_DONATION, donor_type, chain[0])
+    key = f"{pdf_key}:{image_format}:{width}"
+    etag = f'"{hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]}"'
+    if if_none_match and etag in if_none_match:
+        return None, etag
+
+    thumbnails = get_thumbnail_cache()
+    image_bytes = thumbnails.get(org_id, key)
+    if image_bytes is not None:
+        return image_bytes, etag
+
+    # Other sizes/formats of the same preview share one rendered PDF
+    pdf_cache = get_receipt_cache() if settings.RECEIPT_CACHE_ENABLED else None
+    pdf_bytes = pdf_cache.get(org_id, pdf_key) if pdf_cache is not None else None
+    if pdf_bytes is None:
+        pdf_bytes, engine_name = render_receipt(PREVIEW_DONOR, org_data, PREVIEW_DONATION, donor_type, org_id, chain=chain)
+        if pdf_cache is not None and engine_name == chain[0].name:
+            pdf_cache.put(org_id, pdf_key, pdf_bytes)
+
+    image_bytes = render_pdf_thumbnail(pdf_bytes, width, image_format)
+    thumbnails.put(org_id, key, image_bytes)
+    return image_bytes, etag
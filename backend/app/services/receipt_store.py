@@ -0,0 +1,150 @@
+"""
+Issued receipts in object storage.
+
+The first time a donation's receipt is generated, the PDF is uploaded to the
+Supabase bucket under
+``<org_id>/receipts/<donation_id>/<receipt_number>-<content key>.pdf`` and the
+key is recorded in ``donations.receipt_path``. The content key is a hash of
+everything printed on the receipt (donation, donor, organization profile,
+logo/signature and template versions; see get_receipt_content_key in
+app/services/receipts.py). While it still matches, the stored PDF is what gets
+downloaded, emailed and zipped, with no rendering. Once the donation, the
+donor or the organization changes, the key no longer matches, so the receipt
+is rendered and stored again (and the superseded object deleted).
+Regeneration can also be requested explicitly.
+
+``receipt_path`` values from the Streamlit app (local ``uploads/...`` paths)
+are not under the org's storage prefix and are treated as not stored.
+"""
+from botocore.exceptions import ClientError
+
+from app.core.config import get_settings
+from app.services.asset_cache import NOT_FOUND_CODES, get_storage_client
+
+settings = get_settings()
+
+CONTENT_KEY_LENGTH = 16  # hex digits of the content key kept in the object key
+
+
+def get_receipt_object_key(org_id, donation, content_key):
+    """Org-scoped storage key of a donation's receipt with the given contents."""
+    return f"{org_id}/receipts/{donation.id}/{donation.receipt_number.replace('/', '_')}-{content_key[:CONTENT_KEY_LENGTH]}.pdf"
+
+
+def is_stored_receipt_path(org_id, receipt_path):
+    return bool(receipt_path) and receipt_path.startswith(f"{org_id}/receipts/")
+
+
+def get_stored_receipt_key(org_id, donation, content_key):
+    """
+    The donation's recorded receipt key, or None when it was never stored by
+    the API or was stored with contents that have changed since.
+    """
+    if not settings.RECEIPT_STORAGE_ENABLED or not is_stored_receipt_path(org_id, donation.receipt_path):
+        return None
+    if donation.receipt_path != get_receipt_object_key(org_id, donation, content_key):
+        print(f"♻️ Stored receipt {donation.receipt_path} is out of date, rendering it again")
+        return None
+    return donation.receipt_path
+
+
+def upload_receipt_pdf(org_id, donation, pdf_bytes, content_key):
+    """
+    Upload a receipt without recording it (blocking).
+    Returns (key, ETag), or (None, None) when storage is disabled or the upload failed.
+    """
+    if not settings.RECEIPT_STORAGE_ENABLED:
+        return None, None
+    key = get_receipt_object_key(org_id, donation, content_key)
+    try:
+        response = get_storage_client().put_object(
+            Bucket=settings.SUPABASE_STORAGE_BUCKET,
+            Key=key,
+            Body=pdf_bytes,
+            ContentType="application/pdf",
+            Metadata={"receipt-number": donation.receipt_number, "donation-id": str(donation.id)}
+        )
+    except Exception as e:
+        print(f"⚠️ Warning: Could not store receipt {donation.receipt_number}: {e}")
+        return None, None
+    print(f"📤 Stored receipt {donation.receipt_number} at {key}")
+    return key, response.get("ETag")
+
+
+def store_receipt_pdf(db, donation, org_id, pdf_bytes, content_key):
+    """
+    Upload a receipt and record its key on the donation (blocking).
+    Returns the ETag, or None when storage is disabled or the upload failed.
+    """
+    key, etag = upload_receipt_pdf(org_id, donation, pdf_bytes, content_key)
+    if key and donation.receipt_path != key:
+        superseded = donation.receipt_path
+        donation.receipt_path = key
+        db.commit()
+        if is_stored_receipt_path(org_id, superseded):
+            delete_stored_receipt(superseded)
+    return etag
+
+
+def delete_stored_receipt(key):
+    """Remove a superseded receipt object (best effort)."""
+    try:
+        get_storage_client().delete_object(Bucket=settings.SUPABASE_STORAGE_BUCKET, Key=key)
+    except Exception as e:
+        print(f"⚠️ Warning: Could not delete superseded receipt {key}: {e}")
+
+
+def head_stored_receipt(key):
+    """Size/ETag/Last-Modified of a stored receipt, or None when the object is gone."""
+    try:
+        response = get_storage_client().head_object(Bucket=settings.SUPABASE_STORAGE_BUCKET, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in NOT_FOUND_CODES:
+            return None
+        raise
+    return {
+        "size": response["ContentLength"],
+        "etag": response.get("ETag"),
+        "last_modified": response.get("LastModified"),
+    }
+
+
+def open_stored_receipt(key, byte_range=None, if_none_match=None, if_match=None):
+    """
+    Start reading a stored receipt. ``byte_range`` is an HTTP Range value
+    (``bytes=a-b``); the conditions are passed through to storage, which
+    answers 304/412 as a ClientError. Returns the get_object response
+    (``Body`` streams).
+    """
+    params = {"Bucket": settings.SUPABASE_STORAGE_BUCKET, "Key": key}
+    if byte_range:
+        params["Range"] = byte_range
+    if if_none_match:
+        params["IfNoneMatch"] = if_none_match
+    if if_match:
+        params["IfMatch"] = if_match
+    return get_storage_client().get_object(**params)
+
+
+def read_stored_receipt(key):
+    """Whole stored receipt as bytes, or None when the object is gone."""
+    try:
+        return open_stored_receipt(key)["Body"].read()
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in NOT_FOUND_CODES:
+            return None
+        raise
+
+
+def get_presigned_receipt_url(key, filename):
+    """Time-limited direct download URL of a stored receipt."""
+    return get_storage_client().generate_presigned_url(
+        "get_object",
+        Params={
+            "Bucket": settings.SUPABASE_STORAGE_BUCKET,
+            "Key": key,
+            "ResponseContentType": "application/pdf",
+            "ResponseContentDisposition": f"attachment; filename={filename}",
+        },
+        ExpiresIn=settings.RECEIPT_PRESIGNED_URL_SECONDS
+    )
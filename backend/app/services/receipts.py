@@ -0,0 +1,288 @@
+"""
+Receipt generation shared by the download and email endpoints.
+
+Builds the template inputs from a donation/donor row, serves the PDF from the
+receipt cache when the same inputs were rendered before, and otherwise renders
+it with the org's receipt engine, trying the configured fallback engines in
+order (see template_generate/engines.py).
+
+get_receipt_pdf_async is the same for async endpoints: storage and template work
+run in worker threads and the Chromium print is awaited, with at most
+RECEIPT_RENDER_CONCURRENCY renders in flight per worker process.
+
+get_issued_receipt_pdf(_async) returns the receipt stored in object storage when
+the donation has one showing its current details, and otherwise renders,
+stores and records it (see
+app/services/receipt_store.py). send_receipt_pdf_email mails a receipt to the
+donor (used by the email endpoint and by queued receipt jobs) within the
+account's sending limits (app/services/email_rate_limits.py).
+"""
+import asyncio
+import os
+import tempfile
+
+from app.core.config import get_settings
+from app.services.asset_cache import get_org_asset_versions
+from app.services.email_rate_limits import get_email_rate_limiter
+from app.services.receipt_cache import get_receipt_cache, get_receipt_cache_key
+from app.services.receipt_store import get_stored_receipt_key, read_stored_receipt, store_receipt_pdf
+
+settings = get_settings()
+
+from template_generate.engines import get_engine_chain, render_receipt, render_receipt_async
+from template_generate.pdf_optimize import get_optimize_tag
+from template_generate.template_engine import TEMPLATE_VERSION
+
+
+def get_payment_details_display(payment_details, payment_mode):
+    """Extract and format payment details for receipt display"""
+    try:
+        if not payment_details or payment_details == {}:
+            return "N/A"
+
+        if isinstance(payment_details, dict):
+            # Try to extract meaningful payment info based on payment mode
+            if payment_mode and payment_mode.lower() in ['upi', 'online', 'digital']:
+                # For digital payments, look for transaction ID, UPI ID, etc.
+                for key in ['transaction_id', 'txn_id', 'upi_id', 'ref_number', 'reference']:
+                    if key in payment_details:
+                        return str(payment_details[key])
+            elif payment_mode and payment_mode.lower() in ['cheque', 'check']:
+                # For cheques, look for cheque number
+                for key in ['cheque_number', 'check_number', 'cheque_no']:
+                    if key in payment_details:
+                        return f"Cheque No: {payment_details[key]}"
+            elif payment_mode and payment_mode.lower() in ['neft', 'rtgs', 'bank_transfer']:
+                # For bank transfers, look for reference number
+                for key in ['reference_number', 'ref_no', 'transaction_id']:
+                    if key in payment_details:
+                        return str(payment_details[key])
+
+            # If no specific field found, return first non-empty value
+            for value in payment_details.values():
+                if value and str(value).strip():
+                    return str(value)
+
+        # Fallback: convert to string
+        return str(payment_details) if payment_details else "N/A"
+
+    except Exception as e:
+        print(f"Error processing payment details: {e}")
+        return "N/A"
+
+
+def format_donation_date(donation):
+    return donation.date.strftime("%Y-%m-%d") if hasattr(donation.date, 'strftime') else str(donation.date)
+
+
+def build_receipt_inputs(donation, donor, org_settings):
+    """
+    Prepare the template inputs for one donation.
+    Returns (donor_data, org_data, donation_data, donor_type).
+    """
+    donor_data = {
+        "name": donor.full_name,
+        "address": donor.address or "Address Not Provided",
+        "phone": donor.phone or "Phone Not Provided",
+        "email": donor.email or "Email Not Provided",
+        "pan": donor.pan or "N/A"
+    }
+
+    org_data = org_settings.get('organization', {})
+
+    donation_data = {
+        "receipt_number": donation.receipt_number,
+        "amount": float(donation.amount),
+        "date": format_donation_date(donation),
+        "purpose": donation.purpose or "General Fund",
+        "payment_mode": donation.payment_mode or "Online",
+        "payment_details": get_payment_details_display(donation.payment_details, donation.payment_mode)
+    }
+
+    # Determine donor type - check for Company/Individual
+    donor_type = getattr(donor, 'donor_type', 'Individual')
+    return donor_data, org_data, donation_data, donor_type
+
+
+def get_receipt_cache_key_for(org_id, donor_data, org_data, donation_data, donor_type, engine):
+    """Cache key for a receipt, including the current logo/signature and template versions."""
+    return get_receipt_cache_key(
+        donor_data, org_data, donation_data, donor_type,
+        get_org_asset_versions(org_id), TEMPLATE_VERSION, engine.get_cache_tag() + get_optimize_tag()
+    )
+
+
+def get_receipt_content_key(org_id, donation, donor, org_settings):
+    """
+    Key of what is printed on a donation's receipt (not of how it is rendered);
+    a stored receipt is reissued when it changes (blocking: asset versions).
+    """
+    donor_data, org_data, donation_data, donor_type = build_receipt_inputs(donation, donor, org_settings)
+    return get_receipt_cache_key(donor_data, org_data, donation_data, donor_type, get_org_asset_versions(org_id), TEMPLATE_VERSION)
+
+
+def get_receipt_pdf(donation, donor, org_id, org_settings, use_cache=True):
+    """
+    Return the receipt PDF bytes for a donation, from the cache when the same
+    inputs were rendered before (unless use_cache is False).
+    """
+    donor_data, org_data, donation_data, donor_type = build_receipt_inputs(donation, donor, org_settings)
+    chain = get_engine_chain(org_settings.get('receipt_engine'))
+
+    cache = get_receipt_cache() if settings.RECEIPT_CACHE_ENABLED and chain else None
+    cache_key = None
+    if cache is not None and use_cache:
+        cache_key = get_receipt_cache_key_for(org_id, donor_data, org_data, donation_data, donor_type, chain[0])
+        pdf_bytes = cache.get(org_id, cache_key)
+        if pdf_bytes is not None:
+            print(f"⚡ Serving cached receipt {donation.receipt_number}")
+            return pdf_bytes
+
+    print(f"Debug: Generating receipt for donor type: {donor_type}")
+    pdf_bytes, engine_name = render_receipt(donor_data, org_data, donation_data, donor_type, org_id, chain=chain)
+
+    # Fallback output isn't cached, so the next request retries the preferred engine
+    if cache is not None and engine_name == chain[0].name:
+        cache_key = cache_key or get_receipt_cache_key_for(org_id, donor_data, org_data, donation_data, donor_type, chain[0])
+        cache.put(org_id, cache_key, pdf_bytes)
+    return pdf_bytes
+
+
+_render_semaphore = None
+
+
+def get_render_semaphore():
+    """Limit of concurrent async renders (created on the running event loop)."""
+    global _render_semaphore
+    if _render_semaphore is None:
+        _render_semaphore = asyncio.Semaphore(max(1, settings.RECEIPT_RENDER_CONCURRENCY))
+    return _render_semaphore
+
+
+async def get_receipt_pdf_async(donation, donor, org_id, org_settings, use_cache=True):
+    """
+    Async get_receipt_pdf: same cache and engine chain, without holding a
+    threadpool worker while Chromium renders.
+    """
+    donor_data, org_data, donation_data, donor_type = build_receipt_inputs(donation, donor, org_settings)
+    chain = get_engine_chain(org_settings.get('receipt_engine'))
+
+    cache = get_receipt_cache() if settings.RECEIPT_CACHE_ENABLED and chain else None
+    cache_key = None
+    if cache is not None and use_cache:
+        # Asset versions may need a storage round-trip and lower cache tiers read disk/S3
+        cache_key = await asyncio.to_thread(get_receipt_cache_key_for, org_id, donor_data, org_data, donation_data, donor_type, chain[0])
+        pdf_bytes = await asyncio.to_thread(cache.get, org_id, cache_key)
+        if pdf_bytes is not None:
+            print(f"⚡ Serving cached receipt {donation.receipt_number}")
+            return pdf_bytes
+
+    print(f"Debug: Generating receipt for donor type: {donor_type}")
+    async with get_render_semaphore():
+        pdf_bytes, engine_name = await render_receipt_async(donor_data, org_data, donation_data, donor_type, org_id, chain=chain)
+
+    if cache is not None and engine_name == chain[0].name:
+        cache_key = cache_key or await asyncio.to_thread(get_receipt_cache_key_for, org_id, donor_data, org_data, donation_data, donor_type, chain[0])
+        await asyncio.to_thread(cache.put, org_id, cache_key, pdf_bytes)
+    return pdf_bytes
+
+
+def get_issued_receipt_pdf(db, donation, donor, org_id, org_settings, regenerate=False):
+    """
+    The donation's stored receipt; rendered, stored and recorded on the
+    donation when it has none yet, when what it shows has changed or when
+    regenerate is set (blocking).
+    """
+    content_key = get_receipt_content_key(org_id, donation, donor, org_settings)
+    key = None if regenerate else get_stored_receipt_key(org_id, donation, content_key)
+    if key:
+        pdf_bytes = read_stored_receipt(key)
+        if pdf_bytes is not None:
+            return pdf_bytes
+        print(f"⚠️ Stored receipt {key} is missing, rendering it again")
+
+    pdf_bytes = get_receipt_pdf(donation, donor, org_id, org_settings, use_cache=not regenerate)
+    store_receipt_pdf(db, donation, org_id, pdf_bytes, content_key)
+    return pdf_bytes
+
+
+async def get_issued_receipt_pdf_async(db, donation, donor, org_id, org_settings, regenerate=False):
+    """Async get_issued_receipt_pdf: storage and database work run in worker threads."""
+    content_key = await asyncio.to_thread(get_receipt_content_key, org_id, donation, donor, org_settings)
+    key = None if regenerate else get_stored_receipt_key(org_id, donation, content_key)
+    if key:
+        pdf_bytes = await asyncio.to_thread(read_stored_receipt, key)
+        if pdf_bytes is not None:
+            return pdf_bytes
+        print(f"⚠️ Stored receipt {key} is missing, rendering it again")
+
+    pdf_bytes = await get_receipt_pdf_async(donation, donor, org_id, org_settings, use_cache=not regenerate)
+    await asyncio.to_thread(store_receipt_pdf, db, donation, org_id, pdf_bytes, content_key)
+    return pdf_bytes
+
+
+class ReceiptEmailError(Exception):
+    """
+    Receipt email could not be sent. ``permanent`` errors won't succeed on
+    retry; ``retry_after`` is set when the account's sending limit was reached.
+    """
+
+    def __init__(self, message, permanent=False, retry_after=None):
+        super().__init__(message)
+        self.permanent = permanent
+        self.retry_after = retry_after
+
+
+def send_receipt_pdf(donation, donor, org_id, org_settings, pdf_bytes, email_config=None, to_email=None):
+    """Mail the receipt PDF to the donor (or ``to_email``) over SMTP (blocking). Nothing is recorded."""
+    from modules.email_utils import get_email_config, send_email_receipt, validate_email_config
+
+    org_details = org_settings.get('organization', {})
+    receipt_number = donation.receipt_number
+    safe_receipt_number = receipt_number.replace('/', '_')
+
+    # Format donation date for email (DD/MM/YYYY format)
+    donation_date_formatted = donation.date.strftime("%d/%m/%Y") if hasattr(donation.date, 'strftime') else str(donation.date)
+
+    # Validate SMTP configuration before proceeding
+    if email_config is None:
+        email_config = get_email_config(org_id)
+    error_msg = validate_email_config(email_config)
+    if error_msg:
+        raise ReceiptEmailError(error_msg, permanent=True)
+
+    wait = get_email_rate_limiter().acquire(email_config, settings.EMAIL_RATE_LIMIT_MAX_WAIT_SECONDS)
+    if wait:
+        raise ReceiptEmailError(f"Sending limit reached for {email_config['email_address']}, retry in {wait:.0f}s", retry_after=wait)
+
+    # The attachment is named after the file, so write it under its receipt number
+    # in a directory of its own (receipt numbers repeat across organizations)
+    with tempfile.TemporaryDirectory(prefix="receipt-email-") as temp_dir:
+        receipt_path = os.path.join(temp_dir, f"{safe_receipt_number}.pdf")
+        with open(receipt_path, 'wb') as f:
+            f.write(pdf_bytes)
+
+        # Use organization details from database for email
+        email_sent = send_email_receipt(
+            to_email=to_email or donor.email,
+            donor_name=donor.full_name,
+            receipt_path=receipt_path,
+            amount=float(donation.amount),
+            receipt_number=receipt_number,
+            purpose=donation.purpose,
+            payment_mode=donation.payment_mode,
+            org_details=org_details,
+            donation_date=donation_date_formatted,  # Pass the actual donation date
+            organization_id=org_id  # Pass organization ID for email config
+        )
+    if not email_sent:
+        raise ReceiptEmailError("Failed to send email receipt")
+
+
+def send_receipt_pdf_email(db, donation, donor, org_id, org_settings, pdf_bytes):
+    """Send the receipt PDF and mark the donation as emailed (blocking)."""
+    send_receipt_pdf(donation, donor, org_id, org_settings, pdf_bytes)
+
+    # Update donation to mark email as sent
+    donation.email_sent = True
+    db.commit()
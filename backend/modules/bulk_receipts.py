@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Bulk ReportLab receipts across CPU cores.
+
+The drawn receipt (modules/pdf_template.py) is CPU-bound, so a backfill of a
+year of imported donations runs on a ProcessPoolExecutor. Org details and the
+logo/signature bytes are fetched once in the parent and handed to every
+worker when it starts; the workers never touch the database or storage.
+Donations are sent in chunks, with only a few chunks per worker in flight,
+and PDFs come back in input order.
+
+    cd backend
+    python -m modules.bulk_receipts donations.json --organization-id <org_id> \\
+        --output receipts.zip --workers 8
+
+donations.json is a list (or JSON lines) of the dicts generate_receipt_bytes
+takes: name, amount, date, receipt_number, purpose, payment_mode, pan.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from itertools import islice
+
+# Add the backend app path to import settings
+backend_dir = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, backend_dir)
+
+DEFAULT_CHUNK_SIZE = 16
+CHUNKS_PER_WORKER = 2  # in flight per worker; the rest wait for a result to be taken
+
+# Set in each worker by init_worker
+_worker_org_data = None
+_worker_resources = None
+
+
+def init_worker(org_data, assets):
+    """Worker start: prepare the org's images once for every receipt it renders."""
+    global _worker_org_data, _worker_resources
+    from modules.pdf_template import prepare_receipt_image
+
+    _worker_org_data = org_data
+    _worker_resources = {asset_type: prepare_receipt_image(data) if data else None for asset_type, data in assets.items()}
+
+
+def render_chunk(donor_data_chunk):
+    """Render a chunk of receipts in a worker. Returns their PDF bytes in order."""
+    from modules.pdf_template import DonationReceipt
+
+    pdfs = []
+    for donor_data in donor_data_chunk:
+        buffer = BytesIO()
+        DonationReceipt(donor_data, _worker_org_data, _worker_resources).generate(buffer)
+        pdfs.append(buffer.getvalue())
+    return pdfs
+
+
+def load_bulk_inputs(organization_id=None):
+    """Org details and raw logo/signature bytes, fetched once for the whole run."""
+    from modules.pdf_template import get_s3_asset, load_receipt_org_data
+
+    assets = {}
+    for asset_type in ('logo', 'signature'):
+        try:
+            assets[asset_type] = get_s3_asset(organization_id, asset_type) if organization_id else None
+        except Exception as e:
+            print(f"⚠️ Warning: Could not load {asset_type} for {organization_id}: {e}")
+            assets[asset_type] = None
+    return load_receipt_org_data(organization_id), assets
+
+
+def iter_chunks(items, chunk_size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def generate_receipts_parallel(donor_data_list, organization_id=None, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield receipt PDF bytes for each donor_data, in input order, rendered by
+    ``workers`` processes (default: one per core). ``donor_data_list`` may be
+    any iterable; it is consumed only as fast as results are taken.
+    """
+    workers = workers or os.cpu_count() or 1
+    org_data, assets = load_bulk_inputs(organization_id)
+
+    if workers <= 1:
+        init_worker(org_data, assets)
+        for chunk in iter_chunks(donor_data_list, chunk_size):
+            yield from render_chunk(chunk)
+        return
+
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_worker,
+        initargs=(org_data, assets)
+    )
+    pending = deque()
+    try:
+        for chunk in iter_chunks(donor_data_list, chunk_size):
+            pending.append(pool.submit(render_chunk, chunk))
+            # Back-pressure: wait for the oldest chunk before queueing more
+            if len(pending) >= workers * CHUNKS_PER_WORKER:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def get_receipt_filename(donor_data, index):
+    receipt_number = str(donor_data.get('receipt_number') or f"receipt_{index + 1}")
+    return f"{receipt_number.replace('/', '_')}.pdf"
+
+
+def write_receipts(donor_data_list, output, organization_id=None, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Render receipts in parallel and write them, in input order, to a ZIP
+    (``output`` ending in .zip) or a directory. Returns the number written.
+    """
+    donor_data_list = list(donor_data_list)
+    pdfs = generate_receipts_parallel(donor_data_list, organization_id, workers, chunk_size)
+
+    count = 0
+    if output.endswith('.zip'):
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as archive:
+            for index, pdf_bytes in enumerate(pdfs):
+                archive.writestr(get_receipt_filename(donor_data_list[index], index), pdf_bytes)
+                count += 1
+    else:
+        os.makedirs(output, exist_ok=True)
+        for index, pdf_bytes in enumerate(pdfs):
+            with open(os.path.join(output, get_receipt_filename(donor_data_list[index], index)), 'wb') as f:
+                f.write(pdf_bytes)
+            count += 1
+    return count
+
+
+def load_donor_data(path):
+    with open(path, 'r') as f:
+        text = f.read().strip()
+    if text.startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate ReportLab receipts in bulk across CPU cores")
+    parser.add_argument('input', help="JSON list (or JSON lines) of donor_data dicts")
+    parser.add_argument('--organization-id', help="organization whose details, logo and signature to use")
+    parser.add_argument('--output', default='receipts.zip', help="ZIP file or directory to write (default: receipts.zip)")
+    parser.add_argument('--workers', type=int, default=0, help="worker processes (default: one per core)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="receipts per task sent to a worker")
+    args = parser.parse_args(argv)
+
+    donor_data_list = load_donor_data(args.input)
+    workers = args.workers or os.cpu_count() or 1
+    print(f"🧾 Generating {len(donor_data_list)} receipts with {workers} workers...")
+    start = time.perf_counter()
+    count = write_receipts(donor_data_list, args.output, args.organization_id, workers, max(1, args.chunk_size))
+    elapsed = time.perf_counter() - start
+    print(f"✅ Wrote {count} receipts to {args.output} in {elapsed:.1f}s ({count / elapsed if elapsed else 0:.1f} receipts/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Per-organization email templates, compiled and cached.
+
+A template is split once into literal text and ``{{placeholder}}`` names, so
+filling it in is a single pass over the parts instead of a chain of
+``str.replace`` calls (values are never rescanned for placeholders). All of an
+organization's active templates (body and subject) are loaded with one query
+on the first email after a change and kept, compiled, in an LRU keyed by
+organization and template type. The file/default fallback for types it has no
+template for is compiled and cached too, so sending an email needs no
+database round-trip for templates.
+
+The /email-templates endpoints drop an organization's entries when its
+templates change. Other processes pick up changes once their entries are
+older than ``EMAIL_TEMPLATE_CACHE_TTL_SECONDS``.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMAIL_TEMPLATE_CACHE_SIZE = int(os.getenv("EMAIL_TEMPLATE_CACHE_SIZE", "512"))
+EMAIL_TEMPLATE_CACHE_TTL_SECONDS = float(os.getenv("EMAIL_TEMPLATE_CACHE_TTL_SECONDS", "300"))
+
+PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
+
+
+class CompiledTemplate:
+    """A template split into literal text (even parts) and placeholder names (odd parts)."""
+
+    def __init__(self, source):
+        self.source = source
+        self.parts = PLACEHOLDER_RE.split(source)
+
+    def render(self, values):
+        """Fill in the placeholders; ones without a value are left as written."""
+        parts = self.parts
+        out = []
+        for index, part in enumerate(parts):
+            if index % 2 == 0:
+                out.append(part)
+            else:
+                value = values.get(part)
+                out.append("{{" + part + "}}" if value is None else str(value))
+        return "".join(out)
+
+
+def load_org_email_templates(organization_id):
+    """The organization's active templates by type, from one query."""
+    from app.db.session import SessionLocal
+    from app.models.email_template import OrganizationEmailTemplate
+
+    db = SessionLocal()
+    try:
+        rows = db.query(OrganizationEmailTemplate.template_type, OrganizationEmailTemplate.content).filter(
+            OrganizationEmailTemplate.organization_id == organization_id,
+            OrganizationEmailTemplate.is_active == True
+        ).all()
+    finally:
+        db.close()
+
+    templates = {}
+    for template_type, content in rows:
+        templates.setdefault(template_type, content)
+    return templates
+
+
+class EmailTemplateCache:
+    """LRU of each organization's compiled templates, plus the compiled defaults."""
+
+    def __init__(self, max_entries=512, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # organization id -> ({template type: CompiledTemplate}, loaded at)
+        self._defaults = {}  # template type -> (CompiledTemplate, loaded at)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, organization_id, template_type, load_default):
+        """
+        Compiled template of the given type for the organization, or of
+        ``load_default()`` when it has none (or when no organization is given).
+        """
+        templates = self.get_org_templates(organization_id) if organization_id else {}
+        template = templates.get(template_type)
+        if template is not None:
+            return template
+
+        with self._lock:
+            entry = self._defaults.get(template_type)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl_seconds:
+                return entry[0]
+        template = CompiledTemplate(load_default())
+        with self._lock:
+            self._defaults[template_type] = (template, time.monotonic())
+        return template
+
+    def get_org_templates(self, organization_id):
+        key = str(organization_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[0]
+            self._misses += 1
+
+        try:
+            templates = {template_type: CompiledTemplate(content) for template_type, content in load_org_email_templates(organization_id).items()}
+        except Exception as e:
+            # Not cached, so the next email tries the database again
+            print(f"Error fetching email templates from database: {e}")
+            return {}
+
+        with self._lock:
+            self._entries[key] = (templates, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return templates
+
+    def invalidate(self, organization_id):
+        """Drop an organization's templates (they were created, changed or deleted)."""
+        with self._lock:
+            self._entries.pop(str(organization_id), None)
+
+    def stats(self):
+        with self._lock:
+            return {"organizations": len(self._entries), "hits": self._hits, "misses": self._misses}
+
+
+_email_template_cache = None
+_email_template_cache_lock = threading.Lock()
+
+
+def get_email_template_cache():
+    """Return the process-wide template cache, creating it on first use."""
+    global _email_template_cache
+    with _email_template_cache_lock:
+        if _email_template_cache is None:
+            _email_template_cache = EmailTemplateCache(EMAIL_TEMPLATE_CACHE_SIZE, EMAIL_TEMPLATE_CACHE_TTL_SECONDS)
+    return _email_template_cache
+
+
+def invalidate_email_templates(organization_id):
+    get_email_template_cache().invalidate(organization_id)
@@ -1,8 +1,6 @@
-import smtplib
 from email.message import EmailMessage
 import os
 from dotenv import load_dotenv
-from .email_template import get_template, get_subject
 from datetime import datetime
 import json
 from num2words import num2words
@@ -11,6 +9,8 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
 from .supabase_utils import get_organization_settings
+from .smtp_pool import get_smtp_pool
+from .email_template_cache import get_email_template_cache
 
 load_dotenv()
 
@@ -140,78 +140,22 @@ def convert_to_html(text, org_details):
     return html
 
 def get_email_template_from_db(organization_id, template_type):
-    """Get email template from database for organization"""
-    try:
-        from app.db.session import get_db
-        from app.models.email_template import OrganizationEmailTemplate
-        
-        # Get database session
-        db = next(get_db())
-        
-        # Query for active template
-        template = db.query(OrganizationEmailTemplate).filter(
-            OrganizationEmailTemplate.organization_id == organization_id,
-            OrganizationEmailTemplate.template_type == template_type,
-            OrganizationEmailTemplate.is_active == True
-        ).first()
-        
-        if template:
-            return template.content
-        else:
-            print(f"No {template_type} found for organization {organization_id}, using default")
-            return None
-            
-    except Exception as e:
-        print(f"Error fetching email template from database: {e}")
-        return None
+    """Get an organization's email template (cached; None when it has none)"""
+    template = get_email_template_cache().get_org_templates(organization_id).get(template_type)
+    return template.source if template is not None else None
+
+def get_compiled_template(organization_id, template_type):
+    """Compiled email body or subject for organization, falling back to file/default"""
+    load_default = load_email_subject if template_type == 'receipt_subject' else load_email_template
+    return get_email_template_cache().get(organization_id, template_type, load_default)
 
 def get_template_for_organization(organization_id=None):
     """Get email template for organization from database or fallback to file/default"""
-    if organization_id:
-        # Try to get from database first
-        db_template = get_email_template_from_db(organization_id, 'receipt_template')
-        if db_template:
-            return db_template
-    
-    # Fallback to file-based template
-    try:
-        with open('config/email_template.txt', 'r') as f:
-            return f.read()
-    except FileNotFoundError:
-        return """Dear {{Name}},
-
-Thank you for your generous donation of Rs. {{Amount}} /- ({{AmountInWords}}) to {{orgName}}. Your contribution will help us make a difference in the lives of stray animals.
-
-Receipt Details:
-- Receipt Number: {{receiptNumber}}
-- Date: {{Date}}
-- Purpose: {{Purpose}}
-- Payment Mode: {{PaymentMode}}
-
-The official receipt is attached to this email.
-
-Best regards,
-{{orgDepartment}}
-{{orgName}}
-
-Contact us:
-{{orgEmail}} | {{orgPhone}}
-{{orgSocial}}"""
+    return get_compiled_template(organization_id, 'receipt_template').source
 
 def get_subject_for_organization(organization_id=None):
     """Get email subject for organization from database or fallback to file/default"""
-    if organization_id:
-        # Try to get from database first
-        db_subject = get_email_template_from_db(organization_id, 'receipt_subject')
-        if db_subject:
-            return db_subject
-    
-    # Fallback to file-based subject
-    try:
-        with open('config/email_subject.txt', 'r') as f:
-            return f.read()
-    except FileNotFoundError:
-        return "Thank you for your donation - {{Name}}"
+    return get_compiled_template(organization_id, 'receipt_subject').source
 
 def validate_email_config(email_config):
     """Validate email configuration and return error if invalid"""
@@ -299,12 +243,6 @@ def send_email_receipt(to_email, donor_name, receipt_path, amount, receipt_numbe
         msg = MIMEMultipart('alternative')
         msg['From'] = email_config['email_address']
         msg['To'] = to_email
-        # Get and format subject line
-        subject_template = get_subject_for_organization(organization_id)
-        subject = subject_template.replace("{{Name}}", donor_name)
-        msg['Subject'] = subject
-        # Get the template and format it with all placeholders
-        template = get_template_for_organization(organization_id)
         # Convert amount to words
         try:
             amount_in_words = num2words(float(amount), lang='en_IN').title()
@@ -316,20 +254,24 @@ def send_email_receipt(to_email, donor_name, receipt_path, amount, receipt_numbe
             formatted_date = donation_date  # Already formatted as DD/MM/YYYY from calling function
         else:
             formatted_date = datetime.now().strftime("%d/%m/%Y")
-            
-        # Format the template with proper line breaks
-        email_body = template.replace("{{Name}}", donor_name)\
-                            .replace("{{Amount}}", str(amount))\
-                            .replace("{{AmountInWords}}", amount_in_words)\
-                            .replace("{{Date}}", formatted_date)\
-                            .replace("{{receiptNumber}}", receipt_number)\
-                            .replace("{{Purpose}}", purpose or "General Donation")\
-                            .replace("{{PaymentMode}}", payment_mode or "Online")\
-                            .replace("{{orgName}}", org_details.get('name', ''))\
-                            .replace("{{orgDepartment}}", org_details.get('department', 'Accounts Department'))\
-                            .replace("{{orgEmail}}", org_details.get('email', ''))\
-                            .replace("{{orgPhone}}", org_details.get('phone', ''))\
-                            .replace("{{orgSocial}}", social_text)
+        
+        placeholders = {
+            "Name": donor_name,
+            "Amount": str(amount),
+            "AmountInWords": amount_in_words,
+            "Date": formatted_date,
+            "receiptNumber": receipt_number,
+            "Purpose": purpose or "General Donation",
+            "PaymentMode": payment_mode or "Online",
+            "orgName": org_details.get('name', ''),
+            "orgDepartment": org_details.get('department', 'Accounts Department'),
+            "orgEmail": org_details.get('email', ''),
+            "orgPhone": org_details.get('phone', ''),
+            "orgSocial": social_text
+        }
+        # Subject and body come compiled from the template cache and are filled in one pass
+        msg['Subject'] = get_compiled_template(organization_id, 'receipt_subject').render(placeholders)
+        email_body = get_compiled_template(organization_id, 'receipt_template').render(placeholders)
         # Add plain text version
         msg.attach(MIMEText(email_body, 'plain', 'utf-8'))
         # Add HTML version
@@ -349,15 +291,8 @@ def send_email_receipt(to_email, donor_name, receipt_path, amount, receipt_numbe
         # Send the email using organization-specific SMTP settings
         print(f"Sending email from {email_config['email_address']} via {email_config['smtp_server']}:{email_config['smtp_port']}")
         
-        if email_config['use_tls']:
-            with smtplib.SMTP(email_config['smtp_server'], email_config['smtp_port']) as smtp:
-                smtp.starttls()
-                smtp.login(email_config['email_address'], email_config['email_password'])
-                smtp.send_message(msg)
-        else:
-            with smtplib.SMTP_SSL(email_config['smtp_server'], email_config['smtp_port']) as smtp:
-                smtp.login(email_config['email_address'], email_config['email_password'])
-                smtp.send_message(msg)
+        # Reuses an authenticated session of this account when one is pooled
+        get_smtp_pool().send_message(email_config, msg)
         
         print(f"✅ Email sent successfully to {to_email}")
         return True
@@ -0,0 +1,169 @@
+"""
+Per-organization settings, cached in the process.
+
+Building an organization's settings takes two Supabase REST calls (the
+``organizations`` row and its ``organization_settings``) plus parsing the JSON
+columns, and sending one receipt email used to do it three times. The built
+settings are kept in an LRU keyed by organization for
+``ORG_SETTINGS_CACHE_TTL_SECONDS``, and every lookup gets its own copy (callers
+fill in defaults in place).
+
+Saving settings (save_organization_settings, ``PUT /settings``,
+``PUT /settings/{key}``, ``PUT /organization/me``) drops the organization's
+entry. With ``ORG_SETTINGS_NOTIFY_CHANNEL`` set, the change is also announced
+with Postgres ``NOTIFY`` and each process listens on the channel, so the other
+API workers, the dispatchers and the Streamlit app drop theirs at once instead
+of when the TTL runs out.
+"""
+import copy
+import os
+import re
+import select
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ORG_SETTINGS_CACHE_SIZE = int(os.getenv("ORG_SETTINGS_CACHE_SIZE", "1024"))
+ORG_SETTINGS_CACHE_TTL_SECONDS = float(os.getenv("ORG_SETTINGS_CACHE_TTL_SECONDS", "60"))
+ORG_SETTINGS_NOTIFY_CHANNEL = os.getenv("ORG_SETTINGS_NOTIFY_CHANNEL", "")  # e.g. org_settings_changed; empty: TTL only
+
+CHANNEL_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+LISTEN_KEEPALIVE_SECONDS = 60
+LISTEN_RECONNECT_SECONDS = 5
+
+
+class OrgSettingsCache:
+    """LRU of each organization's settings, loaded by ``loader(organization_id)``."""
+
+    def __init__(self, loader, max_entries=1024, ttl_seconds=60):
+        self.loader = loader
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # organization id -> (settings, loaded at)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, organization_id):
+        """A copy of the organization's settings, loaded when not cached (or stale)."""
+        key = str(organization_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return copy.deepcopy(entry[0])
+            self._misses += 1
+
+        settings = self.loader(organization_id)
+        if not settings:
+            # Unknown organization or a failed load: not cached, so the next lookup retries
+            return settings
+
+        with self._lock:
+            self._entries[key] = (settings, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return copy.deepcopy(settings)
+
+    def invalidate(self, organization_id):
+        with self._lock:
+            self._entries.pop(str(organization_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"organizations": len(self._entries), "hits": self._hits, "misses": self._misses}
+
+
+class SettingsChangeListener(threading.Thread):
+    """Drops cached settings named by ``NOTIFY`` on the channel, reconnecting when the connection is lost."""
+
+    def __init__(self, cache, channel):
+        super().__init__(name="org-settings-listener", daemon=True)
+        self.cache = cache
+        self.channel = channel
+
+    def run(self):
+        while True:
+            try:
+                self.listen()
+            except Exception as e:
+                print(f"⚠️ Organization settings listener lost its connection, reconnecting: {e}")
+            # Changes made while not listening were missed
+            self.cache.clear()
+            time.sleep(LISTEN_RECONNECT_SECONDS)
+
+    def listen(self):
+        from app.db.session import engine
+
+        connection = engine.raw_connection()
+        connection.detach()  # autocommit and LISTENing, so it never goes back to the pool
+        try:
+            dbapi_connection = connection.dbapi_connection
+            dbapi_connection.autocommit = True
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f'LISTEN "{self.channel}"')
+            print(f"👂 Listening for organization settings changes on {self.channel}")
+            while True:
+                if not select.select([dbapi_connection], [], [], LISTEN_KEEPALIVE_SECONDS)[0]:
+                    cursor.execute("SELECT 1")  # raises when the connection died quietly
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notify = dbapi_connection.notifies.pop(0)
+                    self.cache.invalidate(notify.payload)
+        finally:
+            connection.close()
+
+
+def publish_settings_change(organization_id):
+    """``NOTIFY`` the other processes that the organization's settings changed."""
+    from sqlalchemy import text
+    from app.db.session import engine
+
+    try:
+        with engine.begin() as connection:
+            connection.execute(text("SELECT pg_notify(:channel, :organization_id)"),
+                               {"channel": ORG_SETTINGS_NOTIFY_CHANNEL, "organization_id": str(organization_id)})
+    except Exception as e:
+        # The other processes catch up when their entries expire
+        print(f"⚠️ Warning: Could not announce settings change for {organization_id}: {e}")
+
+
+_org_settings_cache = None
+_org_settings_cache_lock = threading.Lock()
+
+
+def get_org_settings_cache(loader=None):
+    """
+    Return the process-wide settings cache, creating it (with ``loader``) on
+    first use, and start listening for changes when a channel is configured.
+    """
+    global _org_settings_cache
+    with _org_settings_cache_lock:
+        if _org_settings_cache is None:
+            if loader is None:
+                from modules.supabase_utils import load_organization_settings as loader
+            _org_settings_cache = OrgSettingsCache(loader, ORG_SETTINGS_CACHE_SIZE, ORG_SETTINGS_CACHE_TTL_SECONDS)
+            if ORG_SETTINGS_NOTIFY_CHANNEL:
+                if CHANNEL_RE.match(ORG_SETTINGS_NOTIFY_CHANNEL):
+                    SettingsChangeListener(_org_settings_cache, ORG_SETTINGS_NOTIFY_CHANNEL).start()
+                else:
+                    print(f"⚠️ Warning: Invalid ORG_SETTINGS_NOTIFY_CHANNEL {ORG_SETTINGS_NOTIFY_CHANNEL!r}, not listening")
+    return _org_settings_cache
+
+
+def invalidate_organization_settings(organization_id):
+    """Drop the organization's cached settings here and, with a channel, in the other processes."""
+    get_org_settings_cache().invalidate(organization_id)
+    if ORG_SETTINGS_NOTIFY_CHANNEL and CHANNEL_RE.match(ORG_SETTINGS_NOTIFY_CHANNEL):
+        publish_settings_change(organization_id)
@@ -1,24 +1,24 @@
 import streamlit as st
 from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4, letter
+from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
-from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
-from reportlab.platypus import Paragraph, Table, TableStyle, Image, Spacer
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Table, TableStyle
 from reportlab.lib.utils import ImageReader
 from io import BytesIO
 import os
 from dotenv import load_dotenv
 import json
 import io
+import hashlib
+import threading
+from collections import OrderedDict
 from num2words import num2words
 from datetime import datetime
 from reportlab.lib.units import inch
 from modules.supabase_utils import get_organization_settings, get_organization_asset_path
 from PIL import Image
-import boto3
 from app.core.config import get_settings
+from app.services.asset_cache import get_org_asset, get_org_asset_versions
 settings = get_settings()
 
 load_dotenv()
@@ -37,28 +37,78 @@ DEFAULT_RECEIPT_SETTINGS = {
     }
 }
 
-def get_s3_client():
-    return boto3.client(
-        's3',
-        endpoint_url=settings.SUPABASE_STORAGE_URL,
-        region_name=settings.SUPABASE_STORAGE_REGION,
-        aws_access_key_id=settings.SUPABASE_STORAGE_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.SUPABASE_STORAGE_SECRET_ACCESS_KEY
-    )
+# Donation details table style; the same for every receipt
+TABLE_STYLE = TableStyle([
+    ('FONT', (0, 0), (-1, -1), FONT_NORMAL, 10),
+    ('FONT', (0, 0), (-1, 0), FONT_BOLD, 10),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('ALIGN', (3, 1), (3, 1), 'RIGHT'),  # Right align amount
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('BACKGROUND', (0, 0), (-1, 0), colors.white),
+    ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+    ('TOPPADDING', (0, 0), (-1, -1), 6),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+])
+
+# Prepared logo/signature per organization, keyed by the assets' versions
+RESOURCE_CACHE_SIZE = 32
+_resource_cache = OrderedDict()
+_resource_lock = threading.Lock()
 
 def get_s3_asset(org_id, asset_type):
-    s3_client = get_s3_client()
-    asset_key = f"{org_id}/assets/{asset_type}.png"
+    return get_org_asset(org_id, asset_type)
+
+def prepare_receipt_image(image_bytes):
+    """Decode an uploaded logo/signature into an ImageReader that every receipt can draw."""
+    pil_image = Image.open(io.BytesIO(image_bytes))
+    if pil_image.mode != 'RGBA':
+        pil_image = pil_image.convert('RGBA')
+    background = Image.new('RGBA', pil_image.size, (255, 255, 255, 0))
+    final_image = Image.alpha_composite(background, pil_image).convert('RGB')
+    reader = ImageReader(final_image)
+    reader.getRGBData()  # decoded pixels are kept on the reader
+    return reader
+
+def load_receipt_image(organization_id, asset_type):
     try:
-        response = s3_client.get_object(Bucket=settings.SUPABASE_STORAGE_BUCKET, Key=asset_key)
-        return response['Body'].read()
-    except Exception:
+        image_bytes = get_s3_asset(organization_id, asset_type)
+        return prepare_receipt_image(image_bytes) if image_bytes else None
+    except Exception as e:
+        print(f"{asset_type.capitalize()} error: {e}")
         return None
 
+def get_receipt_resources(organization_id=None):
+    """
+    Logo and signature ImageReaders for an organization, prepared once and
+    reused until either asset changes. Values are None when not uploaded.
+    """
+    if not organization_id:
+        return {'logo': None, 'signature': None}
+
+    versions = get_org_asset_versions(organization_id)
+    key = (str(organization_id), versions.get('logo'), versions.get('signature'))
+    with _resource_lock:
+        resources = _resource_cache.get(key)
+        if resources is not None:
+            _resource_cache.move_to_end(key)
+            return resources
+
+    resources = {asset_type: load_receipt_image(organization_id, asset_type) for asset_type in ('logo', 'signature')}
+    with _resource_lock:
+        # Drop the organization's previous versions along with the least recently used
+        for stale_key in [k for k in _resource_cache if k[0] == key[0]]:
+            del _resource_cache[stale_key]
+        _resource_cache[key] = resources
+        while len(_resource_cache) > RESOURCE_CACHE_SIZE:
+            _resource_cache.popitem(last=False)
+    return resources
+
 class DonationReceipt:
-    def __init__(self, donor_data, org_settings):
+    def __init__(self, donor_data, org_settings, resources=None):
         self.donor_data = donor_data
         self.org_settings = org_settings
+        self.resources = resources
         self.width, self.height = A4
         self.margin = DEFAULT_RECEIPT_SETTINGS['margin']
         
@@ -88,26 +138,17 @@ class DonationReceipt:
         top_margin = self.height - self.margin
         current_y = top_margin
         
+        # Prepared once per organization (see get_receipt_resources)
+        resources = self.resources
+        if resources is None:
+            resources = get_receipt_resources(getattr(self, 'organization_id', None))
+        
         # Add logo if available
         try:
-            logo_bytes = None
-            if hasattr(self, 'organization_id'):
-                logo_bytes = get_s3_asset(self.organization_id, 'logo')
-            if logo_bytes:
-                from PIL import Image as PILImage
-                import io
-                pil_image = PILImage.open(io.BytesIO(logo_bytes))
-                if pil_image.mode != 'RGBA':
-                    pil_image = pil_image.convert('RGBA')
-                background = PILImage.new('RGBA', pil_image.size, (255, 255, 255, 0))
-                final_image = PILImage.alpha_composite(background, pil_image)
-                final_image = final_image.convert('RGB')
-                logo_buffer = BytesIO()
-                final_image.save(logo_buffer, format='PNG')
-                logo_buffer.seek(0)
+            if resources['logo']:
                 logo_width = 1.5 * inch
                 logo_height = 1.5 * inch
-                c.drawImage(ImageReader(logo_buffer), left_margin, current_y - logo_height, width=logo_width, height=logo_height, preserveAspectRatio=True)
+                c.drawImage(resources['logo'], left_margin, current_y - logo_height, width=logo_width, height=logo_height, preserveAspectRatio=True)
         except Exception as e:
             print(f"Logo error: {e}")
             pass
@@ -210,18 +251,7 @@ class DonationReceipt:
         ]
         
         table = Table(data, colWidths=col_widths)
-        table.setStyle(TableStyle([
-            ('FONT', (0, 0), (-1, -1), FONT_NORMAL, 10),
-            ('FONT', (0, 0), (-1, 0), FONT_BOLD, 10),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('ALIGN', (3, 1), (3, 1), 'RIGHT'),  # Right align amount
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('BACKGROUND', (0, 0), (-1, 0), colors.white),
-            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-            ('TOPPADDING', (0, 0), (-1, -1), 6),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-        ]))
+        table.setStyle(TABLE_STYLE)
         table.wrapOn(c, table_width, 50)
         table.drawOn(c, left_margin, current_y - 50)
         
@@ -244,26 +274,12 @@ class DonationReceipt:
         
         # Add signature if available
         try:
-            sig_bytes = None
-            if hasattr(self, 'organization_id'):
-                sig_bytes = get_s3_asset(self.organization_id, 'signature')
-            if sig_bytes:
-                from PIL import Image as PILImage
-                import io
-                pil_image = PILImage.open(io.BytesIO(sig_bytes))
-                if pil_image.mode != 'RGBA':
-                    pil_image = pil_image.convert('RGBA')
-                background = PILImage.new('RGBA', pil_image.size, (255, 255, 255, 0))
-                final_image = PILImage.alpha_composite(background, pil_image)
-                final_image = final_image.convert('RGB')
-                sig_buffer = BytesIO()
-                final_image.save(sig_buffer, format='PNG')
-                sig_buffer.seek(0)
+            if resources['signature']:
                 current_y -= 60
                 sig_width = 1.5 * inch
                 sig_height = 0.75 * inch
-                c.drawImage(ImageReader(sig_buffer), left_margin, current_y, width=sig_width, height=sig_height, preserveAspectRatio=True)
-        except Exception as e:
+                c.drawImage(resources['signature'], left_margin, current_y, width=sig_width, height=sig_height, preserveAspectRatio=True)
+        except Exception:
             current_y -= 40
         
         # Signatory details
@@ -308,8 +324,8 @@ def generate_receipt(donor_data, output_path, organization_id=None):
         receipt.organization_id = organization_id
     receipt.generate(output_path)
 
-def generate_receipt_bytes(donor_data, organization_id=None):
-    """Generate a donation receipt PDF and return as bytes (in-memory, no disk write)."""
+def load_receipt_org_data(organization_id=None):
+    """Organization details for the receipt, with placeholders for anything missing."""
     # Default organization data to prevent KeyError
     default_org_data = {
         'name': 'Organization Name Not Set',
@@ -335,16 +351,16 @@ def generate_receipt_bytes(donor_data, organization_id=None):
     # Load organization settings from database
     if organization_id:
         try:
-        org_settings = get_organization_settings(organization_id)
-        org_data = org_settings.get('organization', {})
+            org_settings = get_organization_settings(organization_id)
+            org_data = org_settings.get('organization', {})
             
             # Merge with defaults to ensure all required fields exist
             merged_org_data = default_org_data.copy()
             merged_org_data.update(org_data)
             org_data = merged_org_data
             
-        if not org_data.get('signature_holder'):
-            org_data['signature_holder'] = DEFAULT_RECEIPT_SETTINGS['signature_holder']
+            if not org_data.get('signature_holder'):
+                org_data['signature_holder'] = DEFAULT_RECEIPT_SETTINGS['signature_holder']
                 
         except Exception as e:
             print(f"Error loading organization settings for {organization_id}: {str(e)}")
@@ -361,15 +377,30 @@ def generate_receipt_bytes(donor_data, organization_id=None):
         except:
             org_data = default_org_data
     
-    # Create receipt with organization ID for asset paths
-    receipt = DonationReceipt(donor_data, org_data)
-    if organization_id:
-        receipt.organization_id = organization_id
-    # Generate PDF in memory
-    buffer = BytesIO()
-    receipt.generate(buffer)
-    buffer.seek(0)
-    return buffer.read()
+    return org_data
+
+def generate_receipts_bytes(donor_data_list, organization_id=None):
+    """
+    Generate several receipts for one organization and return their PDF bytes,
+    in order. Org details, logo and signature are loaded once for the batch.
+    """
+    org_data = load_receipt_org_data(organization_id)
+    resources = get_receipt_resources(organization_id)
+    
+    pdfs = []
+    for donor_data in donor_data_list:
+        receipt = DonationReceipt(donor_data, org_data, resources)
+        if organization_id:
+            receipt.organization_id = organization_id
+        # Generate PDF in memory
+        buffer = BytesIO()
+        receipt.generate(buffer)
+        pdfs.append(buffer.getvalue())
+    return pdfs
+
+def generate_receipt_bytes(donor_data, organization_id=None):
+    """Generate a donation receipt PDF and return as bytes (in-memory, no disk write)."""
+    return generate_receipts_bytes([donor_data], organization_id)[0]
 
 def pdf_settings_page():
     st.markdown("## 📄 PDF Template Settings")
@@ -474,39 +505,24 @@ def pdf_settings_page():
             "pan": "ABCDE1234F"
         }
         
-        # Generate preview receipt
-        preview_dir = f"uploads/organizations/{organization_id}/assets"
-        os.makedirs(preview_dir, exist_ok=True)
-        preview_path = os.path.join(preview_dir, "receipt_preview.pdf")
-        
         try:
-            # Generate receipt with organization-specific settings
-            generate_receipt(sample_data, preview_path, organization_id=organization_id)
+            # Rendered once per settings/assets version, then served from the thumbnail cache
+            from app.services.receipt_previews import get_thumbnail_cache, render_pdf_thumbnail
+            preview_org_data = load_receipt_org_data(organization_id)
+            preview_key = hashlib.sha256(json.dumps(
+                [sample_data, preview_org_data, get_org_asset_versions(organization_id)], sort_keys=True, default=str
+            ).encode('utf-8')).hexdigest()
+            thumbnails = get_thumbnail_cache()
+            preview_image = thumbnails.get(organization_id, f"reportlab:{preview_key}")
+            if preview_image is None:
+                pdf_bytes = generate_receipts_bytes([sample_data], organization_id)[0]
+                preview_image = render_pdf_thumbnail(pdf_bytes, 1200)  # 2x for sharp display at 600px
+                thumbnails.put(organization_id, f"reportlab:{preview_key}", preview_image)
             
-            # Convert first page of PDF to image for preview
-            try:
-                import fitz  # PyMuPDF
-                doc = fitz.open(preview_path)
-                page = doc[0]
-                zoom = 2  # Increase zoom for better quality
-                mat = fitz.Matrix(zoom, zoom)
-                pix = page.get_pixmap(matrix=mat)
-                preview_image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                
-                # Save and display preview image
-                preview_image_path = os.path.join(preview_dir, "receipt_preview.png")
-                preview_image.save(preview_image_path, quality=95, dpi=(300, 300))
-                
-                # Display preview image
-                st.image(preview_image_path, width=600)
-                
-                # Clean up
-                doc.close()
-                os.remove(preview_path)
-            except ImportError:
-                st.info("📝 Preview not available. Install PyMuPDF for preview functionality.")
-            except Exception as e:
-                st.error(f"❌ Failed to generate preview: {str(e)}")
+            # Display preview image
+            st.image(preview_image, width=600)
+        except ImportError:
+            st.info("📝 Preview not available. Install PyMuPDF for preview functionality.")
         except Exception as e:
             st.error(f"❌ Failed to generate preview: {str(e)}")
     else:
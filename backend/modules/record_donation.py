@@ -10,7 +10,6 @@ from modules.supabase_utils import (
     get_organization_receipt_path
 )
 from modules.pdf_template import generate_receipt, DEFAULT_RECEIPT_SETTINGS
-from modules.email_utils import send_email_receipt
 from modules.settings import load_settings, save_settings, load_org_settings
 import os
 from datetime import datetime
@@ -483,6 +482,9 @@ def record_donation_view():
                     status_text.text("Recording payment...")
                     progress_bar.progress(60)
                     
+                    # Queued in the same transaction as the donation, so it is never lost
+                    receipt_email = donor_options[selected_donor].get("Email") if send_receipt else None
+                    
                     if st.session_state.get('selected_recurring_plan'):
                         # Record recurring payment
                         plan = st.session_state.selected_recurring_plan
@@ -492,7 +494,8 @@ def record_donation_view():
                             amount=plan['Amount'],
                             payment_date=date,
                             payment_details=payment_details,
-                            organization_id=organization_id
+                            organization_id=organization_id,
+                            receipt_email=receipt_email
                         )
 
                         if result:
@@ -513,7 +516,8 @@ def record_donation_view():
                             recurring_status="Active" if st.session_state.show_recurring_fields else None,
                             linked_to_recurring=False,
                             is_scheduled_payment=False,
-                            organization_id=organization_id
+                            organization_id=organization_id,
+                            receipt_email=receipt_email
                         )
 
                         if result:
@@ -539,29 +543,9 @@ def record_donation_view():
                             # Generate receipt
                             generate_receipt(donor_data, receipt_path, organization_id=organization_id)
                             
-                            # Send email if requested
-                            if send_receipt and donor_options[selected_donor].get("Email"):
-                                status_text.text("Sending email receipt...")
-                                progress_bar.progress(90)
-                                
-                                # Format donation date for email (DD/MM/YYYY)
-                                donation_date_formatted = date.strftime("%d/%m/%Y")
-                                
-                                email_sent = send_email_receipt(
-                                    to_email=donor_options[selected_donor]["Email"],
-                                    donor_name=donor_options[selected_donor]["Full Name"],
-                                    receipt_path=receipt_path,
-                                    amount=donor_data["amount"],
-                                    receipt_number=receipt_number,
-                                    purpose=donor_data["purpose"],
-                                    payment_mode=payment_method,
-                                    donation_date=donation_date_formatted,
-                                    organization_id=organization_id  # Pass organization ID for email config
-                                )
-                                if email_sent:
-                                    success_message += "\n📧 Receipt sent via email!"
-                                else:
-                                    success_message += "\n⚠️ Failed to send receipt via email."
+                            # The email was queued with the donation; it is sent in the background
+                            if receipt_email:
+                                success_message += "\n📧 Receipt email queued, it will be sent shortly!"
                             
                             # Complete progress
                             status_text.text("Payment recorded successfully!")
@@ -796,6 +780,9 @@ def show_donation_form():
                     status_text.text("Recording payment...")
                     progress_bar.progress(60)
                     
+                    # Queued in the same transaction as the donation, so it is never lost
+                    receipt_email = donor_options[selected_donor].get("Email") if send_receipt else None
+                    
                     if st.session_state.get('selected_recurring_plan'):
                         # Record recurring payment
                         plan = st.session_state.selected_recurring_plan
@@ -805,7 +792,8 @@ def show_donation_form():
                             amount=plan['Amount'],
                             payment_date=date,
                             payment_details=payment_details,
-                            organization_id=organization_id
+                            organization_id=organization_id,
+                            receipt_email=receipt_email
                         )
 
                         if result:
@@ -826,7 +814,8 @@ def show_donation_form():
                             recurring_status="Active" if st.session_state.show_recurring_fields else None,
                             linked_to_recurring=False,
                             is_scheduled_payment=False,
-                            organization_id=organization_id
+                            organization_id=organization_id,
+                            receipt_email=receipt_email
                         )
 
                         if result:
@@ -852,29 +841,9 @@ def show_donation_form():
                             # Generate receipt
                             generate_receipt(donor_data, receipt_path, organization_id=organization_id)
                             
-                            # Send email if requested
-                            if send_receipt and donor_options[selected_donor].get("Email"):
-                                status_text.text("Sending email receipt...")
-                                progress_bar.progress(90)
-                                
-                                # Format donation date for email (DD/MM/YYYY)
-                                donation_date_formatted = date.strftime("%d/%m/%Y")
-                                
-                                email_sent = send_email_receipt(
-                                    to_email=donor_options[selected_donor]["Email"],
-                                    donor_name=donor_options[selected_donor]["Full Name"],
-                                    receipt_path=receipt_path,
-                                    amount=donor_data["amount"],
-                                    receipt_number=receipt_number,
-                                    purpose=donor_data["purpose"],
-                                    payment_mode=payment_method,
-                                    donation_date=donation_date_formatted,
-                                    organization_id=organization_id  # Pass organization ID for email config
-                                )
-                                if email_sent:
-                                    success_message += "\n📧 Receipt sent via email!"
-                                else:
-                                    success_message += "\n⚠️ Failed to send receipt via email."
+                            # The email was queued with the donation; it is sent in the background
+                            if receipt_email:
+                                success_message += "\n📧 Receipt email queued, it will be sent shortly!"
                             
                             # Complete progress
                             status_text.text("Payment recorded successfully!")
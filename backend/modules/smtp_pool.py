@@ -0,0 +1,297 @@
+"""
+Pooled SMTP sessions for receipt emails.
+
+Opening a connection, STARTTLS and LOGIN cost 1-2 s per email with Gmail or
+Workspace, so authenticated sessions are kept and reused. Sessions are pooled
+per account: the (server, port, TLS, address, password) tuple from
+get_email_config. The pool:
+
+* caps open sessions per account (``SMTP_POOL_MAX_PER_ACCOUNT``) and per
+  provider host across all accounts (``SMTP_POOL_MAX_PER_PROVIDER``). When a
+  provider is at its cap, an idle session of another account on it is closed
+  to make room; otherwise senders wait for a session to be returned.
+* checks a session that sat idle for a while with NOOP before reusing it,
+  and drops sessions idle past ``SMTP_POOL_IDLE_SECONDS`` (servers time them
+  out anyway) or that sent ``SMTP_POOL_MAX_MESSAGES``.
+* sends again on a fresh session when the server answers 421 (closing) or a
+  reused session turns out to be dead. A timeout on a fresh session is not
+  retried, since the message may already have been accepted.
+"""
+import atexit
+import os
+import smtplib
+import socket
+import threading
+import time
+from collections import Counter, deque
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+SMTP_POOL_MAX_PER_ACCOUNT = int(os.getenv("SMTP_POOL_MAX_PER_ACCOUNT", "2"))
+SMTP_POOL_MAX_PER_PROVIDER = int(os.getenv("SMTP_POOL_MAX_PER_PROVIDER", "10"))
+SMTP_POOL_IDLE_SECONDS = float(os.getenv("SMTP_POOL_IDLE_SECONDS", "120"))
+SMTP_POOL_NOOP_AFTER_SECONDS = float(os.getenv("SMTP_POOL_NOOP_AFTER_SECONDS", "15"))
+SMTP_POOL_MAX_MESSAGES = int(os.getenv("SMTP_POOL_MAX_MESSAGES", "100"))
+SMTP_POOL_ACQUIRE_TIMEOUT = float(os.getenv("SMTP_POOL_ACQUIRE_TIMEOUT", "60"))
+
+# The session is gone or the server is shutting it down; a new one may work
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, socket.timeout, ConnectionError)
+# The server refused this message; the session itself is still usable
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+class SMTPPoolTimeout(Exception):
+    """No session became available within the acquire timeout."""
+
+
+def get_account_key(email_config):
+    """Pool key for an account: the get_email_config values as a tuple."""
+    return (
+        str(email_config['smtp_server']).lower(),
+        int(email_config['smtp_port']),
+        bool(email_config.get('use_tls', True)),
+        email_config['email_address'],
+        email_config['email_password'],
+    )
+
+
+def is_reconnect_error(error):
+    if isinstance(error, smtplib.SMTPResponseException) and error.smtp_code == 421:
+        return True
+    return isinstance(error, RECONNECT_ERRORS)
+
+
+class SMTPSession:
+    """One authenticated connection and its bookkeeping."""
+
+    def __init__(self, key):
+        self.key = key
+        self.smtp = None
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+        self.reused = False
+
+    def connect(self):
+        server, port, use_tls, address, password = self.key
+        if use_tls:
+            self.smtp = smtplib.SMTP(server, port, timeout=SMTP_TIMEOUT)
+            self.smtp.starttls()
+        else:
+            self.smtp = smtplib.SMTP_SSL(server, port, timeout=SMTP_TIMEOUT)
+        self.smtp.login(address, password)
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+        self.reused = False
+
+    def close(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except Exception:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+        self.smtp = None
+
+    def is_healthy(self):
+        """NOOP a session that has been idle a while; fresh ones are trusted."""
+        if time.monotonic() - self.last_used < SMTP_POOL_NOOP_AFTER_SECONDS:
+            return True
+        try:
+            code, _ = self.smtp.noop()
+            return code == 250
+        except Exception:
+            return False
+
+
+class SMTPConnectionPool:
+    """Per-account pools of SMTP sessions with per-provider limits."""
+
+    def __init__(self, max_per_account=SMTP_POOL_MAX_PER_ACCOUNT, max_per_provider=SMTP_POOL_MAX_PER_PROVIDER):
+        self.max_per_account = max(1, max_per_account)
+        self.max_per_provider = max(1, max_per_provider)
+        self._idle = {}  # account key -> deque of idle sessions, most recent last
+        self._open_per_account = Counter()
+        self._open_per_provider = Counter()
+        self._condition = threading.Condition()
+
+        self._connects = 0
+        self._reuses = 0
+        self._reconnects = 0
+        self._sent = 0
+
+    # ------------------------------------------------------------------
+    # Sending
+    # ------------------------------------------------------------------
+    def send_message(self, email_config, msg):
+        """Send ``msg`` with the account in ``email_config``, reusing a pooled session."""
+        key = get_account_key(email_config)
+        session = self.acquire(key)
+        try:
+            session.smtp.send_message(msg)
+        except MESSAGE_ERRORS:
+            self.release(session)
+            raise
+        except Exception as e:
+            self.release(session, broken=True)
+            # Retry once on a new session, unless the message may already be delivered
+            if not is_reconnect_error(e) or (isinstance(e, socket.timeout) and not session.reused):
+                raise
+            with self._condition:
+                self._reconnects += 1
+            print(f"♻️ SMTP session to {key[0]} failed ({e}), sending on a new one")
+            session = self.acquire(key, fresh=True)
+            try:
+                session.smtp.send_message(msg)
+            except MESSAGE_ERRORS:
+                self.release(session)
+                raise
+            except Exception:
+                self.release(session, broken=True)
+                raise
+        session.messages_sent += 1
+        self.release(session)
+        with self._condition:
+            self._sent += 1
+
+    # ------------------------------------------------------------------
+    # Sessions
+    # ------------------------------------------------------------------
+    def acquire(self, key, fresh=False, timeout=SMTP_POOL_ACQUIRE_TIMEOUT):
+        """Check out a working session for ``key``, connecting if needed."""
+        provider = key[0]
+        deadline = time.monotonic() + timeout
+        while True:
+            evicted = None
+            session = None
+            with self._condition:
+                while True:
+                    idle = self._idle.get(key)
+                    if idle and not fresh:
+                        session = idle.pop()
+                        break
+                    if idle and fresh:
+                        # Sessions idle as long as the one that just failed are suspect too
+                        evicted = idle.popleft()
+                        self._forget(evicted)
+                        break
+                    if self._open_per_account[key] < self.max_per_account and self._open_per_provider[provider] < self.max_per_provider:
+                        session = SMTPSession(key)
+                        self._open_per_account[key] += 1
+                        self._open_per_provider[provider] += 1
+                        break
+                    if self._open_per_account[key] < self.max_per_account:
+                        evicted = self._pop_idle_for_provider(provider, exclude=key)
+                        if evicted is not None:
+                            self._forget(evicted)
+                            break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise SMTPPoolTimeout(f"No SMTP session for {key[3]} via {provider} within {timeout:.0f}s")
+                    self._condition.wait(remaining)
+
+            if evicted is not None:
+                evicted.close()
+                continue
+
+            if session.smtp is None:
+                try:
+                    session.connect()
+                except Exception:
+                    self._discard(session)
+                    raise
+                with self._condition:
+                    self._connects += 1
+                return session
+
+            if time.monotonic() - session.last_used > SMTP_POOL_IDLE_SECONDS or not session.is_healthy():
+                session.close()
+                try:
+                    session.connect()
+                except Exception:
+                    self._discard(session)
+                    raise
+                with self._condition:
+                    self._connects += 1
+                return session
+
+            session.reused = True
+            with self._condition:
+                self._reuses += 1
+            return session
+
+    def release(self, session, broken=False):
+        """Return a session to its pool, or close it when broken or worn out."""
+        if broken or session.smtp is None or session.messages_sent >= SMTP_POOL_MAX_MESSAGES:
+            session.close()
+            self._discard(session)
+            return
+        session.last_used = time.monotonic()
+        with self._condition:
+            self._idle.setdefault(session.key, deque()).append(session)
+            self._condition.notify_all()
+
+    def _discard(self, session):
+        with self._condition:
+            self._forget(session)
+            self._condition.notify_all()
+
+    def _forget(self, session):
+        """Release a session's slots (caller holds the lock)."""
+        self._open_per_account[session.key] -= 1
+        self._open_per_provider[session.key[0]] -= 1
+        if self._open_per_account[session.key] <= 0:
+            del self._open_per_account[session.key]
+        if self._open_per_provider[session.key[0]] <= 0:
+            del self._open_per_provider[session.key[0]]
+
+    def _pop_idle_for_provider(self, provider, exclude):
+        """Longest-idle session of another account on the same provider (caller holds the lock)."""
+        oldest = None
+        for key, idle in self._idle.items():
+            if key != exclude and key[0] == provider and idle:
+                if oldest is None or idle[0].last_used < oldest[0].last_used:
+                    oldest = idle
+        return oldest.popleft() if oldest is not None else None
+
+    def close_all(self):
+        """Close every idle session (on shutdown)."""
+        with self._condition:
+            sessions = [session for idle in self._idle.values() for session in idle]
+            self._idle = {}
+            for session in sessions:
+                self._forget(session)
+            self._condition.notify_all()
+        for session in sessions:
+            session.close()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "open": sum(self._open_per_account.values()),
+                "idle": sum(len(idle) for idle in self._idle.values()),
+                "open_per_provider": dict(self._open_per_provider),
+                "connects": self._connects,
+                "reuses": self._reuses,
+                "reconnects": self._reconnects,
+                "sent": self._sent,
+            }
+
+
+_smtp_pool = None
+_smtp_pool_lock = threading.Lock()
+
+
+def get_smtp_pool():
+    """Return the process-wide SMTP pool, creating it on first use."""
+    global _smtp_pool
+    with _smtp_pool_lock:
+        if _smtp_pool is None:
+            _smtp_pool = SMTPConnectionPool()
+            atexit.register(_smtp_pool.close_all)
+    return _smtp_pool
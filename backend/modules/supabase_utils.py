@@ -6,6 +6,7 @@ import json
 import pandas as pd
 from dateutil.relativedelta import relativedelta
 import re
+from .org_settings_cache import get_org_settings_cache, invalidate_organization_settings
 
 load_dotenv()
 
@@ -77,6 +78,32 @@ def fetch_donors(organization_id: str = None):
         print(f"Error fetching donors: {str(e)}")
         return []
 
+def queue_receipt_email(donation_id: str, to_email: str, organization_id: str = None):
+    """
+    Queue an existing donation's receipt email in the email outbox; the API's
+    outbox dispatcher renders and sends it. Returns True when queued (or already
+    pending). New donations pass receipt_email to record_donation instead, so
+    the donation and its email are written together.
+    """
+    try:
+        if not organization_id:
+            raise ValueError("Organization ID is required")
+        
+        supabase.table("email_outbox").insert({
+            "organization_id": organization_id,
+            "donation_id": donation_id,
+            "kind": "receipt",
+            "to_email": to_email
+        }).execute()
+        print(f"✅ Queued receipt email for donation {donation_id}")
+        return True
+    except Exception as e:
+        # The pending-email unique index rejects a second one for the same donation
+        if "uq_email_outbox_pending" in str(e):
+            return True
+        print(f"Error queueing receipt email: {str(e)}")
+        return False
+
 def update_donation_email_status(donation_id: str, email_sent: bool, organization_id: str = None):
     """Update the email_sent status of a donation"""
     try:
@@ -99,8 +126,21 @@ def update_donation_email_status(donation_id: str, email_sent: bool, organizatio
         print(f"Error updating donation email status: {str(e)}")
         return False
 
-def record_donation(donor_id, amount, date, purpose, payment_method, payment_details, is_recurring=False, recurring_frequency=None, start_date=None, next_due_date=None, recurring_status=None, linked_to_recurring=False, recurring_id=None, is_scheduled_payment=False, organization_id=None):
-    """Record a donation in the database"""
+def insert_donation(data, receipt_email=None):
+    """
+    Insert a donation row. With receipt_email, its receipt email is queued in
+    the email outbox in the same transaction (the record_donation_with_receipt_email
+    function), so a donation is never committed without its email.
+    """
+    if receipt_email:
+        return supabase.rpc("record_donation_with_receipt_email", {
+            "donation": data,
+            "to_email": receipt_email
+        }).execute()
+    return supabase.table("donations").insert(data).execute()
+
+def record_donation(donor_id, amount, date, purpose, payment_method, payment_details, is_recurring=False, recurring_frequency=None, start_date=None, next_due_date=None, recurring_status=None, linked_to_recurring=False, recurring_id=None, is_scheduled_payment=False, organization_id=None, receipt_email=None):
+    """Record a donation in the database, queueing its receipt email when receipt_email is given. Returns the inserted row, or False"""
     try:
         if not organization_id:
             raise ValueError("Organization ID is required")
@@ -121,6 +161,7 @@ def record_donation(donor_id, amount, date, purpose, payment_method, payment_det
             "recurring_id": recurring_id,
             "is_scheduled_payment": is_scheduled_payment,
             "organization_id": organization_id,
+            "receipt_number": payment_details.get("receipt_number") if payment_details else None,
             "receipt_path": payment_details.get("receipt_path") if payment_details else None
         }
 
@@ -128,9 +169,9 @@ def record_donation(donor_id, amount, date, purpose, payment_method, payment_det
         if is_recurring and not linked_to_recurring:
             data["last_paid_date"] = start_date
 
-        result = supabase.table("donations").insert(data).execute()
+        result = insert_donation(data, receipt_email)
         
-        return result.data is not None and len(result.data) > 0
+        return result.data[0] if result.data else False
     except Exception as e:
         print(f"Error recording donation: {str(e)}")
         return False
@@ -301,8 +342,8 @@ def get_last_receipt_number(organization_id: str = None):
         print(f"Error getting last receipt number: {str(e)}")
         return None
 
-def record_recurring_payment(donor_id, recurring_id, amount, payment_date, payment_details, organization_id=None):
-    """Record a payment for a recurring donation"""
+def record_recurring_payment(donor_id, recurring_id, amount, payment_date, payment_details, organization_id=None, receipt_email=None):
+    """Record a payment for a recurring donation, queueing its receipt email when receipt_email is given. Returns the inserted payment row, or False"""
     try:
         if not organization_id:
             raise ValueError("Organization ID is required")
@@ -332,10 +373,11 @@ def record_recurring_payment(donor_id, recurring_id, amount, payment_date, payme
             "linked_to_recurring": True,
             "recurring_id": recurring_id,
             "organization_id": organization_id,
+            "receipt_number": payment_details.get("receipt_number") if payment_details else None,
             "receipt_path": payment_details.get("receipt_path") if payment_details else None
         }
         
-        result = supabase.table("donations").insert(data).execute()
+        result = insert_donation(data, receipt_email)
         
         if result.data:
             # Calculate next due date based on frequency
@@ -359,14 +401,17 @@ def record_recurring_payment(donor_id, recurring_id, amount, payment_date, payme
             
             print(f"Updating recurring plan with data: {update_data}")
             
-            update_result = supabase.table("donations")\
-                .update(update_data)\
-                .eq("id", recurring_id)\
-                .execute()
-            
-            print(f"Update result: {update_result.data}")
+            try:
+                update_result = supabase.table("donations")\
+                    .update(update_data)\
+                    .eq("id", recurring_id)\
+                    .execute()
+                print(f"Update result: {update_result.data}")
+            except Exception as e:
+                # The payment is already recorded; the plan's dates catch up on its next payment
+                print(f"⚠️ Warning: Could not update recurring plan {recurring_id}: {str(e)}")
             
-            return update_result.data is not None
+            return result.data[0]
             
         return False
     except Exception as e:
@@ -554,7 +599,13 @@ def delete_donor(donor_id: str, organization_id: str = None) -> bool:
         print(f"Error deleting donor: {str(e)}")
         return False
 
-def get_organization_settings(organization_id: str) -> dict:
+def get_organization_settings(organization_id: str, use_cache: bool = True) -> dict:
+    """Get organization settings, from the process cache when loaded recently"""
+    if not use_cache or not organization_id:
+        return load_organization_settings(organization_id)
+    return get_org_settings_cache(load_organization_settings).get(organization_id)
+
+def load_organization_settings(organization_id: str) -> dict:
     """Get organization settings from database"""
     try:
         if not organization_id:
@@ -628,6 +679,7 @@ def get_organization_settings(organization_id: str) -> dict:
             }),
             'donation_purposes': settings.get('donation_purposes', ['General Fund', 'Corpus Fund', 'Emergency Fund']),
             'payment_methods': settings.get('payment_methods', ['Cash', 'UPI', 'Bank Transfer', 'Cheque']),
+            'receipt_engine': settings.get('receipt_engine'),  # None: deployment default (RECEIPT_ENGINE)
             'email_config': settings.get('email_config', {
                 'email_address': '',
                 'email_password': '',
@@ -704,6 +756,7 @@ def save_organization_settings(organization_id: str, settings: dict) -> bool:
                     # Insert new setting
                     supabase.table("organization_settings").insert(setting_data).execute()
         
+        invalidate_organization_settings(organization_id)
         return True
     except Exception as e:
         print(f"Error saving organization settings: {str(e)}")
@@ -715,8 +768,8 @@ def get_organization_receipt_number(organization_id: str) -> str:
         if not organization_id:
             raise ValueError("Organization ID is required")
             
-        # Get organization settings
-        settings = get_organization_settings(organization_id)
+        # Get organization settings (uncached: the sequence may have moved on in another process)
+        settings = get_organization_settings(organization_id, use_cache=False)
         receipt_format = settings.get('receipt_format', {
             'prefix': 'REC',
             'format': '{prefix}/{YY}/{MM}/{XXX}',
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Receipt rendering benchmark.
+
+Renders N receipts per (engine, layout, concurrency) with fixture org data and
+the local template assets (no database, no storage), then reports latency
+percentiles, throughput, peak RSS and PDF size before and after the PDF
+optimization stage. Results are printed as a table and written as JSON so runs
+can be compared. Run with RECEIPT_PDF_OPTIMIZE=false for a baseline without
+prepared (re-encoded) image assets.
+
+    cd backend
+    python -m template_generate.benchmark --engines playwright,weasyprint,reportlab,stamp \\
+        --layouts individual,company -n 50 --concurrency 1,2,4 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+
+# Add the backend app path to import settings
+backend_dir = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, backend_dir)
+
+from template_generate.render_metrics import percentile, get_render_metrics
+
+LAYOUTS = {
+    'individual': 'Individual',  # thank-you letter + receipt
+    'company': 'Company',  # 80G certificate + receipt
+}
+
+FIXTURE_ORG = {
+    'name': 'Example Charitable Trust',
+    'registration_number': 'ABC1234567',
+    'office_address': '123 Gandhi Road, Jamshedpur, Jharkhand – 831001',
+    'pan_number': 'ABCDE1234F',
+    'csr_number': 'CSR-908765',
+    'tax_exemption_12a': 'AAETT3091Q24PT01',
+    'tax_exemption_80g': 'AAETT3091Q25PT01',
+    'phone': '+91 9876543210',
+    'email': 'info@example.com',
+    'website': 'www.example.com',
+    'signature_holder': {'name': 'Signatory Name', 'designation': 'Trustee'},
+}
+
+
+def make_fixture(index):
+    """Donor and donation dicts for the index-th receipt (distinct values per receipt)."""
+    donor_data = {
+        'name': f"Donor {index:05d}",
+        'address': '5th Floor, Sion Residency, Navi Mumbai',
+        'phone': '+91-9876543210',
+        'email': f"donor{index}@example.com",
+        'pan': 'XYZPQ1234R',
+    }
+    donation_data = {
+        'receipt_number': f"BENCH/25/{index:05d}",
+        'amount': 1000 + index,
+        'date': '2025-08-02',
+        'purpose': 'General Fund',
+        'payment_mode': 'UPI',
+        'payment_details': f"UTIB{index:010d}",
+    }
+    return donor_data, donation_data
+
+
+# ----------------------------------------------------------------------
+# Engine runners: (donor_data, donation_data, donor_type) -> PDF bytes
+# ----------------------------------------------------------------------
+def get_runner(engine_name):
+    if engine_name == 'playwright':
+        from template_generate.render import generate_receipt_pdf as render_playwright
+        return lambda donor, donation, donor_type: render_playwright(donor, FIXTURE_ORG, donation, donor_type)
+
+    if engine_name == 'weasyprint':
+        from template_generate.render_weasyprint import generate_receipt_pdf as render_weasyprint
+        return lambda donor, donation, donor_type: render_weasyprint(donor, FIXTURE_ORG, donation, donor_type)
+
+    if engine_name == 'stamp':
+        from template_generate.engines import get_engine
+        engine = get_engine('stamp')
+        if not engine.is_available():
+            raise RuntimeError("needs pymupdf and an HTML engine for the base pages")
+        return lambda donor, donation, donor_type: engine.render(donor, FIXTURE_ORG, donation, donor_type)
+
+    if engine_name == 'reportlab':
+        from modules.pdf_template import DonationReceipt
+
+        def run(donor, donation, donor_type):
+            # The drawn receipt has one layout regardless of donor type
+            receipt = DonationReceipt({**donation, 'name': donor['name'], 'pan': donor['pan']}, FIXTURE_ORG)
+            buffer = BytesIO()
+            receipt.generate(buffer)
+            return buffer.getvalue()
+        return run
+
+    raise ValueError(f"Unknown engine '{engine_name}'")
+
+
+def warm_up(engine_name, runner):
+    """Pay one-off costs (browser launch, font loading) outside the measurement."""
+    if engine_name == 'playwright':
+        from template_generate.browser_pool import get_browser_pool
+        get_browser_pool().start()
+    donor, donation = make_fixture(0)
+    # Stamp mode renders one base per layout on first use
+    for donor_type in LAYOUTS.values():
+        runner(donor, donation, donor_type)
+
+
+# ----------------------------------------------------------------------
+# Memory sampling
+# ----------------------------------------------------------------------
+def get_current_rss_mb():
+    """Resident memory of this process plus its children (Chromium), in MB."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            own = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # No /proc (macOS): fall back to the process high-water mark
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss / (1024 * 1024) if sys.platform == 'darwin' else maxrss / 1024
+
+    from template_generate.browser_pool import get_process_tree_rss_mb
+    return own + (get_process_tree_rss_mb() or 0)
+
+
+class PeakRssSampler:
+    """Samples RSS on a background thread while a scenario runs."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, get_current_rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, get_current_rss_mb())
+
+
+# ----------------------------------------------------------------------
+# Scenarios
+# ----------------------------------------------------------------------
+def summarize_latencies(values):
+    values = sorted(values)
+    return {
+        'p50': round(percentile(values, 50), 1) if values else None,
+        'p95': round(percentile(values, 95), 1) if values else None,
+        'p99': round(percentile(values, 99), 1) if values else None,
+        'max': round(values[-1], 1) if values else None,
+    }
+
+
+def summarize_sizes(sizes):
+    return {
+        'mean': int(sum(sizes) / len(sizes)) if sizes else None,
+        'min': min(sizes) if sizes else None,
+        'max': max(sizes) if sizes else None,
+    }
+
+
+def run_scenario(engine_name, runner, layout, count, concurrency, optimize=None):
+    """optimize: the PDF stage applied to each render (None when the engine skips it)."""
+    donor_type = LAYOUTS[layout]
+    latencies = []
+    optimize_latencies = []
+    sizes = []
+    optimized_sizes = []
+    errors = []
+
+    def render_one(index):
+        donor, donation = make_fixture(index)
+        start = time.perf_counter()
+        try:
+            pdf_bytes = runner(donor, donation, donor_type)
+        except Exception as e:
+            errors.append(str(e))
+            return
+        latencies.append((time.perf_counter() - start) * 1000)
+        sizes.append(len(pdf_bytes))
+
+        if optimize is not None:
+            start = time.perf_counter()
+            pdf_bytes = optimize(pdf_bytes)
+            optimize_latencies.append((time.perf_counter() - start) * 1000)
+        optimized_sizes.append(len(pdf_bytes))
+
+    with PeakRssSampler() as sampler:
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(render_one, range(1, count + 1)))
+        wall_seconds = time.perf_counter() - wall_start
+
+    return {
+        'engine': engine_name,
+        'layout': layout,
+        'concurrency': concurrency,
+        'renders': len(latencies),
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_per_s': round(len(latencies) / wall_seconds, 2) if wall_seconds else None,
+        'latency_ms': summarize_latencies(latencies),
+        'optimize_ms': summarize_latencies(optimize_latencies) if optimize is not None else None,
+        'peak_rss_mb': round(sampler.peak_mb, 1),
+        'pdf_bytes': summarize_sizes(sizes),
+        'optimized_pdf_bytes': summarize_sizes(optimized_sizes),
+    }
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=backend_dir, capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def format_value(value):
+    return '-' if value is None else value
+
+
+def print_table(results):
+    header = f"{'engine':<11} {'layout':<11} {'conc':>4} {'n':>5} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'rec/s':>7} {'RSS MB':>8} {'PDF KB':>8} {'opt KB':>8}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        latency = r['latency_ms']
+        size = r['pdf_bytes']['mean']
+        optimized_size = r['optimized_pdf_bytes']['mean']
+        print(f"{r['engine']:<11} {r['layout']:<11} {r['concurrency']:>4} {r['renders']:>5} {r['errors']:>4} "
+              f"{format_value(latency['p50']):>8} {format_value(latency['p95']):>8} {format_value(latency['p99']):>8} "
+              f"{format_value(r['throughput_per_s']):>7} {r['peak_rss_mb']:>8} {(size or 0) / 1024:>8.1f} {(optimized_size or 0) / 1024:>8.1f}")
+
+
+def parse_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark receipt rendering engines")
+    parser.add_argument('--engines', default='playwright,weasyprint,reportlab,stamp', help="comma-separated engines")
+    parser.add_argument('--layouts', default='individual,company', help="comma-separated layouts (individual, company)")
+    parser.add_argument('-n', '--count', type=int, default=20, help="receipts per scenario")
+    parser.add_argument('--concurrency', default='1,2,4', help="comma-separated concurrency levels")
+    parser.add_argument('--output', help="write JSON results to this file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    concurrency_levels = [int(level) for level in parse_list(args.concurrency)]
+    from template_generate import pdf_optimize
+    results = []
+    skipped = {}
+
+    for engine_name in parse_list(args.engines):
+        try:
+            runner = get_runner(engine_name)
+            warm_up(engine_name, runner)
+        except Exception as e:
+            print(f"⚠️ Skipping engine {engine_name}: {e}")
+            skipped[engine_name] = str(e)
+            continue
+
+        for layout in parse_list(args.layouts):
+            for concurrency in concurrency_levels:
+                print(f"⏱️ {engine_name} / {layout} / concurrency {concurrency} x {args.count}")
+                # Stamp output is a pre-optimized base plus a small update; the service skips the PDF stage for it
+                optimize = pdf_optimize.optimize_pdf if pdf_optimize.OPTIMIZE and engine_name != 'stamp' else None
+                results.append(run_scenario(engine_name, runner, layout, args.count, concurrency, optimize))
+
+    report = {
+        'generated_at': datetime.utcnow().isoformat() + 'Z',
+        'git_commit': get_git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'count': args.count,
+        'pdf_optimize': {
+            'enabled': pdf_optimize.OPTIMIZE,
+            'image_dpi': pdf_optimize.IMAGE_DPI,
+            'image_quality': pdf_optimize.IMAGE_QUALITY,
+        },
+        'results': results,
+        'skipped_engines': skipped,
+        'render_metrics': get_render_metrics(),
+    }
+
+    print()
+    print_table(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📄 Wrote {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if {'playwright', 'stamp'} & (set(parse_list(args.engines)) - set(skipped)):
+        from template_generate.browser_pool import shutdown_browser_pool
+        shutdown_browser_pool()
+
+
+if __name__ == "__main__":
+    main()
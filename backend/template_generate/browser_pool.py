@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Process-wide Chromium pool for receipt rendering.
+
+Playwright objects are bound to the event loop that created them, so the pool
+owns a private asyncio loop running on a daemon thread. Callers on any thread
+(FastAPI threadpool workers, Streamlit reruns, scripts) hand it a coroutine
+function via ``BrowserPool.run``; the coroutine receives a checked-out page and
+the page goes back to the pool when it finishes. Async callers on their own
+event loop use ``BrowserPool.run_async`` instead.
+
+The browser is relaunched after ``max_renders`` renders or when the resident
+memory of the Chromium process tree crosses ``max_rss_mb``.
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import os
+import sys
+import threading
+import time
+from contextlib import asynccontextmanager
+
+from playwright.async_api import async_playwright
+
+# Add the backend app path to import settings
+backend_dir = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, backend_dir)
+
+try:
+    from app.core.config import get_settings
+    settings = get_settings()
+except Exception:
+    settings = None
+
+DEFAULT_POOL_SIZE = 2
+DEFAULT_MAX_RENDERS = 500
+DEFAULT_MAX_RSS_MB = 1536
+DEFAULT_RENDER_TIMEOUT = 60
+DEFAULT_LAUNCH_TIMEOUT = 60
+RSS_CHECK_INTERVAL = 10  # renders between /proc scans
+
+
+def get_process_tree_rss_mb(pid=None):
+    """
+    Sum the resident memory (MB) of every descendant of ``pid``.
+    Returns None where /proc is not available (e.g. macOS development machines).
+    """
+    pid = pid or os.getpid()
+    if not os.path.isdir('/proc'):
+        return None
+
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                stat = f.read()
+            # The command name may contain spaces, so split after the closing paren
+            ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    total_bytes = 0
+    stack = list(children.get(pid, []))
+    while stack:
+        child = stack.pop()
+        stack.extend(children.get(child, []))
+        try:
+            with open(f'/proc/{child}/statm', 'r') as f:
+                total_bytes += int(f.read().split()[1]) * page_size
+        except (OSError, ValueError, IndexError):
+            continue
+    return total_bytes / (1024 * 1024)
+
+
+class BrowserPool:
+    """A single long-lived Chromium with ``size`` reusable contexts/pages."""
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, max_renders=DEFAULT_MAX_RENDERS, max_rss_mb=DEFAULT_MAX_RSS_MB):
+        self.size = max(1, int(size))
+        self.max_renders = max_renders
+        self.max_rss_mb = max_rss_mb
+
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._started = False
+
+        self._playwright = None
+        self._browser = None
+        self._pages = None
+        self._recycle_lock = None
+        self._recycle_task = None
+
+        self._renders_since_launch = 0
+        self._total_renders = 0
+        self._launches = 0
+        self._last_rss_mb = None
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    def start(self):
+        """Start the pool thread and launch Chromium (idempotent)."""
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._run_loop, name="receipt-browser-pool", daemon=True)
+            self._thread.start()
+            launch = asyncio.run_coroutine_threadsafe(self._launch(), self._loop)
+            try:
+                launch.result(timeout=DEFAULT_LAUNCH_TIMEOUT)
+            except Exception:
+                launch.cancel()
+                # Playwright objects belong to this loop, so none of them can be reused by the next start()
+                try:
+                    asyncio.run_coroutine_threadsafe(self._stop_playwright(), self._loop).result(timeout=DEFAULT_LAUNCH_TIMEOUT)
+                except Exception as e:
+                    print(f"⚠️ Warning: Error stopping Playwright after a failed launch: {e}")
+                self._playwright = None
+                self._browser = None
+                self._pages = None
+                self._recycle_lock = None
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._loop = None
+                raise
+            self._started = True
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _launch(self):
+        start = time.perf_counter()
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(headless=True)
+        # Keep the same queue across relaunches so waiting callers are served by the new pages
+        if self._pages is None:
+            self._pages = asyncio.Queue()
+            self._recycle_lock = asyncio.Lock()
+        for _ in range(self.size):
+            self._pages.put_nowait(await self._new_page())
+        self._renders_since_launch = 0
+        self._launches += 1
+        print(f"🚀 Browser pool launched Chromium with {self.size} pages in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    async def _new_page(self):
+        context = await self._browser.new_context()
+        return await context.new_page()
+
+    async def _close_browser(self):
+        try:
+            if self._browser is not None:
+                await self._browser.close()
+        except Exception as e:
+            print(f"⚠️ Warning: Error closing pooled browser: {e}")
+        self._browser = None
+
+    async def _stop_playwright(self):
+        await self._close_browser()
+        if self._playwright is not None:
+            playwright, self._playwright = self._playwright, None
+            await playwright.stop()
+
+    def close(self):
+        """Close Chromium and stop the pool thread."""
+        with self._start_lock:
+            if self._loop is None:
+                return
+            try:
+                asyncio.run_coroutine_threadsafe(self._stop_playwright(), self._loop).result(timeout=30)
+            except Exception as e:
+                print(f"⚠️ Warning: Error shutting down browser pool: {e}")
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._started = False
+            self._loop = None
+            self._thread = None
+
+    # ------------------------------------------------------------------
+    # Checkout / return
+    # ------------------------------------------------------------------
+    @asynccontextmanager
+    async def page(self):
+        """Check out a page for the duration of the block (runs on the pool loop)."""
+        if self._browser is None:
+            # A previous relaunch failed; try again before waiting on an empty queue
+            async with self._recycle_lock:
+                if self._browser is None:
+                    await self._launch()
+        page = await self._pages.get()
+        if page.is_closed():
+            # Its replacement failed after a crash; try again before using the slot
+            try:
+                page = await self._replace_page(page)
+            except BaseException:
+                self._pages.put_nowait(page)
+                raise
+        try:
+            yield page
+        finally:
+            try:
+                if page.is_closed() or self._browser is None or not self._browser.is_connected():
+                    page = await self._replace_page(page)
+            except Exception as e:
+                print(f"⚠️ Warning: Could not replace crashed browser page: {e}")
+            finally:
+                # Every slot goes back, even a closed page, so a recycle can always drain ``size`` pages
+                self._pages.put_nowait(page)
+            self._renders_since_launch += 1
+            self._total_renders += 1
+            if self._needs_recycle():
+                # In its own task: the caller has its result and must not wait for the drain and relaunch
+                self._recycle_task = asyncio.get_running_loop().create_task(self._recycle())
+
+    async def _replace_page(self, page):
+        """Swap a crashed/closed page for a fresh one."""
+        try:
+            await page.context.close()
+        except Exception:
+            pass
+        if self._browser is None or not self._browser.is_connected():
+            # The whole browser went away; recycle will relaunch it
+            return page
+        print("♻️ Replacing crashed browser page")
+        return await self._new_page()
+
+    def _needs_recycle(self):
+        if self._recycle_lock.locked() or (self._recycle_task is not None and not self._recycle_task.done()):
+            return False
+        if self._browser is None or not self._browser.is_connected():
+            return True
+        if self.max_renders and self._renders_since_launch >= self.max_renders:
+            print(f"♻️ Browser reached {self._renders_since_launch} renders, recycling")
+            return True
+        if self.max_rss_mb and self._renders_since_launch % RSS_CHECK_INTERVAL == 0:
+            self._last_rss_mb = get_process_tree_rss_mb()
+            if self._last_rss_mb is not None and self._last_rss_mb >= self.max_rss_mb:
+                print(f"♻️ Browser RSS {self._last_rss_mb:.0f} MB over {self.max_rss_mb} MB, recycling")
+                return True
+        return False
+
+    async def _recycle(self):
+        """Drain every page (waiting for in-flight renders), then relaunch Chromium."""
+        async with self._recycle_lock:
+            drained = 0
+            while drained < self.size:
+                await self._pages.get()
+                drained += 1
+            await self._close_browser()
+            try:
+                await self._launch()
+            except Exception as e:
+                # Leave _browser unset; the next checkout retries the launch
+                print(f"❌ Error relaunching pooled browser: {e}")
+
+    # ------------------------------------------------------------------
+    # Public entry points
+    # ------------------------------------------------------------------
+    async def _run_with_page(self, fn, *args, **kwargs):
+        async with self.page() as page:
+            return await fn(page, *args, **kwargs)
+
+    def run(self, fn, *args, timeout=DEFAULT_RENDER_TIMEOUT, **kwargs):
+        """
+        Run ``await fn(page, *args, **kwargs)`` on a pooled page from any thread
+        and return its result.
+        """
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self._run_with_page(fn, *args, **kwargs), self._loop)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            # Cancels the render on the pool loop, so its page goes back to the pool
+            future.cancel()
+            raise
+
+    async def run_async(self, fn, *args, timeout=DEFAULT_RENDER_TIMEOUT, **kwargs):
+        """
+        Awaitable variant of ``run`` for callers on another event loop (async
+        FastAPI endpoints). The caller's loop is free while Chromium renders.
+        """
+        if not self._started:
+            # start() blocks until Chromium is up, so run it off the caller's loop
+            await asyncio.to_thread(self.start)
+        future = asyncio.run_coroutine_threadsafe(self._run_with_page(fn, *args, **kwargs), self._loop)
+        # Cancelling the wrapper (timeout, client disconnect) cancels the render on the pool loop
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "available_pages": self._pages.qsize() if self._pages is not None else 0,
+            "renders_since_launch": self._renders_since_launch,
+            "total_renders": self._total_renders,
+            "launches": self._launches,
+            "last_rss_mb": self._last_rss_mb,
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_browser_pool():
+    """Return the process-wide browser pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool(
+                size=getattr(settings, 'RECEIPT_BROWSER_POOL_SIZE', DEFAULT_POOL_SIZE),
+                max_renders=getattr(settings, 'RECEIPT_BROWSER_MAX_RENDERS', DEFAULT_MAX_RENDERS),
+                max_rss_mb=getattr(settings, 'RECEIPT_BROWSER_MAX_RSS_MB', DEFAULT_MAX_RSS_MB),
+            )
+            atexit.register(_pool.close)
+    return _pool
+
+
+def shutdown_browser_pool():
+    """Close the process-wide browser pool if it was started."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
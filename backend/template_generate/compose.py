@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Compose several standalone receipt pages into one multi-page HTML document.
+
+Each template links its own stylesheet and those stylesheets reuse class names
+(``.receipt-page``, ``.header``, ``.underline`` ...), so every page is wrapped
+in ``<section class="doc-page doc-<name>">`` and its CSS rules are prefixed
+with that class. ``@font-face`` rules are hoisted to the top level and each
+``@page`` rule becomes a named page so the cert keeps its taller page size.
+
+The scoper only understands flat rule blocks, which is all the receipt
+stylesheets use; nested at-rules such as ``@media`` are not supported.
+"""
+import os
+import re
+from html import escape
+
+COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+RULE_RE = re.compile(r'([^{}]+)\{([^{}]*)\}')
+STYLESHEET_RE = re.compile(r'<link[^>]+href="([^"]+\.css)"[^>]*>', re.I)
+BODY_RE = re.compile(r'<body[^>]*>(.*)</body>', re.S | re.I)
+ROOT_SELECTOR_RE = re.compile(r'^(html|body)\b')
+
+_stylesheet_cache = {}
+
+
+def read_stylesheet(path):
+    """Read a stylesheet, cached until the file changes."""
+    mtime = os.path.getmtime(path)
+    cached = _stylesheet_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'r', encoding='utf-8') as f:
+        css = f.read()
+    _stylesheet_cache[path] = (mtime, css)
+    return css
+
+
+def scope_css(css, name):
+    """
+    Split a stylesheet into (hoisted_rules, scoped_rules) for page ``name``.
+    """
+    scope = f".doc-{name}"
+    hoisted = []
+    scoped = []
+    for selectors, body in RULE_RE.findall(COMMENT_RE.sub('', css)):
+        selectors = selectors.strip()
+        body = body.strip()
+        if selectors.startswith('@font-face'):
+            hoisted.append(f"@font-face {{ {body} }}")
+        elif selectors.startswith('@page'):
+            hoisted.append(f"@page {name} {{ {body} }}")
+        else:
+            prefixed = []
+            for selector in selectors.split(','):
+                selector = selector.strip()
+                if ROOT_SELECTOR_RE.match(selector):
+                    prefixed.append(ROOT_SELECTOR_RE.sub(scope, selector))
+                else:
+                    prefixed.append(f"{scope} {selector}")
+            scoped.append(f"{', '.join(prefixed)} {{ {body} }}")
+    return hoisted, scoped
+
+
+def compose_document(pages, base_dir, title="Donation Receipt", rewrite_css=None):
+    """
+    Combine rendered pages into one HTML document.
+    pages: list of (name, html) tuples, in print order.
+    base_dir: directory the pages' relative stylesheet/asset URLs resolve against.
+    rewrite_css: optional function (css, base_dir) -> css applied to each stylesheet.
+    """
+    hoisted = []
+    styles = []
+    sections = []
+
+    for name, html in pages:
+        for href in STYLESHEET_RE.findall(html):
+            css_path = os.path.join(base_dir, href)
+            if not os.path.exists(css_path):
+                print(f"⚠️ Stylesheet not found for page {name}: {css_path}")
+                continue
+            css = read_stylesheet(css_path)
+            if rewrite_css:
+                css = rewrite_css(css, base_dir)
+            page_hoisted, page_scoped = scope_css(css, name)
+            for rule in page_hoisted:
+                if rule not in hoisted:
+                    hoisted.append(rule)
+            styles.extend(page_scoped)
+
+        body_match = BODY_RE.search(html)
+        body = body_match.group(1) if body_match else html
+        sections.append(f'<section class="doc-page doc-{name}" style="page: {name}">{body}</section>')
+
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+  <meta charset="UTF-8">
+  <title>{escape(title)}</title>
+  <style>
+{chr(10).join(hoisted)}
+html, body {{ margin: 0; padding: 0; }}
+.doc-page {{ break-after: page; overflow: hidden; }}
+.doc-page:last-child {{ break-after: auto; }}
+{chr(10).join(styles)}
+  </style>
+</head>
+<body>
+{chr(10).join(sections)}
+</body>
+</html>"""
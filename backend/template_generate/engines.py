@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Receipt rendering engines.
+
+Every engine turns the same (donor, org, donation, donor_type) inputs into PDF
+bytes. The active engine is chosen per organization (``receipt_engine`` org
+setting) or for the deployment (``RECEIPT_ENGINE``), and the order in which
+others are tried when it fails is configured explicitly with
+``RECEIPT_ENGINE_FALLBACKS``, instead of being buried in ImportError handlers.
+
+* ``playwright`` - pooled headless Chromium (template_generate/render.py)
+* ``weasyprint`` - in-process, no browser (template_generate/render_weasyprint.py)
+* ``reportlab`` - the original drawn receipt (modules/pdf_template.py)
+* ``stamp`` - per-donation text stamped with PyMuPDF onto org base pages that an
+  HTML engine rendered once (template_generate/stamp.py)
+
+Engines import their backend lazily, so a deployment only needs the packages
+of the engines it actually uses. Their output goes through the PDF size
+optimization stage (template_generate/pdf_optimize.py) unless disabled. With
+``RECEIPT_RENDER_WORKERS`` set, both happen in separate worker processes
+(template_generate/render_workers.py).
+
+render_document prints an already composed HTML document (annual statements,
+template_generate/statement.py) with the first HTML-capable engine in the chain.
+"""
+import asyncio
+import importlib.util
+import os
+import sys
+
+# Add the backend app path to import settings
+backend_dir = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, backend_dir)
+
+try:
+    from app.core.config import get_settings
+    settings = get_settings()
+except Exception:
+    settings = None
+
+DEFAULT_ENGINE = 'playwright'
+DEFAULT_FALLBACKS = 'weasyprint,reportlab'
+
+
+class ReceiptEngine:
+    """Base class: subclasses set ``name``/``requires`` and implement ``render``."""
+
+    name = None
+    requires = ()
+    renders_html = False  # can print a composed HTML document (render_document)
+    optimize_output = True  # run output through pdf_optimize.optimize_pdf
+    _available = None
+
+    def is_available(self):
+        """True when the engine's packages are installed (checked once)."""
+        if self._available is None:
+            self._available = all(importlib.util.find_spec(module) is not None for module in self.requires)
+            if not self._available:
+                print(f"⚠️ Receipt engine '{self.name}' is not installed ({', '.join(self.requires)})")
+        return self._available
+
+    def get_cache_tag(self):
+        """Identifies this engine's output in receipt cache keys."""
+        return self.name
+
+    def render(self, donor_data, org_data, donation_data, donor_type="Individual", organization_id=None):
+        raise NotImplementedError
+
+    async def render_async(self, donor_data, org_data, donation_data, donor_type="Individual", organization_id=None):
+        """Engines without a native async path render in a worker thread."""
+        return await asyncio.to_thread(self.render, donor_data, org_data, donation_data, donor_type, organization_id)
+
+    def render_document(self, html):
+        """Print an already composed receipt document to PDF bytes."""
+        raise NotImplementedError
+
+
+class PlaywrightEngine(ReceiptEngine):
+    name = 'playwright'
+    requires = ('playwright',)
+    renders_html = True
+
+    def get_cache_tag(self):
+        single_document = getattr(settings, 'RECEIPT_SINGLE_DOCUMENT', True)
+        return f"{self.name}:{'single-document' if single_document else 'per-page'}"
+
+    def render(self, donor_data, org_data, donation_data, donor_type="Individual", organization_id=None):
+        from template_generate.render import generate_receipt_pdf
+        return generate_receipt_pdf(donor_data, org_data, donation_data, donor_type, organization_id)
+
+    async def render_async(self, donor_data, org_data, donation_data, donor_type="Individual", organization_id=None):
+        from template_generate.render import generate_receipt_pdf_async
+        return await generate_receipt_pdf_async(donor_data, org_data, donation_data, donor_type, organization_id)
+
+    def render_document(self, html):
+        from template_generate.browser_pool import get_browser_pool
+        from template_generate.render import TEMPLATE_ROOT_URL, render_document_to_pdf
+        return get_browser_pool().run(render_document_to_pdf, html, TEMPLATE_ROOT_URL)
+
+
+class WeasyPrintEngine(ReceiptEngine):
+    name = 'weasyprint'
+    requires = ('weasyprint',)
+    renders_html = True
+
+    def render(self, donor_data, org_data, donation_data, donor_type="Individual", organization_id=None):
+        from template_generate.render_weasyprint import generate_receipt_pdf
+        return generate_receipt_pdf(donor_data, org_data, donation_data, donor_type, organization_id)
+
+    def render_document(self, html):
+        from template_generate.render_weasyprint import render_document_to_pdf
+        return render_document_to_pdf(html)
+
+
+class ReportLabEngine(ReceiptEngine):
+    name = 'reportlab'
+    # modules.pdf_template also hosts the Streamlit settings page
+    requires = ('reportlab', 'streamlit')
+
+    def render(self, donor_data, org_data, donation_data, donor_type="Individual", organization_id=None):
+        from modules.pdf_template import generate_receipt_bytes
+
+        # The drawn receipt has a single layout and loads org details itself
+        donor_data_old = {
+            "name": donor_data.get('name'),
+            "amount": float(donation_data.get('amount', 0)),
+            "date": donation_data.get('date'),
+            "receipt_number": donation_data.get('receipt_number'),
+            "purpose": donation_data.get('purpose'),
+            "payment_mode": donation_data.get('payment_mode'),
+            "pan": donor_data.get('pan', 'N/A')
+        }
+        return generate_receipt_bytes(donor_data_old, organization_id=organization_id)
+
+
+class StampEngine(ReceiptEngine):
+    name = 'stamp'
+    requires = ('pymupdf',)
+    optimize_output = False  # the base is optimized once when it is built
+
+    def get_base_engine(self):
+        """HTML engine that renders the org base pages: the configured ones first."""
+        fallbacks = getattr(settings, 'RECEIPT_ENGINE_FALLBACKS', DEFAULT_FALLBACKS)
+        for name in [get_default_engine_name()] + (fallbacks or '').split(',') + list(ENGINES):
+            engine = ENGINES.get(name.strip().lower())
+            if engine is not None and engine.renders_html and engine.is_available():
+                return engine
+        return None
+
+    def is_available(self):
+        return super().is_available() and self.get_base_engine() is not None
+
+    def get_cache_tag(self):
+        base_engine = self.get_base_engine()
+        return f"{self.name}:{base_engine.get_cache_tag() if base_engine else 'none'}"
+
+    def render(self, donor_data, org_data, donation_data, donor_type="Individual", organization_id=None):
+        from template_generate.stamp import generate_receipt_pdf
+
+        base_engine = self.get_base_engine()
+        if base_engine is None:
+            raise RuntimeError("Stamp mode needs an HTML engine (playwright or weasyprint) for the base pages")
+        return generate_receipt_pdf(donor_data, org_data, donation_data, donor_type, organization_id, base_engine)
+
+
+ENGINES = {}
+
+
+def register_engine(engine):
+    """Add (or replace) an engine in the registry."""
+    ENGINES[engine.name] = engine
+    return engine
+
+
+for _engine in (PlaywrightEngine(), WeasyPrintEngine(), ReportLabEngine(), StampEngine()):
+    register_engine(_engine)
+
+
+def get_engine(name):
+    """Look up an engine by name (KeyError for unknown names)."""
+    try:
+        return ENGINES[name.strip().lower()]
+    except KeyError:
+        raise KeyError(f"Unknown receipt engine '{name}'. Available: {', '.join(sorted(ENGINES))}")
+
+
+def get_default_engine_name():
+    return getattr(settings, 'RECEIPT_ENGINE', None) or DEFAULT_ENGINE
+
+
+def get_engine_chain(org_engine=None):
+    """
+    Engines to try, in order: the org's choice, the deployment default, then
+    the configured fallbacks. Unknown or uninstalled engines are skipped.
+    """
+    fallbacks = getattr(settings, 'RECEIPT_ENGINE_FALLBACKS', DEFAULT_FALLBACKS)
+    names = [name for name in [org_engine, get_default_engine_name()] + (fallbacks or '').split(',') if name and name.strip()]
+
+    chain = []
+    for name in names:
+        try:
+            engine = get_engine(name)
+        except KeyError as e:
+            print(f"⚠️ {e.args[0]}")
+            continue
+        if engine in chain:
+            continue
+        if not engine.is_available():
+            continue
+        chain.append(engine)
+    return chain
+
+
+def optimize_output(engine, pdf_bytes):
+    """Shrink engine output (font subsetting, object dedupe) when enabled."""
+    if not engine.optimize_output or not getattr(settings, 'RECEIPT_PDF_OPTIMIZE', True):
+        return pdf_bytes
+    from template_generate.pdf_optimize import optimize_pdf
+    return optimize_pdf(pdf_bytes)
+
+
+def render_in_process(engine, donor_data, org_data, donation_data, donor_type="Individual", organization_id=None):
+    """Render and optimize with one engine in this process (what a render worker runs)."""
+    pdf_bytes = engine.render(donor_data, org_data, donation_data, donor_type, organization_id)
+    return optimize_output(engine, pdf_bytes)
+
+
+def render_document_in_process(engine, html):
+    """Print and optimize a composed HTML document with one engine in this process."""
+    return optimize_output(engine, engine.render_document(html))
+
+
+def get_render_worker_pool():
+    """The render worker pool, or None when rendering in-process."""
+    if not getattr(settings, 'RECEIPT_RENDER_WORKERS', 0):
+        return None
+    from template_generate.render_workers import get_render_worker_pool
+    return get_render_worker_pool()
+
+
+def render_receipt(donor_data, org_data, donation_data, donor_type="Individual", organization_id=None, org_engine=None, chain=None):
+    """
+    Render with the first engine in the chain that succeeds.
+    Returns (pdf_bytes, engine_name).
+    """
+    chain = chain if chain is not None else get_engine_chain(org_engine)
+    workers = get_render_worker_pool()
+    errors = []
+    for engine in chain:
+        try:
+            if workers is not None:
+                return workers.render(engine.name, donor_data, org_data, donation_data, donor_type, organization_id), engine.name
+            return render_in_process(engine, donor_data, org_data, donation_data, donor_type, organization_id), engine.name
+        except Exception as e:
+            errors.append(f"{engine.name}: {e}")
+            print(f"❌ Receipt engine '{engine.name}' failed: {e}")
+    raise RuntimeError(f"All receipt engines failed ({'; '.join(errors) or 'no engine available'})")
+
+
+async def render_receipt_async(donor_data, org_data, donation_data, donor_type="Individual", organization_id=None, org_engine=None, chain=None):
+    """Async render_receipt. Returns (pdf_bytes, engine_name)."""
+    chain = chain if chain is not None else get_engine_chain(org_engine)
+    workers = get_render_worker_pool()
+    errors = []
+    for engine in chain:
+        try:
+            if workers is not None:
+                return await workers.render_async(engine.name, donor_data, org_data, donation_data, donor_type, organization_id), engine.name
+            pdf_bytes = await engine.render_async(donor_data, org_data, donation_data, donor_type, organization_id)
+            return await asyncio.to_thread(optimize_output, engine, pdf_bytes), engine.name
+        except Exception as e:
+            errors.append(f"{engine.name}: {e}")
+            print(f"❌ Receipt engine '{engine.name}' failed: {e}")
+    raise RuntimeError(f"All receipt engines failed ({'; '.join(errors) or 'no engine available'})")
+
+
+def render_document(html, org_engine=None):
+    """
+    Print a composed HTML document (e.g. an annual statement) with the first
+    HTML-capable engine in the chain that succeeds. Returns (pdf_bytes, engine_name).
+    """
+    chain = [engine for engine in get_engine_chain(org_engine) if engine.renders_html]
+    workers = get_render_worker_pool()
+    errors = []
+    for engine in chain:
+        try:
+            if workers is not None:
+                return workers.render_document(engine.name, html), engine.name
+            return render_document_in_process(engine, html), engine.name
+        except Exception as e:
+            errors.append(f"{engine.name}: {e}")
+            print(f"❌ Receipt engine '{engine.name}' failed to print document: {e}")
+    raise RuntimeError(f"All HTML receipt engines failed ({'; '.join(errors) or 'no HTML engine available'})")
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Receipt PDF size optimization.
+
+Two stages, so the expensive work is not repeated for every receipt:
+
+* Asset preparation: raster images are re-encoded once for print before any
+  engine sees them. Opaque images become JPEGs, and anything larger than the
+  target DPI allows for a full receipt page is downsampled. This covers the
+  template backgrounds (``background.png`` alone is 3.2 MB) and the orgs' uploaded
+  logos and signatures. Prepared template assets are written to
+  RECEIPT_OPTIMIZED_ASSET_DIR and the composed document's stylesheets point at
+  them.
+* PDF stage (optimize_pdf): embedded fonts are subset to the glyphs the receipt
+  uses (HTML engines embed the variable IBM Plex / Open Sans fonts whole, about
+  520 KB each). Duplicate objects are merged when the file is written.
+"""
+import hashlib
+import io
+import math
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import pymupdf
+from PIL import Image
+
+# Add the backend app path to import settings
+backend_dir = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, backend_dir)
+
+try:
+    from app.core.config import get_settings
+    settings = get_settings()
+except Exception:
+    settings = None
+
+from template_generate.render_metrics import record_timing
+
+OPTIMIZE = getattr(settings, 'RECEIPT_PDF_OPTIMIZE', True)
+IMAGE_DPI = getattr(settings, 'RECEIPT_PDF_IMAGE_DPI', 150)
+IMAGE_QUALITY = getattr(settings, 'RECEIPT_PDF_IMAGE_QUALITY', 80)
+ASSET_DIR = getattr(settings, 'RECEIPT_OPTIMIZED_ASSET_DIR', '') or os.path.join(tempfile.gettempdir(), 'deardonor-receipt-assets')
+
+# Receipt pages are 2000 CSS px (96 per inch) wide; no image needs more pixels than that at the target DPI
+PAGE_WIDTH_INCHES = 2000 / 96
+ASSET_URL_RE = re.compile(r'url\(\s*(["\']?)([^)"\']+\.(?:png|jpe?g))\1\s*\)', re.I)
+IMAGE_CACHE_SIZE = 64
+
+
+def get_optimize_tag():
+    """Part of receipt cache keys: output changes with the optimization settings."""
+    return f"+opt:{IMAGE_DPI}dpi:q{IMAGE_QUALITY}" if OPTIMIZE else ""
+
+
+def get_max_image_pixels(dpi=IMAGE_DPI):
+    return math.ceil(PAGE_WIDTH_INCHES * dpi)
+
+
+# ----------------------------------------------------------------------
+# Asset preparation
+# ----------------------------------------------------------------------
+def optimize_image(image_bytes, dpi=IMAGE_DPI, quality=IMAGE_QUALITY):
+    """
+    Re-encode an image for print: downsample to the target DPI, JPEG when it has
+    no transparency. Returns (bytes, extension), the original when not smaller.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    extension = 'jpg' if image.format == 'JPEG' else 'png'
+
+    max_pixels = get_max_image_pixels(dpi)
+    if max(image.size) > max_pixels:
+        image.thumbnail((max_pixels, max_pixels), Image.LANCZOS)
+
+    if image.mode in ('RGBA', 'LA') and image.getchannel('A').getextrema()[0] == 255:
+        image = image.convert('RGB')
+    elif image.mode == 'P' and 'transparency' not in image.info:
+        image = image.convert('RGB')
+
+    output = io.BytesIO()
+    if image.mode in ('RGB', 'L', 'CMYK'):
+        image.save(output, 'JPEG', quality=quality, optimize=True)
+        optimized = (output.getvalue(), 'jpg')
+    else:
+        image.save(output, 'PNG', optimize=True)
+        optimized = (output.getvalue(), 'png')
+
+    if len(optimized[0]) >= len(image_bytes):
+        return image_bytes, extension
+    return optimized
+
+
+_optimized_images = OrderedDict()
+_optimized_images_lock = threading.Lock()
+
+
+def get_optimized_image(image_bytes):
+    """optimize_image for org uploads, remembered by content."""
+    key = hashlib.sha256(image_bytes).hexdigest()
+    with _optimized_images_lock:
+        if key in _optimized_images:
+            _optimized_images.move_to_end(key)
+            return _optimized_images[key]
+
+    try:
+        optimized = optimize_image(image_bytes)[0]
+    except Exception as e:
+        print(f"⚠️ Could not optimize image: {e}")
+        optimized = image_bytes
+
+    with _optimized_images_lock:
+        _optimized_images[key] = optimized
+        while len(_optimized_images) > IMAGE_CACHE_SIZE:
+            _optimized_images.popitem(last=False)
+    return optimized
+
+
+def get_optimized_asset_uri(path):
+    """
+    file:// URI of the print-ready copy of a template image (prepared on first
+    use, kept until the source changes). None when the original is already best.
+    """
+    stat = os.stat(path)
+    key = hashlib.sha256(f"{path}:{stat.st_mtime_ns}:{stat.st_size}:{IMAGE_DPI}:{IMAGE_QUALITY}".encode('utf-8')).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    for extension in ('jpg', 'png'):
+        prepared = os.path.join(ASSET_DIR, f"{stem}-{key}.{extension}")
+        if os.path.exists(prepared):
+            return Path(prepared).as_uri()
+    if os.path.exists(os.path.join(ASSET_DIR, f"{stem}-{key}.keep")):
+        return None
+
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        original = f.read()
+    optimized, extension = optimize_image(original)
+
+    os.makedirs(ASSET_DIR, exist_ok=True)
+    if optimized is original:
+        # Remember that this one is not worth replacing
+        open(os.path.join(ASSET_DIR, f"{stem}-{key}.keep"), 'w').close()
+        return None
+
+    prepared = os.path.join(ASSET_DIR, f"{stem}-{key}.{extension}")
+    temp_path = f"{prepared}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(optimized)
+    os.replace(temp_path, prepared)
+    record_timing('asset_optimize', (time.perf_counter() - start) * 1000)
+    print(f"🗜️ Prepared {os.path.basename(path)} for print: {len(original) // 1024} KB -> {len(optimized) // 1024} KB")
+    return Path(prepared).as_uri()
+
+
+def rewrite_asset_urls(css, base_dir):
+    """Point a stylesheet's image URLs at their print-ready copies."""
+    def replace(match):
+        path = os.path.join(base_dir, match.group(2))
+        if not os.path.exists(path):
+            return match.group(0)
+        try:
+            uri = get_optimized_asset_uri(path)
+        except Exception as e:
+            print(f"⚠️ Could not prepare {match.group(2)}: {e}")
+            uri = None
+        return f'url("{uri}")' if uri else match.group(0)
+    return ASSET_URL_RE.sub(replace, css)
+
+
+# ----------------------------------------------------------------------
+# PDF stage
+# ----------------------------------------------------------------------
+def optimize_document(doc, subset_fonts=True, object_streams=True):
+    """Subset fonts and write an open document compactly. Returns PDF bytes."""
+    if subset_fonts:
+        doc.subset_fonts()
+    return doc.tobytes(garbage=4, deflate=True, deflate_images=True, deflate_fonts=True, use_objstms=1 if object_streams else 0)
+
+
+def optimize_pdf(pdf_bytes):
+    """
+    Shrink a rendered receipt. Returns the optimized bytes, or the input when
+    optimization fails or does not help.
+    """
+    start = time.perf_counter()
+    try:
+        optimized = optimize_document(pymupdf.open(stream=pdf_bytes, filetype='pdf'))
+    except Exception as e:
+        print(f"⚠️ PDF optimization failed, keeping original: {e}")
+        return pdf_bytes
+    record_timing('pdf_optimize', (time.perf_counter() - start) * 1000)
+
+    if len(optimized) >= len(pdf_bytes):
+        return pdf_bytes
+    print(f"🗜️ Optimized receipt PDF: {len(pdf_bytes) // 1024} KB -> {len(optimized) // 1024} KB")
+    return optimized
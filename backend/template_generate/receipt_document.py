@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Receipt content shared by every rendering engine.
+
+Turns donor/org/donation dicts into template values, fetches the org logo and
+signature through the asset cache, renders the Jinja pages and composes them
+into a single printable HTML document. Nothing here depends on a particular
+PDF backend.
+"""
+import base64
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from num2words import num2words
+
+# Add the backend app path to import settings
+backend_dir = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, backend_dir)
+
+try:
+    from app.core.config import get_settings
+    from app.services.asset_cache import get_org_asset
+    settings = get_settings()
+except ImportError:
+    settings = None
+    get_org_asset = None
+    print("Warning: Could not import settings, organization assets may not work")
+
+from template_generate.compose import compose_document
+from template_generate.pdf_optimize import OPTIMIZE, get_optimized_image, rewrite_asset_urls
+from template_generate.template_engine import TEMPLATE_ROOT, PAGE_TEMPLATES, render_page
+
+# Read-only root holding the CSS files and shared assets (fonts, backgrounds, default
+# logo/signature). Pages load them in place; nothing is copied per receipt.
+TEMPLATE_ROOT_URL = Path(TEMPLATE_ROOT).as_uri() + '/'
+
+# Organization assets overlaid on the shared defaults, by the template field they fill
+ORG_ASSET_FIELDS = {
+    'logo': 'logo_src',
+    'signature': 'signature_src',
+}
+
+def get_s3_asset(org_id, asset_type):
+    """Fetch organization asset through the shared asset cache (None if not uploaded)"""
+    if get_org_asset is None:
+        return None
+    return get_org_asset(org_id, asset_type)
+
+def get_asset_data_uri(asset_bytes):
+    """Encode image bytes as a data: URI (org uploads may be PNG or JPEG)"""
+    mime_type = 'image/jpeg' if asset_bytes[:3] == b'\xff\xd8\xff' else 'image/png'
+    return f"data:{mime_type};base64,{base64.b64encode(asset_bytes).decode('utf-8')}"
+
+def get_org_asset_overrides(organization_id=None):
+    """
+    Fetch the organization's logo and signature as data URIs, keyed by the
+    template field they fill. Missing assets keep the shared defaults.
+    """
+    overrides = {}
+    if not organization_id:
+        return overrides
+    
+    print(f"Fetching organization assets for: {organization_id}")
+    for asset_type, field in ORG_ASSET_FIELDS.items():
+        asset_bytes = get_s3_asset(organization_id, asset_type)
+        if asset_bytes:
+            overrides[field] = get_asset_data_uri(get_optimized_image(asset_bytes) if OPTIMIZE else asset_bytes)
+            print(f"✅ Fetched organization {asset_type} for {organization_id}")
+        else:
+            print(f"⚠️ No organization {asset_type} found for {organization_id}, using fallback")
+    
+    return overrides
+
+def build_template_data(donor_data, org_data, donation_data):
+    """Build the placeholder values shared by all receipt templates."""
+    return {
+        # Organization data
+        'org_name': org_data.get('name', 'Organization Name Not Set').upper(),
+        'org_name_proper': org_data.get('name', 'Organization Name Not Set'),
+        'registration_number': org_data.get('registration_number', 'Registration Number Not Set'),
+        'office_address': org_data.get('office_address', 'Address Not Set'),
+        'org_pan': org_data.get('pan_number', 'PAN Number Not Set'),
+        'csr_number': org_data.get('csr_number', 'CSR Number Not Set'),
+        'tax_exemption_12a': org_data.get('tax_exemption_12a', '12A Number Not Set'),  # Use separate 12A field
+        'tax_exemption_80g': org_data.get('tax_exemption_80g', '80G Number Not Set'),  # Use separate 80G field
+        'org_phone': org_data.get('phone', 'Phone Number Not Set'),
+        'org_email': org_data.get('email', 'Email Not Set'),
+        'org_website': org_data.get('website', 'Website Not Set'),
+        
+        # Donation data
+        'receipt_number': donation_data.get('receipt_number', 'REC/2024/001'),
+        'amount': f"Rs. {float(donation_data.get('amount', 0)):,.0f}",
+        'amount_only': f"{float(donation_data.get('amount', 0)):,.0f}",
+        'amount_words': convert_amount_to_words(donation_data.get('amount', 0)),
+        'donation_date': donation_data.get('date', datetime.now().strftime('%d/%m/%Y')),
+        'donation_date_iso': donation_data.get('date', datetime.now().strftime('%Y-%m-%d')),
+        'purpose': donation_data.get('purpose', 'General Fund'),
+        'payment_mode': donation_data.get('payment_mode', 'Online'),
+        'payment_details': donation_data.get('payment_details', 'N/A'),
+        'financial_year': get_financial_year(donation_data.get('date', datetime.now().strftime('%Y-%m-%d'))),
+        
+        # Donor data
+        'donor_name': donor_data.get('name', 'Donor Name Not Set'),
+        'name': donor_data.get('name', 'Donor Name Not Set'),  # For thank you template
+        'donor_address': donor_data.get('address', 'Address Not Provided'),
+        'donor_phone': donor_data.get('phone', 'Phone Not Provided'),
+        'donor_email': donor_data.get('email', 'Email Not Provided'),
+        'donor_pan': donor_data.get('pan', 'N/A'),
+        
+        # Signature data
+        'signatory_name': org_data.get('signature_holder', {}).get('name', 'Authorized Signatory'),
+        'signatory_designation': org_data.get('signature_holder', {}).get('designation', 'Authorized Signatory'),
+        
+        # Shared default assets, replaced by get_org_asset_overrides
+        'logo_src': 'assets/logo.png',
+        'signature_src': 'assets/signature.jpg'
+    }
+
+def render_receipt_pages(template_data, asset_overrides=None, page_names=None):
+    """
+    Render the receipt pages (all of them unless page_names is given) with real data.
+    Returns a dict of page name -> HTML string.
+    """
+    if asset_overrides:
+        template_data = {**template_data, **asset_overrides}
+    return {name: render_page(name, template_data) for name in (page_names or PAGE_TEMPLATES)}
+
+def get_receipt_page_order(donor_type):
+    """Company: cert + receipt. Individual: thankyou + receipt."""
+    if donor_type and donor_type.lower() == "company":
+        return ['cert', 'receipt']
+    return ['thankyou', 'receipt']
+
+def convert_amount_to_words(amount):
+    """Convert amount to words in Indian style"""
+    try:
+        amount_float = float(amount)
+        words = num2words(amount_float, lang='en_IN').title()
+        return f"Rupees {words} Only"
+    except:
+        return "Rupees Zero Only"
+
+def get_financial_year(date_str):
+    """Get financial year from date string"""
+    try:
+        if isinstance(date_str, str):
+            date_obj = datetime.strptime(date_str, '%Y-%m-%d')
+        else:
+            date_obj = date_str
+        
+        year = date_obj.year
+        if date_obj.month >= 4:  # April or later
+            return f"{year}-{str(year + 1)[2:]}"
+        else:  # January to March
+            return f"{year - 1}-{str(year)[2:]}"
+    except:
+        current_year = datetime.now().year
+        return f"{current_year}-{str(current_year + 1)[2:]}"
+
+def get_financial_year_dates(financial_year=None):
+    """
+    Parse a financial year label ("2024-25", "2024-2025" or the starting year
+    "2024"; the current year when None) into (label, start, end) datetimes:
+    April 1 up to, but not including, the next April 1.
+    """
+    if not financial_year:
+        financial_year = get_financial_year(datetime.now())
+    parts = str(financial_year).strip().split('-')
+    try:
+        start_year = int(parts[0])
+    except ValueError:
+        start_year = None
+    if start_year is None or len(parts) > 2 or (len(parts) == 2 and not (parts[1] and str(start_year + 1).endswith(parts[1]))):
+        raise ValueError(f"Invalid financial year '{financial_year}', expected e.g. 2024-25")
+    label = f"{start_year}-{str(start_year + 1)[2:]}"
+    return label, datetime(start_year, 4, 1), datetime(start_year + 1, 4, 1)
+
+def compose_receipt_document(template_data, donor_type="Individual", organization_id=None):
+    """
+    Render the pages for this donor type from prepared template values (org
+    logo/signature inlined) and compose them into one HTML document ready to print.
+    """
+    asset_overrides = get_org_asset_overrides(organization_id)
+    page_order = get_receipt_page_order(donor_type)
+    pages = render_receipt_pages(template_data, asset_overrides, page_order)
+    print(f"Generating {donor_type} receipt ({' + '.join(page_order)})")
+    return compose_document([(name, pages[name]) for name in page_order], TEMPLATE_ROOT,
+                            rewrite_css=rewrite_asset_urls if OPTIMIZE else None)
+
+def build_receipt_document(donor_data, org_data, donation_data, donor_type="Individual", organization_id=None):
+    """Compose the printable HTML document for one donation."""
+    return compose_receipt_document(build_template_data(donor_data, org_data, donation_data), donor_type, organization_id)
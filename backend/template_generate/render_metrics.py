@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+In-process timing metrics for receipt rendering.
+
+Samples are kept in a bounded window per metric name so percentiles reflect
+recent behaviour without growing memory.
+"""
+import math
+import threading
+from collections import deque
+
+WINDOW_SIZE = 1000
+
+_samples = {}
+_counts = {}
+_lock = threading.Lock()
+
+
+def record_timing(name, value_ms):
+    """Record one sample (milliseconds) for the named metric."""
+    with _lock:
+        window = _samples.get(name)
+        if window is None:
+            window = _samples[name] = deque(maxlen=WINDOW_SIZE)
+        window.append(value_ms)
+        _counts[name] = _counts.get(name, 0) + 1
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def get_render_metrics():
+    """Return count and p50/p95/max (ms) over the recent window for every metric."""
+    with _lock:
+        snapshot = {name: sorted(window) for name, window in _samples.items()}
+        counts = dict(_counts)
+
+    metrics = {}
+    for name, values in snapshot.items():
+        metrics[name] = {
+            "count": counts.get(name, 0),
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "max_ms": values[-1] if values else None,
+        }
+    return metrics
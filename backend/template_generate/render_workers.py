@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+Process-isolated receipt rendering.
+
+With ``RECEIPT_RENDER_WORKERS`` > 0, engine renders run in that many separate
+worker processes instead of inside the API process. Each worker owns its own
+Chromium (browser_pool) and stamp bases, so a leaking or hung render can only
+take down a worker, and the API process's memory stays flat however many
+receipts are rendered.
+
+* Jobs are queued in the API process and handed to idle workers over a pipe
+  by a supervisor thread; one job per worker at a time.
+* The worker writes the PDF into a shared memory segment and sends back only
+  its name and size, so the bytes are not pickled through the pipe.
+* A job that runs longer than ``RECEIPT_RENDER_WORKER_TIMEOUT`` kills its
+  worker (with its Chromium process group) and fails with TimeoutError.
+* A worker whose process tree (Python plus Chromium) goes over
+  ``RECEIPT_RENDER_WORKER_MAX_RSS_MB`` after a job exits cleanly and is
+  replaced. Crashed workers are replaced too.
+
+Workers are started with the ``spawn`` method: forking a process that already
+runs Playwright threads is not safe. Each uvicorn worker has its own pool.
+"""
+import asyncio
+import atexit
+import itertools
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import connection, shared_memory
+
+# Add the backend app path to import settings
+backend_dir = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, backend_dir)
+
+try:
+    from app.core.config import get_settings
+    settings = get_settings()
+except Exception:
+    settings = None
+
+from template_generate.render_metrics import record_timing
+
+DEFAULT_JOB_TIMEOUT = 90
+DEFAULT_MAX_RSS_MB = 1024
+SHUTDOWN_TIMEOUT = 10
+MAX_RESPAWN_DELAY = 30  # seconds between attempts while workers keep dying on startup
+
+
+def get_rss_mb():
+    """Resident memory of this process and its children (Chromium), in MB."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            own = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+    try:
+        from template_generate.browser_pool import get_process_tree_rss_mb
+        children = get_process_tree_rss_mb() or 0
+    except ImportError:
+        children = 0
+    return own + children
+
+
+# ----------------------------------------------------------------------
+# Worker process
+# ----------------------------------------------------------------------
+def warm_up():
+    """Launch Chromium before the first job when the deployment renders with it."""
+    from template_generate.engines import get_default_engine_name, get_engine
+
+    try:
+        if get_default_engine_name() in ('playwright', 'stamp') and get_engine('playwright').is_available():
+            from template_generate.browser_pool import get_browser_pool
+            get_browser_pool().start()
+    except Exception as e:
+        print(f"⚠️ Render worker {os.getpid()} could not start Chromium: {e}")
+
+
+def worker_main(conn, max_rss_mb):
+    """Render jobs received on ``conn`` until told to stop or over the memory limit."""
+    # Own process group, so a timed-out worker is killed together with its Chromium
+    os.setpgrp()
+    # One job at a time, so one pooled page is enough; and renders here stay here
+    os.environ['RECEIPT_BROWSER_POOL_SIZE'] = '1'
+    os.environ['RECEIPT_RENDER_WORKERS'] = '0'
+    from template_generate.engines import get_engine, render_document_in_process, render_in_process
+
+    warm_up()
+    conn.send(('ready', None, get_rss_mb()))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if message is None:
+            break
+
+        job_id, engine_name, method, args = message
+        start = time.perf_counter()
+        try:
+            render = render_document_in_process if method == 'document' else render_in_process
+            pdf_bytes = render(get_engine(engine_name), *args)
+            segment = shared_memory.SharedMemory(create=True, size=max(1, len(pdf_bytes)))
+            segment.buf[:len(pdf_bytes)] = pdf_bytes
+            segment.close()
+            result = (segment.name, len(pdf_bytes))
+        except Exception as e:
+            conn.send(('error', job_id, f"{type(e).__name__}: {e}"))
+            continue
+
+        rss_mb = get_rss_mb()
+        recycle = bool(max_rss_mb and rss_mb is not None and rss_mb >= max_rss_mb)
+        conn.send(('done', job_id, (*result, (time.perf_counter() - start) * 1000, rss_mb, recycle)))
+        if recycle:
+            print(f"♻️ Render worker {os.getpid()} at {rss_mb:.0f} MB (limit {max_rss_mb} MB), exiting")
+            break
+
+    try:
+        from template_generate.browser_pool import shutdown_browser_pool
+        shutdown_browser_pool()
+    except ImportError:
+        pass
+    conn.close()
+
+
+# ----------------------------------------------------------------------
+# API side
+# ----------------------------------------------------------------------
+class RenderJob:
+    def __init__(self, job_id, engine_name, args, method='receipt'):
+        self.id = job_id
+        self.engine_name = engine_name
+        self.method = method  # 'receipt' (engine inputs) or 'document' (composed HTML)
+        self.args = args
+        self.future = Future()
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+
+
+class RenderWorker:
+    """API-side handle of one worker process."""
+
+    def __init__(self, context, max_rss_mb):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(child_conn, max_rss_mb), name="receipt-render-worker", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.job = None
+        self.jobs_done = 0
+        self.rss_mb = None
+        self.started_at = time.time()
+
+    def kill(self):
+        """Kill the worker and everything it started (Chromium)."""
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (OSError, TypeError):
+            self.process.kill()
+        self.process.join(timeout=SHUTDOWN_TIMEOUT)
+        self.conn.close()
+
+    def stats(self):
+        return {
+            "pid": self.process.pid,
+            "alive": self.process.is_alive(),
+            "ready": self.ready,
+            "busy": self.job is not None,
+            "busy_seconds": round(time.monotonic() - self.job.started_at, 1) if self.job is not None else None,
+            "jobs_done": self.jobs_done,
+            "rss_mb": round(self.rss_mb, 1) if self.rss_mb is not None else None,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+        }
+
+
+class RenderWorkerPool:
+    """``size`` worker processes fed from one job queue by a supervisor thread."""
+
+    def __init__(self, size, job_timeout=DEFAULT_JOB_TIMEOUT, max_rss_mb=DEFAULT_MAX_RSS_MB):
+        self.size = max(1, int(size))
+        self.job_timeout = job_timeout
+        self.max_rss_mb = max_rss_mb
+
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = []
+        self._retiring = []  # recycled workers that are still shutting down
+        self._respawns = []  # monotonic times at which to start replacement workers
+        self._start_failures = 0
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+        self._wakeup_reader, self._wakeup_writer = self._context.Pipe(duplex=False)
+        self._thread = None
+        self._stopping = False
+
+        self._completed = 0
+        self._failed = 0
+        self._timeouts = 0
+        self._crashes = 0
+        self._recycled = 0
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    def start(self):
+        """Start the workers and the supervisor thread (idempotent)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._workers = [RenderWorker(self._context, self.max_rss_mb) for _ in range(self.size)]
+            self._thread = threading.Thread(target=self._supervise, name="receipt-render-supervisor", daemon=True)
+            self._thread.start()
+        print(f"🚀 Started {self.size} receipt render worker processes")
+
+    def close(self):
+        """Stop the workers; queued jobs fail."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._stopping = True
+            thread = self._thread
+        self._wake()
+        thread.join(timeout=SHUTDOWN_TIMEOUT * 2)
+        with self._lock:
+            self._thread = None
+
+    def _wake(self):
+        try:
+            self._wakeup_writer.send(None)
+        except OSError:
+            pass
+
+    # ------------------------------------------------------------------
+    # Submitting
+    # ------------------------------------------------------------------
+    def submit(self, engine_name, donor_data, org_data, donation_data, donor_type="Individual", organization_id=None):
+        """Queue a render with the named engine. Returns a Future of the PDF bytes."""
+        return self._submit(RenderJob(next(self._job_ids), engine_name, (donor_data, org_data, donation_data, donor_type, organization_id)))
+
+    def submit_document(self, engine_name, html):
+        """Queue printing a composed HTML document with the named engine. Returns a Future of the PDF bytes."""
+        return self._submit(RenderJob(next(self._job_ids), engine_name, (html,), method='document'))
+
+    def _submit(self, job):
+        self.start()
+        with self._lock:
+            if self._stopping:
+                raise RuntimeError("Render worker pool is shutting down")
+            self._queue.append(job)
+        self._wake()
+        return job.future
+
+    def render(self, engine_name, donor_data, org_data, donation_data, donor_type="Individual", organization_id=None):
+        """Render in a worker process and wait for the PDF bytes."""
+        return self.submit(engine_name, donor_data, org_data, donation_data, donor_type, organization_id).result()
+
+    async def render_async(self, engine_name, donor_data, org_data, donation_data, donor_type="Individual", organization_id=None):
+        """Awaitable render; the event loop is free while the worker renders."""
+        if self._thread is None:
+            await asyncio.to_thread(self.start)
+        future = self.submit(engine_name, donor_data, org_data, donation_data, donor_type, organization_id)
+        return await asyncio.wrap_future(future)
+
+    def render_document(self, engine_name, html):
+        """Print a composed HTML document in a worker process and wait for the PDF bytes."""
+        return self.submit_document(engine_name, html).result()
+
+    # ------------------------------------------------------------------
+    # Supervisor thread
+    # ------------------------------------------------------------------
+    def _supervise(self):
+        while not self._stopping:
+            self._respawn()
+            self._dispatch()
+            waitables = [self._wakeup_reader]
+            for worker in self._workers:
+                waitables += [worker.conn, worker.process.sentinel]
+            waitables += [worker.process.sentinel for worker in self._retiring]
+
+            ready = connection.wait(waitables, timeout=self._get_wait_timeout())
+            if self._wakeup_reader in ready:
+                while self._wakeup_reader.poll():
+                    self._wakeup_reader.recv()
+
+            # Messages first: a recycled worker exits right after sending its result
+            for worker in list(self._workers):
+                if worker.conn in ready:
+                    self._receive(worker)
+            for worker in list(self._workers):
+                if worker.process.sentinel in ready and worker in self._workers:
+                    self._replace(worker, crashed=True)
+            for worker in list(self._retiring):
+                if worker.process.sentinel in ready:
+                    worker.process.join()
+                    worker.conn.close()
+                    self._retiring.remove(worker)
+            self._check_timeouts()
+
+        self._shutdown_workers()
+
+    def _get_wait_timeout(self):
+        deadlines = list(self._respawns)
+        if self.job_timeout:
+            deadlines += [worker.job.started_at + self.job_timeout for worker in self._workers if worker.job is not None]
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - time.monotonic())
+
+    def _respawn(self):
+        now = time.monotonic()
+        due = [at for at in self._respawns if at <= now]
+        self._respawns = [at for at in self._respawns if at > now]
+        for _ in due:
+            self._workers.append(RenderWorker(self._context, self.max_rss_mb))
+
+    def _dispatch(self):
+        for worker in self._workers:
+            while worker.ready and worker.job is None:
+                with self._lock:
+                    if not self._queue:
+                        return
+                    job = self._queue.popleft()
+                if not job.future.set_running_or_notify_cancel():
+                    continue  # cancelled while queued
+                job.started_at = time.monotonic()
+                record_timing('render_worker_queue', (job.started_at - job.submitted_at) * 1000)
+                try:
+                    worker.conn.send((job.id, job.engine_name, job.method, job.args))
+                except Exception as e:
+                    # Unpicklable arguments or a dead pipe; the sentinel handles the latter
+                    job.future.set_exception(RuntimeError(f"Could not send render job to worker: {e}"))
+                    self._failed += 1
+                    break
+                worker.job = job
+
+    def _receive(self, worker):
+        try:
+            kind, job_id, payload = worker.conn.recv()
+        except (EOFError, OSError):
+            self._replace(worker, crashed=True)
+            return
+
+        if kind == 'ready':
+            worker.ready = True
+            worker.rss_mb = payload
+            self._start_failures = 0
+            return
+
+        job, worker.job = worker.job, None
+        if job is None or job.id != job_id:
+            return
+        worker.jobs_done += 1
+
+        if kind == 'error':
+            self._failed += 1
+            job.future.set_exception(RuntimeError(payload))
+            return
+
+        name, size, render_ms, rss_mb, recycle = payload
+        try:
+            segment = shared_memory.SharedMemory(name=name)
+            try:
+                pdf_bytes = bytes(segment.buf[:size])
+            finally:
+                segment.close()
+                segment.unlink()
+        except Exception as e:
+            self._failed += 1
+            job.future.set_exception(RuntimeError(f"Could not read rendered PDF from worker: {e}"))
+        else:
+            self._completed += 1
+            record_timing('render_worker_job', render_ms)
+            job.future.set_result(pdf_bytes)
+
+        worker.rss_mb = rss_mb
+        if recycle:
+            self._recycled += 1
+            self._workers.remove(worker)
+            self._retiring.append(worker)
+            self._workers.append(RenderWorker(self._context, self.max_rss_mb))
+
+    def _replace(self, worker, crashed=False):
+        """Fail the worker's job (if any) and start a new worker in its place."""
+        worker.kill()
+        if worker.job is not None:
+            self._failed += 1
+            worker.job.future.set_exception(RuntimeError(f"Render worker {worker.process.pid} exited (code {worker.process.exitcode}) during the render"))
+            worker.job = None
+        if crashed:
+            self._crashes += 1
+            print(f"❌ Render worker {worker.process.pid} exited unexpectedly (code {worker.process.exitcode}), replacing it")
+
+        if worker.ready:
+            self._workers[self._workers.index(worker)] = RenderWorker(self._context, self.max_rss_mb)
+            return
+
+        # Died before it could take a job: back off instead of respawning in a tight loop
+        self._workers.remove(worker)
+        self._start_failures += 1
+        self._respawns.append(time.monotonic() + min(MAX_RESPAWN_DELAY, 0.5 * 2 ** (self._start_failures - 1)))
+        if not any(other.ready for other in self._workers):
+            # Nothing can serve the queue; fail it so callers can fall back
+            with self._lock:
+                queued, self._queue = list(self._queue), deque()
+            for job in queued:
+                if job.future.set_running_or_notify_cancel():
+                    self._failed += 1
+                    job.future.set_exception(RuntimeError(f"Render workers are failing to start (exit code {worker.process.exitcode})"))
+
+    def _check_timeouts(self):
+        if not self.job_timeout:
+            return
+        now = time.monotonic()
+        for worker in list(self._workers):
+            job = worker.job
+            if job is None or now - job.started_at < self.job_timeout:
+                continue
+            print(f"⏱️ Render job {job.id} ({job.engine_name}) exceeded {self.job_timeout}s, killing worker {worker.process.pid}")
+            self._timeouts += 1
+            self._failed += 1
+            worker.job = None
+            job.future.set_exception(TimeoutError(f"Receipt render exceeded {self.job_timeout}s"))
+            self._replace(worker)
+
+    def _shutdown_workers(self):
+        with self._lock:
+            queued, self._queue = list(self._queue), deque()
+        for job in queued:
+            if job.future.set_running_or_notify_cancel():
+                job.future.set_exception(RuntimeError("Render worker pool is shutting down"))
+
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+        for worker in self._workers + self._retiring:
+            worker.process.join(timeout=SHUTDOWN_TIMEOUT)
+            if worker.job is not None:
+                worker.job.future.set_exception(RuntimeError("Render worker pool is shutting down"))
+            if worker.process.is_alive():
+                worker.kill()
+            else:
+                worker.conn.close()
+        self._workers = []
+        self._retiring = []
+
+    def stats(self):
+        workers = [worker.stats() for worker in list(self._workers)]
+        return {
+            "size": self.size,
+            "queue_depth": len(self._queue),
+            "busy_workers": sum(1 for worker in workers if worker["busy"]),
+            "alive_workers": sum(1 for worker in workers if worker["alive"]),
+            "completed": self._completed,
+            "failed": self._failed,
+            "timeouts": self._timeouts,
+            "crashes": self._crashes,
+            "recycled": self._recycled,
+            "job_timeout_seconds": self.job_timeout,
+            "max_rss_mb": self.max_rss_mb,
+            "workers": workers,
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_render_worker_pool():
+    """Return the process-wide render worker pool, or None when RECEIPT_RENDER_WORKERS is 0."""
+    global _pool
+    size = getattr(settings, 'RECEIPT_RENDER_WORKERS', 0)
+    if not size or size <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = RenderWorkerPool(
+                size=size,
+                job_timeout=getattr(settings, 'RECEIPT_RENDER_WORKER_TIMEOUT', DEFAULT_JOB_TIMEOUT),
+                max_rss_mb=getattr(settings, 'RECEIPT_RENDER_WORKER_MAX_RSS_MB', DEFAULT_MAX_RSS_MB),
+            )
+            atexit.register(_pool.close)
+    return _pool
+
+
+def shutdown_render_worker_pool():
+    """Stop the process-wide render worker pool if it was started."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+"""
+Stamp-overlay receipts.
+
+Apart from about fifteen donor/donation fields, every receipt page is the same
+for an organization (background, org name and numbers, logo, signature). Stamp
+mode prints the org's pages once through an HTML engine with a marker
+(``QZ07QZ``) in place of each per-donation field, records where each marker sits
+and in which font, removes the markers and keeps that PDF as the org's base.
+A receipt is then a copy of the base plus one content stream that draws the
+donor's values at the recorded positions: no browser and a few milliseconds
+per receipt.
+
+Values are drawn with the template's own font files (pre-embedded in the base,
+so nothing is re-embedded per receipt) in a PDF incremental update appended to
+the base, so the base itself is never re-serialized. When PDF optimization is
+on, the base goes through it once: fonts are subset down to the glyphs the base
+uses plus STAMP_CHARSET, so values may only use those characters. A value with
+other characters, or ones the template font has no glyph for (a donor name in
+Devanagari), raises UnstampableValueError, so the engine chain renders that
+receipt with an HTML engine instead. Text that follows a value on the same
+line (the comma after "Dearest <name>") is redrawn shifted by the difference
+between value and marker widths, and values that would run into the next
+column or past the page margin are scaled down. Values never wrap onto a new
+line, so very long addresses end up in a smaller font than the HTML engines
+would use.
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+
+import pymupdf
+
+# Add the backend app path to import settings
+backend_dir = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, backend_dir)
+
+try:
+    from app.core.config import get_settings
+    from app.services.asset_cache import get_org_asset_versions
+    settings = get_settings()
+except Exception:
+    settings = None
+    get_org_asset_versions = None
+
+from template_generate.compose import COMMENT_RE, RULE_RE, read_stylesheet
+from template_generate.pdf_optimize import OPTIMIZE, get_optimize_tag, optimize_document
+from template_generate.receipt_document import build_template_data, compose_receipt_document, get_receipt_page_order
+from template_generate.render_metrics import record_timing
+from template_generate.template_engine import TEMPLATE_ROOT, TEMPLATE_VERSION
+
+# Template fields that change per donation; everything else is fixed per organization
+STAMP_FIELDS = (
+    'receipt_number', 'amount', 'amount_only', 'amount_words', 'donation_date', 'donation_date_iso',
+    'purpose', 'payment_mode', 'payment_details', 'financial_year',
+    'donor_name', 'name', 'donor_address', 'donor_phone', 'donor_email', 'donor_pan',
+)
+MARKER_RE = re.compile(r'QZ(\d\d)QZ')
+# Glyphs kept when the base's fonts are subset: Latin-1 plus common typography and ₹
+STAMP_CHARSET = ''.join(chr(code) for code in range(0x20, 0x7f)) + ''.join(chr(code) for code in range(0xa0, 0x100)) + '–—‘’‚“”„•…₹€'
+STAMP_CHARSET_SET = frozenset(STAMP_CHARSET)
+CONTENTS_RE = re.compile(r'/Contents\s*(\[[^\]]*\]|\d+\s+\d+\s+R)')
+STARTXREF_RE = re.compile(rb'startxref\s+(\d+)\s+%%EOF\s*$')
+
+# Values alone in a centred table cell, by page
+CENTERED_FIELDS = {
+    'cert': {'donation_date_iso', 'donor_name', 'donor_pan', 'amount_only'},
+}
+
+ASSETS_DIR = os.path.join(TEMPLATE_ROOT, 'assets')
+FALLBACK_FONTS = ('OpenSans-Regular.ttf', 'OpenSans-ExtraBold.ttf')  # regular, bold
+FONT_WEIGHTS = (
+    ('extralight', 200), ('ultralight', 200), ('semibold', 600), ('demibold', 600),
+    ('extrabold', 800), ('ultrabold', 800), ('thin', 100), ('light', 300), ('regular', 400),
+    ('normal', 400), ('book', 400), ('medium', 500), ('bold', 700), ('black', 900), ('heavy', 900),
+)
+CLUSTER_GAP = 2.0  # in font sizes: wider gaps separate columns/flex items
+RUN_GAP = 0.1  # in font sizes: wider gaps start a new text run (positioned, not spaced)
+MIN_FIT_SCALE = 0.6
+BASE_CACHE_SIZE = getattr(settings, 'RECEIPT_STAMP_BASE_CACHE_SIZE', 32)
+
+
+class UnstampableValueError(ValueError):
+    """A value has characters the base's fonts cannot draw."""
+
+
+def get_marker(field):
+    return f"QZ{STAMP_FIELDS.index(field):02d}QZ"
+
+
+# ----------------------------------------------------------------------
+# Fonts
+# ----------------------------------------------------------------------
+def normalize_font_name(name):
+    """'ABCDEF+Open-Sans-Ultra-Bold' -> 'opensansultrabold'"""
+    return re.sub(r'[^a-z0-9]', '', name.split('+', 1)[-1].lower())
+
+
+def get_font_weight(name):
+    for word, weight in FONT_WEIGHTS:
+        if word in name:
+            return weight
+    return 400
+
+
+@lru_cache(maxsize=1)
+def get_font_faces(template_version=TEMPLATE_VERSION):
+    """(family, weight, path) for each @font-face in the template stylesheets."""
+    faces = []
+    for filename in sorted(os.listdir(TEMPLATE_ROOT)):
+        if not filename.endswith('.css'):
+            continue
+        css = read_stylesheet(os.path.join(TEMPLATE_ROOT, filename))
+        for selectors, body in RULE_RE.findall(COMMENT_RE.sub('', css)):
+            if not selectors.strip().startswith('@font-face'):
+                continue
+            family = re.search(r'font-family:\s*["\']?([^;"\']+)', body)
+            src = re.search(r'url\(\s*["\']?([^)"\']+)', body)
+            weight = re.search(r'font-weight:\s*(\w+)', body)
+            if not family or not src:
+                continue
+            path = os.path.join(TEMPLATE_ROOT, src.group(1))
+            if os.path.exists(path):
+                weight = weight.group(1) if weight else '400'
+                faces.append((normalize_font_name(family.group(1)), int(weight) if weight.isdigit() else get_font_weight(weight), path))
+    return faces
+
+
+@lru_cache(maxsize=None)
+def resolve_font_file(pdf_font_name):
+    """Template font file for a font name found in a rendered PDF."""
+    name = normalize_font_name(pdf_font_name)
+
+    # Chromium names fonts by their PostScript name, close to the file name (OpenSans-ExtraBold)
+    for filename in sorted(os.listdir(ASSETS_DIR)):
+        if normalize_font_name(os.path.splitext(filename)[0]) == name:
+            return os.path.join(ASSETS_DIR, filename)
+
+    # WeasyPrint names them after the CSS family plus weight (Open-Sans-Ultra-Bold)
+    faces = [face for face in get_font_faces() if name.startswith(face[0])]
+    if faces:
+        family_length = max(len(face[0]) for face in faces)
+        faces = [face for face in faces if len(face[0]) == family_length]
+        weight = get_font_weight(name[family_length:])
+        return min(faces, key=lambda face: abs(face[1] - weight))[2]
+
+    print(f"⚠️ No template font for '{pdf_font_name}', stamping with Open Sans")
+    return os.path.join(ASSETS_DIR, FALLBACK_FONTS[get_font_weight(name) >= 600])
+
+
+@lru_cache(maxsize=None)
+def get_font(path):
+    return pymupdf.Font(fontfile=path)
+
+
+_glyphs = {}
+
+
+def get_glyphs(path, text):
+    """
+    (hex, width) for text in a template font: 2-byte glyph ids as drawn with the
+    Identity-H encoding the base embeds fonts with, and the advance width in ems.
+    """
+    glyphs = _glyphs.setdefault(path, {})
+    hex_ids = []
+    width = 0
+    for char in text:
+        glyph = glyphs.get(char)
+        if glyph is None:
+            font = get_font(path)
+            glyph = glyphs[char] = (f"{font.has_glyph(ord(char)):04x}", font.glyph_advance(ord(char)))
+        hex_ids.append(glyph[0])
+        width += glyph[1]
+    return ''.join(hex_ids), width
+
+
+def get_missing_chars(path, text):
+    """Characters of text that would come out as .notdef boxes in the base's copy of the font."""
+    get_glyphs(path, text)
+    glyphs = _glyphs[path]
+    return sorted({char for char in text if glyphs[char][0] == '0000' or (OPTIMIZE and char not in STAMP_CHARSET_SET)})
+
+
+# ----------------------------------------------------------------------
+# Base pages
+# ----------------------------------------------------------------------
+def get_page_rows(page):
+    """Characters on the page grouped into rows by baseline, each row sorted by x."""
+    chars = []
+    for block in page.get_text('rawdict')['blocks']:
+        for line in block.get('lines', []):
+            if tuple(line['dir']) != (1, 0):
+                continue
+            for span in line['spans']:
+                for char in span['chars']:
+                    chars.append({**char, 'span': span})
+
+    rows = []
+    for char in sorted(chars, key=lambda char: char['origin'][1]):
+        if rows and abs(char['origin'][1] - rows[-1][0]['origin'][1]) <= 1.5:
+            rows[-1].append(char)
+        else:
+            rows.append([char])
+    return [sorted(row, key=lambda char: char['bbox'][0]) for row in rows]
+
+
+def split_clusters(row):
+    """Split a row at wide gaps (table columns, flex items)."""
+    clusters = [[row[0]]]
+    for char in row[1:]:
+        previous = clusters[-1][-1]
+        if char['bbox'][0] - previous['bbox'][2] > CLUSTER_GAP * previous['span']['size']:
+            clusters.append([])
+        clusters[-1].append(char)
+    return clusters
+
+
+def get_segment(chars, field=None):
+    span = chars[0]['span']
+    color = span['color']
+    return {
+        'field': field,
+        'text': ''.join(char['c'] for char in chars),
+        'x': chars[0]['origin'][0],
+        'y': chars[0]['origin'][1],
+        'width': chars[-1]['bbox'][2] - chars[0]['bbox'][0],
+        'font': resolve_font_file(span['font']),
+        'size': span['size'],
+        'color': ((color >> 16) / 255, ((color >> 8) & 255) / 255, (color & 255) / 255),
+        'bold': bool(span['flags'] & 16),
+    }
+
+
+def get_cluster_segments(cluster):
+    """
+    Segments to draw for a cluster holding markers: the fields and any text after
+    the first one. Returns (segments, chars_to_remove).
+    """
+    text = ''.join(char['c'] for char in cluster)
+    markers = list(MARKER_RE.finditer(text))
+    if not markers:
+        return [], []
+
+    segments = []
+    position = markers[0].start()
+    for marker in markers:
+        segments.extend(get_static_segments(cluster[position:marker.start()]))
+        segments.append(get_segment(cluster[marker.start():marker.end()], STAMP_FIELDS[int(marker.group(1))]))
+        position = marker.end()
+    segments.extend(get_static_segments(cluster[position:]))
+    return segments, cluster[markers[0].start():]
+
+
+def get_static_segments(chars):
+    """Text runs that keep one font and natural spacing."""
+    runs = []
+    for char in chars:
+        if runs:
+            previous = runs[-1][-1]
+            same_style = char['span'] is previous['span'] or (
+                char['span']['font'], char['span']['size'], char['span']['color']) == (
+                previous['span']['font'], previous['span']['size'], previous['span']['color'])
+            if same_style and char['bbox'][0] - previous['bbox'][2] <= RUN_GAP * previous['span']['size']:
+                runs[-1].append(char)
+                continue
+        runs.append([char])
+    return [get_segment(run) for run in runs if ''.join(char['c'] for char in run).strip()]
+
+
+def prepare_page(page, page_name):
+    """Find the markers on a rendered page, remove them and return the clusters to stamp."""
+    page_clusters = []
+    width = page.rect.width
+    for row in get_page_rows(page):
+        clusters = split_clusters(row)
+        for index, cluster in enumerate(clusters):
+            segments, removed = get_cluster_segments(cluster)
+            if not segments:
+                continue
+
+            size = segments[0]['size']
+            left = clusters[index - 1][-1]['bbox'][2] + size / 2 if index > 0 else width - max(cluster[-1]['bbox'][2], width - row[0]['bbox'][0])
+            right = clusters[index + 1][0]['bbox'][0] - size / 2 if index + 1 < len(clusters) else max(cluster[-1]['bbox'][2], width - row[0]['bbox'][0])
+            lone_field = len(segments) == 1 and len(removed) == len(cluster)
+            page_clusters.append({
+                'segments': segments,
+                'left': left,
+                'right': right,
+                'centered': lone_field and segments[0]['field'] in CENTERED_FIELDS.get(page_name, ()),
+            })
+
+            for char in removed:
+                x0, y0, x1, y1 = char['bbox']
+                middle = (y0 + y1) / 2
+                page.add_redact_annot(pymupdf.Rect(x0, middle - 0.5, max(x1, x0 + 0.1), middle + 0.5))
+
+    page.apply_redactions(images=pymupdf.PDF_REDACT_IMAGE_NONE, graphics=pymupdf.PDF_REDACT_LINE_ART_NONE)
+    if 'QZ' in page.get_text() or any('QZ' in segment['text'] for cluster in page_clusters for segment in cluster['segments'] if not segment['field']):
+        print(f"⚠️ A stamp marker on page '{page_name}' was split across lines; that field will be left blank")
+    return page_clusters
+
+
+def set_page_contents(doc, page, xrefs):
+    doc.xref_set_key(page.xref, 'Contents', '[' + ' '.join(f"{xref} 0 R" for xref in xrefs) + ']')
+
+
+def add_stream(doc, data):
+    xref = doc.get_new_xref()
+    doc.update_object(xref, '<<>>')
+    doc.update_stream(xref, data)
+    return xref
+
+
+def prepare_stamp_base(pdf_bytes, page_names):
+    """
+    Turn a PDF rendered with markers into a stamp base: a clean PDF with the
+    needed fonts embedded, plus the positions to draw each field at.
+    """
+    doc = pymupdf.open(stream=pdf_bytes, filetype='pdf')
+    pages = []
+    fonts = {}
+    for page in doc:
+        page_name = page_names[page.number] if page.number < len(page_names) else None
+        clusters = prepare_page(page, page_name)
+
+        # Isolate the page's own graphics state so stamped text starts from the identity matrix
+        set_page_contents(doc, page, [add_stream(doc, b"q\n")] + page.get_contents() + [add_stream(doc, b"\nQ\n")])
+
+        for cluster in clusters:
+            for segment in cluster['segments']:
+                alias = fonts.setdefault(segment['font'], f"ST{len(fonts)}")
+                segment['alias'] = alias
+        page_fonts = {segment['font'] for cluster in clusters for segment in cluster['segments']}
+        for path in page_fonts:
+            page.insert_font(fontname=fonts[path], fontfile=path)
+        if page_fonts and OPTIMIZE:
+            # Invisible, off-page use of the charset so font subsetting keeps those glyphs
+            charset = ' '.join(f"/{fonts[path]} 1 Tf <{get_glyphs(path, STAMP_CHARSET)[0]}> Tj" for path in sorted(page_fonts))
+            set_page_contents(doc, page, page.get_contents() + [add_stream(doc, f"q BT 3 Tr 1 0 0 1 -10000 -10000 Tm {charset} ET Q".encode('latin-1'))])
+
+        pages.append({'clusters': clusters, 'matrix': tuple(~page.transformation_matrix)})
+
+    # Subsetting keeps glyph ids, so stamped glyph ids stay valid. No object
+    # streams: the incremental updates add a classic xref section.
+    base_bytes = optimize_document(doc, subset_fonts=OPTIMIZE, object_streams=False)
+
+    # Object numbers change when saving with garbage collection. Keep what an
+    # incremental update needs: each page object (to point it at one more content
+    # stream), the trailer and the offset of the xref table it extends.
+    saved = pymupdf.open(stream=base_bytes, filetype='pdf')
+    for page, layout in zip(saved, pages):
+        page_object = CONTENTS_RE.sub('/Contents[@CONTENTS@]', saved.xref_object(page.xref, compressed=True), count=1)
+        contents = ' '.join(f"{xref} 0 R" for xref in page.get_contents())
+        layout['xref'] = page.xref
+        layout['object'] = page_object.replace('@CONTENTS@', contents + ' @CONTENTS@')
+    return {
+        'pdf': base_bytes,
+        'size': saved.xref_length(),
+        'trailer': re.sub(r'/(Size|Prev)\s*\d+', '', saved.pdf_trailer(compressed=True))[2:-2],
+        'startxref': int(STARTXREF_RE.search(base_bytes).group(1)),
+        'pages': pages,
+    }
+
+
+def build_stamp_base(org_data, donor_type, organization_id, engine):
+    """Render the org's pages with markers in the per-donation fields and prepare the base."""
+    template_data = build_template_data({}, org_data, {})
+    template_data.update({field: get_marker(field) for field in STAMP_FIELDS})
+    html = compose_receipt_document(template_data, donor_type, organization_id)
+    return prepare_stamp_base(engine.render_document(html), get_receipt_page_order(donor_type))
+
+
+_bases = OrderedDict()
+_bases_lock = threading.Lock()
+
+
+def get_stamp_base_key(org_data, donor_type, organization_id, engine):
+    """Identifies a base: org settings, logo/signature versions, templates and base engine."""
+    asset_versions = get_org_asset_versions(organization_id) if organization_id and get_org_asset_versions else {}
+    payload = json.dumps({
+        'org': org_data,
+        'donor_type': (donor_type or 'Individual').lower(),
+        'organization_id': organization_id,
+        'assets': asset_versions,
+        'template': TEMPLATE_VERSION,
+        'engine': engine.get_cache_tag() + get_optimize_tag(),
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def get_stamp_base(org_data, donor_type, organization_id, engine):
+    """The org's base for this donor type, rendered on first use."""
+    key = get_stamp_base_key(org_data, donor_type, organization_id, engine)
+    with _bases_lock:
+        base = _bases.get(key)
+        if base is not None:
+            _bases.move_to_end(key)
+            return base
+
+    start = time.perf_counter()
+    base = build_stamp_base(org_data, donor_type, organization_id, engine)
+    record_timing('stamp_base_build', (time.perf_counter() - start) * 1000)
+    print(f"🧱 Built {donor_type} stamp base for org {organization_id} with {engine.name}")
+
+    with _bases_lock:
+        _bases[key] = base
+        while len(_bases) > BASE_CACHE_SIZE:
+            _bases.popitem(last=False)
+    return base
+
+
+def clear_stamp_bases():
+    with _bases_lock:
+        _bases.clear()
+
+
+# ----------------------------------------------------------------------
+# Stamping
+# ----------------------------------------------------------------------
+def layout_cluster(cluster, values):
+    """
+    (segment, text, x, fontsize) for each segment, shifted and scaled to fit.
+    Raises UnstampableValueError when a value cannot be drawn.
+    """
+    segments = cluster['segments']
+    # Whitespace collapses as it does in HTML (line breaks in addresses have no glyph)
+    texts = [' '.join(str(values.get(segment['field'], '')).split()) if segment['field'] else segment['text'] for segment in segments]
+    for segment, text in zip(segments, texts):
+        if segment['field']:
+            missing = get_missing_chars(segment['font'], text)
+            if missing:
+                raise UnstampableValueError(f"Stamp fonts cannot draw {''.join(missing)!r} in {segment['field']}")
+    widths = [get_glyphs(segment['font'], text)[1] * segment['size'] for segment, text in zip(segments, texts)]
+
+    if cluster['centered']:
+        segment, width = segments[0], widths[0]
+        center = segment['x'] + segment['width'] / 2
+        room = 2 * min(center - cluster['left'], cluster['right'] - center)
+        scale = max(MIN_FIT_SCALE, min(1, room / width)) if width else 1
+        return [(segment, texts[0], center - width * scale / 2, segment['size'] * scale)]
+
+    def place(scale):
+        placed = []
+        shift = 0
+        for segment, text, width in zip(segments, texts, widths):
+            factor = scale if segment['field'] else 1
+            placed.append((segment, text, segment['x'] + shift, segment['size'] * factor))
+            if segment['field']:
+                shift += width * factor - segment['width']
+        end = placed[-1][2] + widths[-1] * (scale if segments[-1]['field'] else 1)
+        return placed, end
+
+    placed, end = place(1)
+    field_width = sum(width for segment, width in zip(segments, widths) if segment['field'])
+    if end > cluster['right'] and field_width:
+        placed, end = place(max(MIN_FIT_SCALE, 1 - (end - cluster['right']) / field_width))
+    return placed
+
+
+def get_text_operators(placed, matrix):
+    operators = []
+    for segment, text, x, fontsize in placed:
+        if not text:
+            continue
+        point = pymupdf.Point(x, segment['y']) * pymupdf.Matrix(matrix)
+        color = ' '.join(f"{channel:.3f}" for channel in segment['color'])
+        style = f"{color} rg"
+        # Faux bold where the page used a synthetic bold of a regular face
+        if segment['bold'] and get_font_weight(normalize_font_name(os.path.basename(segment['font']))) < 600:
+            style += f" {color} RG 2 Tr {fontsize * 0.03:.2f} w"
+        operators.append(
+            f"q BT /{segment['alias']} {fontsize:.2f} Tf {style} 1 0 0 1 {point.x:.2f} {point.y:.2f} Tm "
+            f"<{get_glyphs(segment['font'], text)[0]}> Tj ET Q"
+        )
+    return operators
+
+
+def stamp_receipt(base, values):
+    """
+    Draw one donation's values onto the base. Returns PDF bytes: the base plus an
+    incremental update adding a content stream to each stamped page.
+    """
+    start = time.perf_counter()
+    parts = [base['pdf']]
+    offset = len(base['pdf'])
+    entries = []
+    next_xref = base['size']
+
+    for layout in base['pages']:
+        operators = []
+        for cluster in layout['clusters']:
+            operators.extend(get_text_operators(layout_cluster(cluster, values), layout['matrix']))
+        if not operators:
+            continue
+
+        stream = zlib.compress('\n'.join(operators).encode('latin-1'))
+        stream_xref = next_xref
+        next_xref += 1
+        page_object = layout['object'].replace('@CONTENTS@', f"{stream_xref} 0 R")
+        for xref, data in (
+            (stream_xref, b"%d 0 obj\n<</Length %d/Filter/FlateDecode>>\nstream\n%s\nendstream\nendobj\n" % (stream_xref, len(stream), stream)),
+            (layout['xref'], f"{layout['xref']} 0 obj\n{page_object}\nendobj\n".encode('latin-1')),
+        ):
+            entries.append((xref, offset))
+            parts.append(data)
+            offset += len(data)
+
+    parts.append(b"xref\n" + b"".join(b"%d 1\n%010d 00000 n\r\n" % entry for entry in sorted(entries)))
+    parts.append(b"trailer\n<</Size %d%s/Prev %d>>\nstartxref\n%d\n%%%%EOF\n" % (
+        next_xref, base['trailer'].encode('latin-1'), base['startxref'], offset))
+    pdf_bytes = b"".join(parts)
+    record_timing('stamp', (time.perf_counter() - start) * 1000)
+    return pdf_bytes
+
+
+def generate_receipt_pdf(donor_data, org_data, donation_data, donor_type="Individual", organization_id=None, engine=None):
+    """
+    Generate a receipt by stamping the donation onto the org's base pages
+    (rendered once with ``engine``). Returns PDF bytes.
+    """
+    base = get_stamp_base(org_data, donor_type, organization_id, engine)
+    return stamp_receipt(base, build_template_data(donor_data, org_data, donation_data))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Annual donor statements.
+
+One PDF per donor listing every donation of a financial year (April to March)
+with the receipt number of each, for their 80G claims. The statement is
+rendered from statement.html, composed like a receipt document and printed by
+the first HTML engine in the org's chain (pooled Chromium or WeasyPrint, in a
+render worker when ``RECEIPT_RENDER_WORKERS`` is set). The table flows over as
+many A4 pages as the donations need, with its header repeated on each.
+"""
+import os
+import sys
+
+# Add the backend app path to import settings
+backend_dir = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, backend_dir)
+
+from template_generate.compose import compose_document
+from template_generate.engines import render_document
+from template_generate.pdf_optimize import OPTIMIZE, rewrite_asset_urls
+from template_generate.receipt_document import build_template_data, convert_amount_to_words, get_org_asset_overrides
+from template_generate.template_engine import TEMPLATE_ROOT, render_page
+
+
+def format_statement_date(value):
+    """dd/mm/yyyy from a date/datetime or an ISO date string."""
+    if hasattr(value, 'strftime'):
+        return value.strftime('%d/%m/%Y')
+    value = str(value)[:10]
+    parts = value.split('-')
+    return f"{parts[2]}/{parts[1]}/{parts[0]}" if len(parts) == 3 else value
+
+
+def build_statement_template_data(donor_data, org_data, donations, financial_year, start, end):
+    """
+    Placeholder values for statement.html.
+    donations: dicts with date, receipt_number, payment_mode, purpose and amount.
+    start/end: the financial year's bounds (end exclusive), as from get_financial_year_dates.
+    """
+    template_data = build_template_data(donor_data, org_data, {})
+    total = sum(float(donation.get('amount') or 0) for donation in donations)
+    template_data.update({
+        'financial_year': financial_year,
+        'period_start': format_statement_date(start),
+        'period_end': f"31/03/{end.year}",
+        'donations': [{
+            'date': format_statement_date(donation.get('date', '')),
+            'receipt_number': donation.get('receipt_number') or 'N/A',
+            'payment_mode': donation.get('payment_mode') or 'N/A',
+            'purpose': donation.get('purpose') or 'General Fund',
+            'amount': f"{float(donation.get('amount') or 0):,.2f}",
+        } for donation in donations],
+        'donation_count': len(donations),
+        'total_amount': f"{total:,.2f}",
+        'total_amount_words': convert_amount_to_words(total),
+    })
+    return template_data
+
+
+def build_statement_document(template_data, asset_overrides=None):
+    """Compose the printable HTML document for one statement."""
+    html = render_page('statement', {**template_data, **(asset_overrides or {})})
+    return compose_document([('statement', html)], TEMPLATE_ROOT, title="Donation Statement",
+                            rewrite_css=rewrite_asset_urls if OPTIMIZE else None)
+
+
+def generate_statement_pdf(donor_data, org_data, donations, financial_year, start, end, organization_id=None, org_engine=None, asset_overrides=None):
+    """
+    Render one donor's statement. Returns PDF bytes.
+    Pass ``asset_overrides`` (get_org_asset_overrides) when rendering many
+    statements for one org, so the logo and signature are encoded once.
+    """
+    if asset_overrides is None:
+        asset_overrides = get_org_asset_overrides(organization_id)
+    html = build_statement_document(build_statement_template_data(donor_data, org_data, donations, financial_year, start, end), asset_overrides)
+    pdf_bytes, _ = render_document(html, org_engine)
+    return pdf_bytes
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Precompiled Jinja2 templates for the receipt pages.
+
+receipt.html, cert.html, templateThankYou.html and statement.html use ``{{ placeholder }}``
+fields. They are loaded and compiled once at import, and each render is a
+single pass with HTML autoescaping, so donor-supplied text such as names and
+addresses cannot break the markup.
+
+``TEMPLATE_VERSION`` fingerprints the templates, stylesheets and shared assets
+as loaded, so caches of rendered receipts can tell when the layout changed.
+"""
+import hashlib
+import os
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+# Directory holding the HTML templates, their CSS and the shared assets
+TEMPLATE_ROOT = os.path.abspath(os.path.dirname(__file__))
+
+# Page name -> template file
+PAGE_TEMPLATES = {
+    'receipt': 'receipt.html',
+    'cert': 'cert.html',
+    'thankyou': 'templateThankYou.html',
+}
+
+# Standalone documents, not part of a receipt
+DOCUMENT_TEMPLATES = {
+    'statement': 'statement.html',  # annual donor statement (template_generate/statement.py)
+}
+
+environment = Environment(
+    loader=FileSystemLoader(TEMPLATE_ROOT),
+    autoescape=select_autoescape(['html']),
+    auto_reload=False,
+)
+
+_compiled_pages = {name: environment.get_template(filename) for name, filename in {**PAGE_TEMPLATES, **DOCUMENT_TEMPLATES}.items()}
+
+
+def render_page(name, template_data):
+    """Render one receipt page (or standalone document) to an HTML string."""
+    return _compiled_pages[name].render(template_data)
+
+
+def compute_template_version(root=TEMPLATE_ROOT):
+    """Hash the templates and CSS by content, and the shared assets by name/size/mtime."""
+    digest = hashlib.sha256()
+    for filename in sorted(os.listdir(root)):
+        if filename.endswith(('.html', '.css')):
+            with open(os.path.join(root, filename), 'rb') as f:
+                digest.update(filename.encode('utf-8'))
+                digest.update(f.read())
+    assets_dir = os.path.join(root, 'assets')
+    if os.path.isdir(assets_dir):
+        for filename in sorted(os.listdir(assets_dir)):
+            stat = os.stat(os.path.join(assets_dir, filename))
+            digest.update(f"{filename}:{stat.st_size}:{int(stat.st_mtime)}".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+TEMPLATE_VERSION = compute_template_version()
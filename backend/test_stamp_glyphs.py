@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Test that stamp mode refuses values its fonts cannot draw (instead of issuing a
+receipt with .notdef boxes) and that the engine chain then falls back to the
+next engine.
+"""
+
+import os
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent))
+
+import pymupdf
+
+from template_generate import engines
+from template_generate.stamp import ASSETS_DIR, FALLBACK_FONTS, UnstampableValueError, get_marker, prepare_stamp_base, stamp_receipt
+
+FONT_PATH = os.path.join(ASSETS_DIR, FALLBACK_FONTS[0])
+
+
+def build_base():
+    """A one-page stamp base with the donor name and address fields, in Open Sans."""
+    doc = pymupdf.open()
+    page = doc.new_page()
+    page.insert_font(fontname='opensans', fontfile=FONT_PATH)
+    page.insert_text((72, 100), f"Dearest {get_marker('donor_name')},", fontname='opensans', fontsize=12)
+    page.insert_text((72, 130), get_marker('donor_address'), fontname='opensans', fontsize=10)
+    return prepare_stamp_base(doc.tobytes(), ['receipt'])
+
+
+def test_latin_values_are_stamped():
+    base = build_base()
+    pdf_bytes = stamp_receipt(base, {'donor_name': 'Ananya Rao', 'donor_address': '12 MG Road\nBengaluru'})
+    text = pymupdf.open(stream=pdf_bytes, filetype='pdf')[0].get_text()
+    print(f"✅ Stamped text: {text.split()}")
+    assert 'Ananya' in text and 'Rao,' in text
+    assert 'Bengaluru' in text
+
+
+def test_non_latin_donor_name_is_refused():
+    base = build_base()
+    try:
+        stamp_receipt(base, {'donor_name': 'अनन्या राव', 'donor_address': 'Pune'})
+    except UnstampableValueError as e:
+        print(f"✅ Refused: {e}")
+        return
+    raise AssertionError("A Devanagari donor name was stamped with missing glyphs")
+
+
+def test_engine_chain_falls_back():
+    base = build_base()
+
+    class StampStub(engines.ReceiptEngine):
+        name = 'stamp-test'
+        optimize_output = False
+
+        def render(self, donor_data, org_data, donation_data, donor_type="Individual", organization_id=None):
+            return stamp_receipt(base, {'donor_name': donor_data['name'], 'donor_address': donor_data['address']})
+
+    class HtmlStub(engines.ReceiptEngine):
+        name = 'html-test'
+        optimize_output = False
+
+        def render(self, donor_data, org_data, donation_data, donor_type="Individual", organization_id=None):
+            return b'%PDF-html'
+
+    chain = [StampStub(), HtmlStub()]
+    _, engine_name = engines.render_receipt({'name': 'अनन्या राव', 'address': 'Pune'}, {}, {}, chain=chain)
+    assert engine_name == 'html-test'
+    _, engine_name = engines.render_receipt({'name': 'Ananya Rao', 'address': 'Pune'}, {}, {}, chain=chain)
+    assert engine_name == 'stamp-test'
+    print("✅ Non-Latin names fall back to the next engine")
+
+
+if __name__ == "__main__":
+    test_latin_values_are_stamped()
+    test_non_latin_donor_name_is_refused()
+    test_engine_chain_falls_back()
@@ -0,0 +1,32 @@
+-- Transactional outbox of donor emails (see backend/app/services/email_outbox.py).
+-- Rows are written in the same transaction as the donation and sent by a dispatcher.
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    organization_id UUID REFERENCES organizations(id) NOT NULL,
+    donation_id UUID REFERENCES donations(id) ON DELETE CASCADE NOT NULL,
+    kind TEXT NOT NULL DEFAULT 'receipt' CHECK (kind IN ('receipt')),
+    to_email TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'sending', 'sent', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 8,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT TIMEZONE('utc'::text, NOW()),
+    locked_until TIMESTAMP,
+    locked_by TEXT,
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT TIMEZONE('utc'::text, NOW()),
+    updated_at TIMESTAMP NOT NULL DEFAULT TIMEZONE('utc'::text, NOW()),
+    sent_at TIMESTAMP
+);
+
+-- At most one pending email of each kind per donation
+CREATE UNIQUE INDEX IF NOT EXISTS uq_email_outbox_pending
+ON email_outbox (donation_id, kind)
+WHERE status IN ('queued', 'sending');
+
+-- Dispatcher polling: due queued emails and expired leases
+CREATE INDEX IF NOT EXISTS idx_email_outbox_due
+ON email_outbox (next_attempt_at)
+WHERE status IN ('queued', 'sending');
+
+CREATE INDEX IF NOT EXISTS idx_email_outbox_organization
+ON email_outbox (organization_id, created_at);
@@ -0,0 +1,32 @@
+-- Durable queue of receipt render/email jobs (see backend/app/services/receipt_jobs.py)
+CREATE TABLE IF NOT EXISTS receipt_jobs (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    organization_id UUID REFERENCES organizations(id) NOT NULL,
+    donation_id UUID REFERENCES donations(id) ON DELETE CASCADE NOT NULL,
+    job_type TEXT NOT NULL CHECK (job_type IN ('render', 'email', 'render+email')),
+    status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'succeeded', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    run_after TIMESTAMP NOT NULL DEFAULT TIMEZONE('utc'::text, NOW()),
+    locked_until TIMESTAMP,
+    locked_by TEXT,
+    last_error TEXT,
+    result JSONB DEFAULT '{}'::jsonb,
+    created_at TIMESTAMP NOT NULL DEFAULT TIMEZONE('utc'::text, NOW()),
+    updated_at TIMESTAMP NOT NULL DEFAULT TIMEZONE('utc'::text, NOW()),
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- At most one queued/running job of each type per donation
+CREATE UNIQUE INDEX IF NOT EXISTS uq_receipt_jobs_active
+ON receipt_jobs (donation_id, job_type)
+WHERE status IN ('queued', 'running');
+
+-- Dispatcher polling: due queued jobs and expired leases
+CREATE INDEX IF NOT EXISTS idx_receipt_jobs_due
+ON receipt_jobs (run_after)
+WHERE status IN ('queued', 'running');
+
+CREATE INDEX IF NOT EXISTS idx_receipt_jobs_organization
+ON receipt_jobs (organization_id, created_at);
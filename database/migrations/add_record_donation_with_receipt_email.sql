@@ -0,0 +1,30 @@
+-- Insert a donation and queue its receipt email in one transaction (see backend/modules/supabase_utils.py).
+-- PostgREST runs each request in its own transaction, so the Streamlit app calls this over RPC
+-- instead of inserting the donation and the email_outbox row in two requests.
+CREATE OR REPLACE FUNCTION record_donation_with_receipt_email(donation JSONB, to_email TEXT)
+RETURNS SETOF donations
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    inserted donations;
+BEGIN
+    INSERT INTO donations (
+        donor_id, amount, date, purpose, payment_mode, payment_details,
+        is_recurring, recurring_frequency, start_date, next_due_date, recurring_status,
+        linked_to_recurring, recurring_id, is_scheduled_payment, last_paid_date,
+        organization_id, receipt_number, receipt_path
+    )
+    SELECT
+        d.donor_id, d.amount, d.date, d.purpose, d.payment_mode, COALESCE(d.payment_details, '{}'::jsonb),
+        COALESCE(d.is_recurring, FALSE), d.recurring_frequency, d.start_date, d.next_due_date, d.recurring_status,
+        COALESCE(d.linked_to_recurring, FALSE), d.recurring_id, COALESCE(d.is_scheduled_payment, FALSE), d.last_paid_date,
+        d.organization_id, d.receipt_number, d.receipt_path
+    FROM jsonb_populate_record(NULL::donations, donation) AS d
+    RETURNING * INTO inserted;
+
+    INSERT INTO email_outbox (organization_id, donation_id, kind, to_email)
+    VALUES (inserted.organization_id, inserted.id, 'receipt', to_email);
+
+    RETURN NEXT inserted;
+END;
+$$;